@@ -1,46 +1,131 @@
 from dataclasses import dataclass
 from typing import Any
+from typing import ClassVar
 from typing import Optional
 
 from tianshou.data import ReplayBuffer
 
+from distrib_l2r.shm import SharedRingRef
+from distrib_l2r.utils import MsgKind
+
 
 @dataclass
 class BaseMsg:
-    """A base message"""
+    """A base message
+
+    kind and policy_version are written into the frame header by send_data.
+    sender optionally identifies the worker that sent the message.
+    """
 
     data: Optional[Any] = None
+    sender: Optional[str] = None
+    kind: ClassVar[int] = MsgKind.OTHER
+
+    @property
+    def policy_version(self) -> Optional[int]:
+        return None
 
 
 @dataclass
 class InitMsg(BaseMsg):
     """Message a worker sends on startup"""
 
-    pass
+    kind: ClassVar[int] = MsgKind.INIT
 
 
 @dataclass
 class BufferMsg(BaseMsg):
-    """A replay buffer message sent from a worker"""
+    """A replay buffer message sent from a worker
+
+    policy_id is the version of the policy that generated the transitions
+    """
+
+    policy_id: Optional[int] = None
 
     def __post_init__(self):
         # assert isinstance(self.data, ReplayBuffer)
         assert True
 
+    @property
+    def kind(self) -> int:
+        if isinstance(self.data, SharedRingRef):
+            return MsgKind.BUFFER_REF
+        return MsgKind.BUFFER
+
+    @property
+    def policy_version(self) -> Optional[int]:
+        return self.policy_id
+
 
 @dataclass
 class EvalResultsMsg(BaseMsg):
-    """An evaluation results message sent from a worker"""
+    """An evaluation results message sent from a worker
+
+    policy_id is the version of the policy that was evaluated
+    """
+
+    policy_id: Optional[int] = None
+    kind: ClassVar[int] = MsgKind.EVAL
 
     def __post_init__(self):
         assert isinstance(self.data, dict)
 
+    @property
+    def policy_version(self) -> Optional[int]:
+        return self.policy_id
+
 
 @dataclass
 class PolicyMsg(BaseMsg):
     """An RL policy message sent from a learner"""
 
+    kind: ClassVar[int] = MsgKind.POLICY
+
     def __post_init__(self):
         assert isinstance(self.data, dict)
         assert "policy_id" in self.data
         assert "policy" in self.data
+
+    @property
+    def policy_version(self) -> Optional[int]:
+        return self.data["policy_id"]
+
+
+@dataclass
+class ActRequestMsg(BaseMsg):
+    """An encoded observation a worker asks the learner to act on"""
+
+    kind: ClassVar[int] = MsgKind.ACT
+
+    def __post_init__(self):
+        assert isinstance(self.data, dict)
+        assert "obs" in self.data
+        assert "deterministic" in self.data
+
+
+@dataclass
+class ActionMsg(BaseMsg):
+    """An action computed by the learner's inference server"""
+
+    kind: ClassVar[int] = MsgKind.ACTION
+
+    def __post_init__(self):
+        assert isinstance(self.data, dict)
+        assert "action" in self.data
+        assert "policy_id" in self.data
+
+    @property
+    def policy_version(self) -> Optional[int]:
+        return self.data["policy_id"]
+
+
+@dataclass
+class RetryMsg(BaseMsg):
+    """Reply from an overloaded learner: the request was dropped and should be
+    sent again after ``retry_after`` seconds"""
+
+    kind: ClassVar[int] = MsgKind.RETRY
+
+    def __post_init__(self):
+        assert isinstance(self.data, dict)
+        assert "retry_after" in self.data
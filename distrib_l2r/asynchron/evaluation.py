@@ -0,0 +1,175 @@
+"""Evaluation bookkeeping on the learner, kept off the request handler threads."""
+
+import collections
+import logging
+import math
+import numbers
+import queue
+import threading
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import time
+
+
+class EvalAggregator:
+    """Aggregates evaluation results from workers per policy version and flushes
+    summary statistics to loggers in batches from a background thread.
+
+    Args:
+        loggers: objects with a ``log(dict)`` method, e.g. a ``WanDBLogger``
+        flush_interval: seconds between flushes
+        keep_versions: the number of most recent policy versions to keep results for
+    """
+
+    def __init__(
+        self,
+        loggers: List[Any],
+        flush_interval: float = 30.0,
+        keep_versions: int = 10,
+    ) -> None:
+        self.loggers = loggers
+        self.flush_interval = flush_interval
+        self.keep_versions = keep_versions
+
+        self.results = collections.OrderedDict()
+        self._pending = queue.Queue()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, result: Dict[str, Any], policy_version: Optional[int]) -> None:
+        """Queue an evaluation result. Never blocks."""
+        self._pending.put((policy_version, result))
+
+    def stats(self, policy_version: Optional[int]) -> Dict[str, float]:
+        """Summary statistics of the results received for a policy version"""
+        with self._lock:
+            results = list(self.results.get(policy_version, []))
+
+        stats = {"eval/policy_version": policy_version, "eval/episodes": len(results)}
+        keys = {k for r in results for k, v in r.items() if _is_number(v)}
+        for key in sorted(keys):
+            values = [float(r[key]) for r in results if _is_number(r.get(key))]
+            mean = sum(values) / len(values)
+            var = sum((v - mean) ** 2 for v in values) / len(values)
+            stats[f"eval/{key}/mean"] = mean
+            stats[f"eval/{key}/std"] = math.sqrt(var)
+            stats[f"eval/{key}/min"] = min(values)
+            stats[f"eval/{key}/max"] = max(values)
+        return stats
+
+    def flush(self) -> None:
+        """Ingest queued results and log every policy version that changed"""
+        while True:
+            try:
+                version, result = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.results.setdefault(version, []).append(result)
+                while len(self.results) > self.keep_versions:
+                    self.results.popitem(last=False)
+            self._dirty.add(version)
+
+        dirty, self._dirty = self._dirty, set()
+        for version in dirty:
+            stats = self.stats(version)
+            for logger in self.loggers:
+                try:
+                    logger.log(stats)
+                except Exception:
+                    logging.exception("Failed to log evaluation results")
+
+    def close(self) -> None:
+        """Stop the background thread after a final flush"""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+
+class EvalScheduler:
+    """Hands out exactly ``episodes`` evaluation episodes for every
+    ``eval_every``-th policy version, one per worker request, and sends every
+    other request back to training.
+
+    Versions are evaluated oldest first. An assigned episode that is not reported
+    back within ``timeout`` seconds (e.g. its worker crashed) is handed out again.
+
+    Args:
+        eval_every: evaluate every policy version divisible by this
+        episodes: the number of evaluation episodes per evaluated version
+        timeout: seconds after which an unreported episode is reassigned
+        max_pending: the number of versions that may await evaluation at once.
+          Older versions are skipped when evaluation falls behind.
+    """
+
+    def __init__(
+        self,
+        eval_every: int = 10,
+        episodes: int = 5,
+        timeout: float = 600.0,
+        max_pending: int = 2,
+    ) -> None:
+        self.eval_every = eval_every
+        self.episodes = episodes
+        self.timeout = timeout
+        self.pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+
+    def publish(self, policy_version: int, weights: Any) -> None:
+        """Offer a new policy version for evaluation"""
+        if policy_version % self.eval_every:
+            return
+        with self._lock:
+            self.pending.append(
+                {
+                    "version": policy_version,
+                    "weights": weights,
+                    "remaining": self.episodes,
+                    "outstanding": collections.deque(),
+                }
+            )
+
+    def assign(self) -> Optional[Tuple[int, Any]]:
+        """Get an evaluation episode to run, if any
+
+        Returns:
+            a tuple of (policy version, weights) to evaluate, or None to train
+        """
+        now = time.time()
+        with self._lock:
+            for entry in self.pending:
+                outstanding = entry["outstanding"]
+                while outstanding and now - outstanding[0] > self.timeout:
+                    outstanding.popleft()
+                    entry["remaining"] += 1
+
+                if entry["remaining"]:
+                    entry["remaining"] -= 1
+                    outstanding.append(now)
+                    return entry["version"], entry["weights"]
+        return None
+
+    def complete(self, policy_version: Optional[int]) -> None:
+        """Record that an evaluation episode of a policy version was reported"""
+        with self._lock:
+            for entry in list(self.pending):
+                if entry["version"] != policy_version:
+                    continue
+                if entry["outstanding"]:
+                    entry["outstanding"].popleft()
+                if not entry["remaining"] and not entry["outstanding"]:
+                    self.pending.remove(entry)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
@@ -0,0 +1,152 @@
+"""Centralized acting: workers send encoded observations to the learner, which
+batches them across workers and runs a single policy forward pass per batch."""
+
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from copy import deepcopy
+from typing import Any
+from typing import Dict
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from distrib_l2r.api import ActRequestMsg
+from distrib_l2r.utils import send_data
+from src.constants import DEVICE
+from src.utils.utils import ActionSample
+
+
+class BatchedInferenceServer:
+    """Batches acting requests from many handler threads into one forward pass.
+
+    The server acts with its own copy of the actor-critic, refreshed by ``load``
+    whenever the learner publishes a new policy, so gradient updates never race
+    with inference.
+
+    Args:
+        actor_critic: the learner's actor-critic, copied on construction
+        max_batch_size: the largest number of observations per forward pass
+        deadline: seconds to wait for more requests after the first one arrives
+    """
+
+    def __init__(
+        self,
+        actor_critic: torch.nn.Module,
+        max_batch_size: int = 64,
+        deadline: float = 0.002,
+    ) -> None:
+        self.actor_critic = deepcopy(actor_critic).to(DEVICE)
+        self.max_batch_size = max_batch_size
+        self.deadline = deadline
+        self.policy_id = 0
+
+        self.requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def load(self, state_dict: Dict[str, torch.Tensor], policy_id: int) -> None:
+        """Swap in a new policy version"""
+        with self._lock:
+            self.actor_critic.load_state_dict(state_dict)
+            self.policy_id = policy_id
+
+    def act(self, obs: torch.Tensor, deterministic: bool = False) -> Tuple[Any, int]:
+        """Block until the batch containing ``obs`` has been evaluated
+
+        Returns:
+            a tuple of (action, policy version that produced it)
+        """
+        future = Future()
+        self.requests.put((obs, deterministic, future))
+        return future.result()
+
+    def _serve(self) -> None:
+        """Collect requests until the batch is full or the deadline passes"""
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.deadline
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch: list) -> None:
+        """Evaluate a batch, with one forward pass per acting mode present"""
+        with self._lock:
+            for deterministic in (False, True):
+                group = [r for r in batch if r[1] == deterministic]
+                if not group:
+                    continue
+                try:
+                    obs = torch.cat(
+                        [torch.as_tensor(r[0]).float().reshape(1, -1) for r in group]
+                    ).to(DEVICE)
+                    actions = self.actor_critic.act(obs, deterministic)
+                    actions = np.asarray(actions).reshape(len(group), -1)
+                except Exception as e:
+                    logging.exception("Batched inference failed")
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+
+                for (_, _, future), action in zip(group, actions):
+                    future.set_result((action, self.policy_id))
+
+
+class RemoteActor:
+    """Stands in for a worker's agent, acting through the learner's inference
+    server over one persistent connection.
+
+    Args:
+        learner_address: the (ip, port) of the learner
+    """
+
+    def __init__(self, learner_address: Tuple[str, int]) -> None:
+        self.sock = socket.create_connection(learner_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.deterministic = False
+        self.policy_id = None
+
+    def select_action(self, obs: torch.Tensor) -> ActionSample:
+        """Get an action for an encoded observation from the learner
+
+        Args:
+            obs (torch.Tensor): Encoded observation.
+
+        Returns:
+            ActionSample: Action object.
+        """
+        response = send_data(
+            data=ActRequestMsg(
+                data={"obs": obs.detach().cpu(), "deterministic": self.deterministic}
+            ),
+            sock=self.sock,
+            reply=True,
+        )
+        self.policy_id = response.data["policy_id"]
+
+        action_obj = ActionSample()
+        action_obj.action = response.data["action"]
+        return action_obj
+
+    def register_reset(self, obs):
+        """Handle reset of episode."""
+        pass
+
+    def load_model(self, path):
+        """Weights stay on the learner, so there is nothing to load."""
+        pass
+
+    def close(self) -> None:
+        self.sock.close()
@@ -1,7 +1,8 @@
 import logging
 import queue
-import random
+from concurrent.futures import ThreadPoolExecutor
 import socketserver
+import time
 from typing import Any
 from typing import Callable
 from typing import Dict
@@ -14,64 +15,138 @@ from src.config.yamlize import create_configurable, NameToSourcePath, yamlize
 from src.loggers.WanDBLogger import WanDBLogger
 
 
+from distrib_l2r.api import ActionMsg
 from distrib_l2r.api import BufferMsg
 from distrib_l2r.api import InitMsg
 from distrib_l2r.api import EvalResultsMsg
 from distrib_l2r.api import PolicyMsg
-from distrib_l2r.utils import receive_data
+from distrib_l2r.api import RetryMsg
+from distrib_l2r.asynchron.evaluation import EvalAggregator
+from distrib_l2r.asynchron.evaluation import EvalScheduler
+from distrib_l2r.asynchron.inference import BatchedInferenceServer
+from distrib_l2r.asynchron.pool import BoundedThreadPoolMixIn
+from distrib_l2r.asynchron.pool import ByteBudget
+from distrib_l2r.asynchron.staleness import PolicyLagTracker
+from distrib_l2r.compression import codec_stats
+from distrib_l2r.metrics import MetricsRegistry
+from distrib_l2r.metrics import MetricsServer
+from distrib_l2r.quantize import pack_policy
+from distrib_l2r.shm import PolicySlot
+from distrib_l2r.shm import SharedRingRef
+from distrib_l2r.shm import TransitionRing
+from distrib_l2r.utils import Frame
+from distrib_l2r.utils import MsgKind
+from distrib_l2r.utils import discard_exactly
+from distrib_l2r.utils import receive_frame
+from distrib_l2r.utils import receive_frame_header
+from distrib_l2r.utils import recv_exactly
 from distrib_l2r.utils import send_data
+from distrib_l2r.utils import traffic_stats
 
 
 class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
-    """Request handler thread created for every request"""
+    """Request handler run on the server's handler pool for every connection"""
 
     def handle(self) -> None:
-        """ReplayBuffers are not thread safe - pass data via thread-safe queues"""
-        msg = receive_data(self.request)
+        """ReplayBuffers are not thread safe - pass data via thread-safe queues.
+
+        Frames are routed by the kind in their header. Buffers are decoded on the
+        server's ingest pool, so this thread replies without unpickling them.
+        Payloads are only read once they fit into the server's byte budget.
+        """
+        frame, size = receive_frame_header(self.request)
+
+        # Acting requests keep the connection open for the rest of the episode,
+        # so they are served on a dedicated thread rather than a pool thread
+        if frame.kind == MsgKind.ACT:
+            frame.payload = recv_exactly(size=size, sock=self.request)
+            self.server.detach(self.request, self.serve_actions, frame)
+            return
+
+        # Overloaded: drop the payload and ask the worker to send it again later
+        if not self.server.byte_budget.try_acquire(size):
+            discard_exactly(size=size, sock=self.request)
+            self.server.metrics.inc("frames_deferred_total")
+            send_data(
+                data=RetryMsg(data={"retry_after": self.server.retry_after}),
+                sock=self.request,
+                accept=frame.accept,
+            )
+            return
+
+        # Buffers hold their bytes until the ingest pool has decoded them; reply
+        # clears this once a buffer is handed to the pool
+        self.admitted = size
+        try:
+            frame.payload = recv_exactly(size=size, sock=self.request)
+            self.reply(frame, size)
+        finally:
+            self.server.byte_budget.release(self.admitted)
+
+    def reply(self, frame: Frame, size: int) -> None:
+        """Handle an admitted frame and reply with an up-to-date policy"""
+        # Co-located workers pass ring references and read policies from shared
+        # memory, so their replies do not need to carry weights
+        colocated = (
+            self.server.policy_slot is not None and frame.kind == MsgKind.BUFFER_REF
+        )
 
         # Received a replay buffer from a worker
-        # Add this to buff
-        if isinstance(msg, BufferMsg):
+        # Hand it off to be decoded and added to the buffer queue
+        if frame.kind in (MsgKind.BUFFER, MsgKind.BUFFER_REF):
             logging.info("Received replay buffer")
-            self.server.buffer_queue.put(msg.data)
+            self.server.metrics.inc("buffers_received_total")
+            self.server.ingest_pool.submit(self.server.ingest, frame, size)
+            self.admitted = 0
 
         # Received an init message from a worker
         # Immediately reply with the most up-to-date policy
-        elif isinstance(msg, InitMsg):
+        elif frame.kind == MsgKind.INIT:
             logging.info("Received init message")
+            self.server.worker_seen(frame.decode().sender)
 
         # Received evaluation results from a worker
-        elif isinstance(msg, EvalResultsMsg):
+        elif frame.kind == MsgKind.EVAL:
+            msg = frame.decode()
+            self.server.worker_seen(msg.sender)
             logging.warn("Received evaluation results message")
             logging.warn(msg.data)
-            self.server.wandb_logger.eval_log(
-                (
-                    msg.data["reward"],
-                    msg.data["total_distance"],
-                    msg.data["total_time"],
-                    msg.data["num_infractions"],
-                    msg.data["average_speed_kph"],
-                    msg.data["average_displacement_error"],
-                    msg.data["trajectory_efficiency"],
-                    msg.data["trajectory_admissibility"],
-                    msg.data["movement_smoothness"],
-                    msg.data["timestep/sec"],
-                    msg.data["laps_completed"],
-                )
-            )
+            self.server.eval_aggregator.put(msg.data, frame.policy_version)
+            self.server.eval_scheduler.complete(frame.policy_version)
 
         # unexpected
         else:
-            logging.warning(f"Received unexpected data: {type(msg)}")
+            logging.warning(f"Received unexpected frame kind: {frame.kind}")
             return
 
         # Reply to the request with an up-to-date policy
-        send_data(data=PolicyMsg(data=self.server.get_agent_dict()), sock=self.request)
-
+        send_data(
+            data=PolicyMsg(data=self.server.get_agent_dict(with_weights=not colocated)),
+            sock=self.request,
+            accept=frame.accept,
+        )
 
+    def serve_actions(self, frame: Frame) -> None:
+        """Answer acting requests on this connection until the worker closes it"""
+        try:
+            while True:
+                msg = frame.decode()
+                action, policy_id = self.server.inference.act(
+                    msg.data["obs"], msg.data["deterministic"]
+                )
+                send_data(
+                    data=ActionMsg(data={"action": action, "policy_id": policy_id}),
+                    sock=self.request,
+                    accept=frame.accept,
+                )
+                frame = receive_frame(self.request)
+        except OSError:
+            pass
+        finally:
+            self.server.shutdown_request(self.request)
 
 
-class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
+class AsyncLearningNode(BoundedThreadPoolMixIn, socketserver.TCPServer):
     """A multi-threaded, offline, off-policy reinforcement learning server
 
     Args:
@@ -80,10 +155,30 @@ class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
         batch_size: the batch size for gradient updates
         epochs: the number of buffers to receive before concluding learning
         server_address: the address the server runs on
-        eval_freq: the likelihood of responding to a worker to eval instead of train
+        eval_every: evaluate every policy version divisible by this
+        eval_episodes: the number of evaluation episodes run per evaluated version
         save_func: a function for saving which is called while learning with
           parameters `epoch` and `policy`
         save_freq: the frequency, in epochs, to save
+        policy_slot_name: if set, also publish policies to a shared memory slot of
+          this name for workers on the same host
+        max_policy_lag: the largest accepted difference between the learner's policy
+          version and the version that generated a buffer. None accepts everything.
+        stale_policy: "drop" or "downweight" buffers beyond max_policy_lag
+        decode_workers: the number of threads decoding received buffers
+        policy_broadcast: "full" to send the whole actor-critic state dict,
+          "fp32", "fp16" or "int8" to send only the policy subnetwork in that
+          precision, or "onnx" to send an ONNX export of it for workers acting
+          with onnxruntime
+        central_inference: act for workers on the learner, batching their
+          observations. Replies then only carry weights for evaluations.
+        metrics_port: if set, serve Prometheus metrics on this port
+        handler_threads: the number of threads handling requests
+        max_pending_connections: connections beyond this many queued or in
+          progress are closed immediately
+        max_bytes_in_flight: the payload bytes that may be received or awaiting
+          decoding at once. Frames beyond it get a ``RetryMsg``.
+        retry_after: seconds overloaded workers are asked to wait before retrying
     """
 
     def __init__(
@@ -94,18 +189,35 @@ class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
         epochs: int = 500, # Originally 500
         buffer_size: int = 1_000_000, # Originally 1M
         server_address: Tuple[str, int] = ("0.0.0.0", 4444),
-        eval_prob: float = 0.20,
+        eval_every: int = 10,
+        eval_episodes: int = 5,
         save_func: Optional[Callable] = None,
         save_freq: Optional[int] = None,
         api_key: str = "",
+        policy_slot_name: Optional[str] = None,
+        max_policy_lag: Optional[int] = None,
+        stale_policy: str = "drop",
+        decode_workers: int = 2,
+        policy_broadcast: str = "full",
+        central_inference: bool = False,
+        metrics_port: Optional[int] = None,
+        handler_threads: int = 16,
+        max_pending_connections: int = 256,
+        max_bytes_in_flight: int = 256 * 2**20,
+        retry_after: float = 1.0,
     ) -> None:
 
         super().__init__(server_address, ThreadedTCPRequestHandler)
+        self.init_pool(handler_threads, max_pending_connections)
+        self.byte_budget = ByteBudget(max_bytes_in_flight)
+        self.retry_after = retry_after
 
         self.update_steps = update_steps
         self.batch_size = batch_size
         self.epochs = epochs
-        self.eval_prob = eval_prob
+        self.eval_scheduler = EvalScheduler(
+            eval_every=eval_every, episodes=eval_episodes
+        )
 
         # Create a replay buffer
         self.buffer_size = buffer_size
@@ -119,23 +231,126 @@ class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
 
         # The bytes of the policy to reply to requests with
 
-        self.updated_agent = {k: v.cpu() for k, v in self.agent.state_dict().items()}
+        # Packed once per version, rather than once per reply, and kept together
+        # with its version so that replies never pair one with the other's weights
+        self.policy_broadcast = policy_broadcast
+        state_dict = self.policy_state_dict()
+        self.updated_agent = (self.agent_id, self.pack_broadcast(state_dict))
 
-        # A thread-safe policy queue to avoid blocking while learning. This marginally
-        # increases off-policy error in order to improve throughput.
+        # A thread-safe queue of (version, packed policy) to avoid blocking while
+        # learning. This marginally increases off-policy error in order to improve
+        # throughput.
         self.agent_queue = queue.Queue(maxsize=1)
 
-        # A queue of buffers that have been received but not yet added to the learner's
-        # main replay buffer
+        # Weights never leave the learner when it acts for the workers
+        self.inference = None
+        if central_inference:
+            self.inference = BatchedInferenceServer(self.agent.actor_critic)
+            self.inference.load(state_dict, policy_id=self.agent_id)
+
+        # Shared memory policy slot and the rings of co-located workers
+        self.policy_slot = None
+        self.rings = {}
+        if policy_slot_name:
+            self.policy_slot = PolicySlot.create(policy_slot_name, state_dict)
+            self.policy_slot.write(state_dict, version=self.agent_id)
+
+        # A queue of (policy version, buffer) that have been received but not yet
+        # added to the learner's main replay buffer
         self.buffer_queue = queue.LifoQueue()
+        self.lag_tracker = PolicyLagTracker(
+            max_lag=max_policy_lag, stale_policy=stale_policy
+        )
+
+        # Received buffers are decoded here rather than on the handler threads
+        self.ingest_pool = ThreadPoolExecutor(
+            max_workers=decode_workers, thread_name_prefix="ingest"
+        )
+
+        self.metrics = self.create_metrics()
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, ("0.0.0.0", metrics_port))
 
         self.wandb_logger = WanDBLogger(api_key=api_key, project_name="test-project")
+
+        # Evaluation results are aggregated and logged off the handler threads
+        self.eval_aggregator = EvalAggregator(loggers=[self.wandb_logger])
         # Save function, called optionally
         self.save_func = save_func
         self.save_freq = save_freq
 
-    def get_agent_dict(self) -> Dict[str, Any]:
-        """Get the most up-to-date version of the policy without blocking"""
+    def create_metrics(self) -> MetricsRegistry:
+        """Declare the learner's metrics"""
+        metrics = MetricsRegistry()
+        metrics.counter(
+            "buffers_received_total", "Buffers received from workers", rate=True
+        )
+        metrics.counter(
+            "transitions_ingested_total",
+            "Transitions added to the replay buffer",
+            rate=True,
+        )
+        metrics.counter("gradient_updates_total", "Agent updates", rate=True)
+        metrics.counter(
+            "frames_deferred_total", "Frames answered with a retry while overloaded"
+        )
+        metrics.counter(
+            "connections_refused_total",
+            "Connections closed because too many were pending",
+            fn=lambda: self.connections_refused,
+        )
+        metrics.gauge(
+            "bytes_in_flight",
+            "Payload bytes being received or awaiting decoding",
+            fn=lambda: self.byte_budget.in_flight,
+        )
+        metrics.counter(
+            "bytes_in_total", "Bytes received", fn=lambda: traffic_stats.bytes_in
+        )
+        metrics.counter(
+            "bytes_out_total", "Bytes sent", fn=lambda: traffic_stats.bytes_out
+        )
+        metrics.gauge(
+            "buffer_queue_depth",
+            "Buffers received but not yet ingested",
+            fn=self.buffer_queue.qsize,
+        )
+        metrics.gauge(
+            "policy_version", "Latest policy version", fn=lambda: self.agent_id
+        )
+        metrics.gauge(
+            "policy_lag_mean",
+            "Mean lag of ingested buffers, in policy versions",
+            fn=lambda: self.lag_tracker.summary()["policy_lag/mean"],
+        )
+        metrics.gauge(
+            "policy_lag_p90",
+            "90th percentile lag of ingested buffers, in policy versions",
+            fn=lambda: self.lag_tracker.percentile(90),
+        )
+        metrics.gauge(
+            "worker_last_seen_timestamp_seconds",
+            "Unix time each worker was last heard from",
+        )
+        metrics.histogram("sample_batch_seconds", "Replay buffer sampling latency")
+        metrics.histogram("update_seconds", "Agent update latency")
+        return metrics
+
+    def worker_seen(self, worker_id: Optional[str]) -> None:
+        """Record that a worker was heard from"""
+        if worker_id is not None:
+            self.metrics.set(
+                "worker_last_seen_timestamp_seconds", time.time(), worker=worker_id
+            )
+
+    def get_agent_dict(self, with_weights: bool = True) -> Dict[str, Any]:
+        """Get the most up-to-date version of the policy without blocking
+
+        Args:
+            with_weights: include the policy weights. Co-located workers read them
+              from the shared memory slot instead.
+        """
         if not self.agent_queue.empty():
             try:
                 self.updated_agent = self.agent_queue.get_nowait()
@@ -143,12 +358,69 @@ class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
                 # non-blocking
                 pass
 
-        return {
-            "policy_id": self.agent_id,
-            "policy": self.updated_agent,
-            "is_train": random.random() >= self.eval_prob,
+        with_weights = with_weights and self.inference is None
+        policy_id, policy = self.updated_agent
+        agent_dict = {
+            "policy_id": policy_id,
+            "policy": policy if with_weights else None,
+            "is_train": True,
         }
 
+        # Evaluations run the scheduled version, which may not be the latest one,
+        # so they always carry its weights. With central inference workers act
+        # locally with them, as the inference server only serves the latest one.
+        assignment = self.eval_scheduler.assign()
+        if assignment is not None:
+            version, weights = assignment
+            agent_dict["policy_id"] = version
+            agent_dict["policy"] = weights
+            agent_dict["is_train"] = False
+
+        if self.policy_slot is not None:
+            agent_dict["policy_slot"] = (self.policy_slot.name, self.policy_slot.layout)
+        return agent_dict
+
+    def ingest(self, frame: Frame, admitted: int = 0) -> None:
+        """Decode a buffer frame and add it to the buffer queue
+
+        Args:
+            frame: a received buffer frame
+            admitted: the bytes of the byte budget to release once decoded
+        """
+        try:
+            msg = frame.decode()
+            assert isinstance(msg, BufferMsg)
+            self.worker_seen(msg.sender)
+            if isinstance(msg.data, SharedRingRef):
+                semibuffer = self.drain_ring(msg.data)
+            else:
+                semibuffer = msg.data
+            self.buffer_queue.put((frame.policy_version, semibuffer))
+        except Exception:
+            logging.exception("Failed to ingest buffer")
+        finally:
+            self.byte_budget.release(admitted)
+
+    def drain_ring(self, ref: SharedRingRef) -> Any:
+        """Copy the transitions a co-located worker wrote into its ring into a
+        buffer of the same type as the learner's replay buffer"""
+        ring = self.rings.get(ref.name)
+        if ring is None or ring.nonce != ref.nonce:
+            # The worker recreated its ring under the same name; the segment we
+            # are attached to has been unlinked
+            if ring is not None:
+                ring.close()
+            ring = self.rings[ref.name] = TransitionRing.attach(ref.name)
+
+        semibuffer = type(self.replay_buffer)(
+            obs_dim=self.replay_buffer.obs_dim,
+            act_dim=self.replay_buffer.act_dim,
+            size=max(ref.count, 1),
+            batch_size=self.replay_buffer.batch_size,
+        )
+        semibuffer.buffer.extend(ring.pop(ref.count))
+        return semibuffer
+
     def update_agent(self) -> None:
         """Update policy that will be sent to workers without blocking"""
         if not self.agent_queue.empty():
@@ -158,28 +430,79 @@ class AsyncLearningNode(socketserver.ThreadingMixIn, socketserver.TCPServer):
             except queue.Empty:
                 pass
 
-        self.agent_queue.put({k: v.cpu() for k, v in self.agent.state_dict().items()})
+        state_dict = self.policy_state_dict()
+        packed = self.pack_broadcast(state_dict)
+        self.agent_queue.put((self.agent_id + 1, packed))
         self.agent_id += 1
+        self.eval_scheduler.publish(self.agent_id, packed)
+
+        if self.policy_slot is not None:
+            self.policy_slot.write(state_dict, version=self.agent_id)
+        if self.inference is not None:
+            self.inference.load(state_dict, policy_id=self.agent_id)
+
+    def pack_broadcast(self, state_dict: Dict[str, Any]) -> Any:
+        """Pack a policy version for the replies to workers"""
+        module = getattr(self.agent, "actor_critic", self.agent)
+        return pack_policy(state_dict, self.policy_broadcast, actor_critic=module)
+
+    def policy_state_dict(self) -> Dict[str, Any]:
+        """A cpu copy of the agent's actor-critic weights"""
+        module = getattr(self.agent, "actor_critic", self.agent)
+        # Copied even on cpu, so that later updates do not change what was sent
+        return {k: v.to("cpu", copy=True) for k, v in module.state_dict().items()}
 
     def learn(self) -> None:
         """The thread where thread-safe gradient updates occur"""
         for epoch in tqdm(range(self.epochs)):
-            semibuffer = self.buffer_queue.get()
+            policy_id, semibuffer = self.buffer_queue.get()
             print(f"Received something {len(semibuffer)} vs {len(self.replay_buffer)}. {self.buffer_queue.qsize()} buffers remaining")
-            # Add new data to the primary replay buffer
-            self.replay_buffer.store(semibuffer)
-
-            # Learning steps for the policy
-            for _ in range(self.update_steps):
-                batch = self.replay_buffer.sample_batch()
-                self.agent.update(data=batch)
+            # Add new data to the primary replay buffer, unless it is too stale
+            received = len(semibuffer)
+            semibuffer = self.lag_tracker.filter(semibuffer, policy_id, self.agent_id)
+            kept = 0
+            if semibuffer is not None:
+                kept = len(semibuffer)
+                self.replay_buffer.store(semibuffer)
+                self.metrics.inc("transitions_ingested_total", kept)
+
+            # Learning steps for the policy, in proportion to the transitions kept,
+            # so that stale traffic does not keep the learner busy without new data
+            update_steps = self.update_steps
+            if received:
+                update_steps = self.update_steps * kept // received
+            if not update_steps:
+                continue
+            for _ in range(update_steps):
+                with self.metrics.timer("sample_batch_seconds"):
+                    batch = self.replay_buffer.sample_batch()
+                with self.metrics.timer("update_seconds"):
+                    self.agent.update(data=batch)
+                self.metrics.inc("gradient_updates_total")
 
             # Update policy without blocking
             self.update_agent()
+            self.wandb_logger.log(
+                {**self.lag_tracker.summary(), **codec_stats.summary()}
+            )
             # Optionally save
             if self.save_func and epoch % self.save_every == 0:
                 self.save_fn(epoch=epoch, policy=self.get_policy_dict())
 
+    def server_close(self) -> None:
+        """Stop serving, and release the policy slot and the rings of co-located
+        workers"""
+        super().server_close()
+        # Rings may still be drained by buffers that were already received
+        self.ingest_pool.shutdown(wait=True)
+        if self.policy_slot is not None:
+            # Unlinks the slot, which the learner created
+            self.policy_slot.close()
+            self.policy_slot = None
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
     def server_bind(self):
         # From https://stackoverflow.com/questions/6380057/python-binding-socket-address-already-in-use/18858817#18858817.
         # Tries to ensure reuse. Might be wrong.
@@ -0,0 +1,156 @@
+"""Data-parallel training across several learner replicas.
+
+Each replica is a full ``AsyncLearningNode`` with its own address, so workers are
+sharded by the replica they connect to. Replicas average their gradients with a
+``torch.distributed`` all-reduce over the gloo backend before every optimizer
+step. They start from the weights of rank 0 and stay identical, so every replica
+replies with the same policy. Only rank 0 schedules evaluations.
+"""
+
+import queue
+import time
+from typing import Any
+from typing import List
+
+import torch
+import torch.distributed as dist
+from tqdm import tqdm
+
+from distrib_l2r.asynchron.learner import AsyncLearningNode
+
+
+class AllReduceOptimizer:
+    """Wraps an optimizer so that ``step`` first averages gradients across the
+    process group. Everything else is forwarded to the wrapped optimizer.
+
+    Args:
+        optimizer: the optimizer to wrap
+    """
+
+    def __init__(self, optimizer: torch.optim.Optimizer) -> None:
+        self.optimizer = optimizer
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.optimizer, name)
+
+    def step(self, *args, **kwargs) -> Any:
+        params = [
+            p
+            for group in self.optimizer.param_groups
+            for p in group["params"]
+            if p.grad is not None
+        ]
+        allreduce_mean([p.grad for p in params])
+        return self.optimizer.step(*args, **kwargs)
+
+
+def allreduce_mean(tensors: List[torch.Tensor]) -> None:
+    """Average tensors in place across the process group, in one collective"""
+    if not tensors:
+        return
+    flat = torch.cat([t.detach().reshape(-1).cpu() for t in tensors])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+
+    offset = 0
+    for tensor in tensors:
+        numel = tensor.numel()
+        tensor.copy_(flat[offset : offset + numel].view_as(tensor))
+        offset += numel
+
+
+def broadcast_module(module: torch.nn.Module, src: int = 0) -> None:
+    """Overwrite a module's parameters and buffers with those of rank ``src``"""
+    tensors = list(module.state_dict().values())
+    flat = torch.cat([t.detach().reshape(-1).float().cpu() for t in tensors])
+    dist.broadcast(flat, src=src)
+
+    offset = 0
+    for tensor in tensors:
+        numel = tensor.numel()
+        tensor.copy_(flat[offset : offset + numel].view_as(tensor))
+        offset += numel
+
+
+class DataParallelLearningNode(AsyncLearningNode):
+    """One replica of a data-parallel learner.
+
+    Every replica ingests the buffers of the workers connected to it and runs the
+    same number of updates per epoch, so their collectives line up.
+
+    Args:
+        rank: this replica's rank
+        world_size: the number of replicas
+        init_method: the ``torch.distributed`` rendezvous, e.g.
+          "tcp://127.0.0.1:29500"
+        **kwargs: passed to ``AsyncLearningNode``
+    """
+
+    def __init__(
+        self,
+        rank: int,
+        world_size: int,
+        init_method: str = "tcp://127.0.0.1:29500",
+        **kwargs,
+    ) -> None:
+        if rank != 0:
+            kwargs["eval_episodes"] = 0
+        super().__init__(**kwargs)
+
+        self.rank = rank
+        self.world_size = world_size
+        dist.init_process_group(
+            "gloo", init_method=init_method, rank=rank, world_size=world_size
+        )
+
+        with torch.no_grad():
+            broadcast_module(self.agent.actor_critic)
+            broadcast_module(self.agent.actor_critic_target)
+        self.agent.q_optimizer = AllReduceOptimizer(self.agent.q_optimizer)
+        self.agent.pi_optimizer = AllReduceOptimizer(self.agent.pi_optimizer)
+
+        # Replies before the first epoch carry rank 0's weights
+        state_dict = self.policy_state_dict()
+        self.updated_agent = (self.agent_id, self.pack_broadcast(state_dict))
+        if self.policy_slot is not None:
+            self.policy_slot.write(state_dict, version=self.agent_id)
+        if self.inference is not None:
+            self.inference.load(state_dict, policy_id=self.agent_id)
+
+    def ingest_queued(self) -> None:
+        """Add every buffer received so far to the replay buffer"""
+        while True:
+            try:
+                policy_id, semibuffer = self.buffer_queue.get_nowait()
+            except queue.Empty:
+                return
+            semibuffer = self.lag_tracker.filter(semibuffer, policy_id, self.agent_id)
+            if semibuffer is not None:
+                self.replay_buffer.store(semibuffer)
+                self.metrics.inc("transitions_ingested_total", len(semibuffer))
+
+    def wait_for_data(self, poll_interval: float = 0.5) -> None:
+        """Ingest buffers until every replica has something to sample"""
+        while True:
+            self.ingest_queued()
+            size = torch.tensor([len(self.replay_buffer)])
+            dist.all_reduce(size, op=dist.ReduceOp.MIN)
+            if size.item() > 0:
+                return
+            time.sleep(poll_interval)
+
+    def learn(self) -> None:
+        """Lockstep gradient updates; gradients are averaged inside the optimizers"""
+        for _ in tqdm(range(self.epochs), disable=self.rank != 0):
+            self.wait_for_data()
+
+            for _ in range(self.update_steps):
+                with self.metrics.timer("sample_batch_seconds"):
+                    batch = self.replay_buffer.sample_batch()
+                with self.metrics.timer("update_seconds"):
+                    self.agent.update(data=batch)
+                self.metrics.inc("gradient_updates_total")
+
+            self.update_agent()
+            if self.rank == 0:
+                self.wandb_logger.log(self.lag_tracker.summary())
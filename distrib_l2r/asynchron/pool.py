@@ -0,0 +1,95 @@
+"""Bounded request handling for the learner: a fixed pool of handler threads and
+admission control on the number of payload bytes being received or decoded."""
+
+import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+
+class ByteBudget:
+    """Admission control on the bytes of received frames not yet processed.
+
+    A frame is admitted while the bytes in flight, including its own, stay within
+    the budget. A frame is always admitted when nothing else is in flight, so that
+    frames larger than the budget are slowed down rather than starved.
+
+    Args:
+        max_bytes: the budget
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        with self._lock:
+            if self.in_flight and self.in_flight + size > self.max_bytes:
+                return False
+            self.in_flight += size
+            return True
+
+    def release(self, size: int) -> None:
+        with self._lock:
+            self.in_flight -= size
+
+
+class BoundedThreadPoolMixIn:
+    """Serve connections from ``handler_threads`` threads instead of a thread per
+    connection, like ``socketserver.ThreadingMixIn`` but bounded.
+
+    At most ``max_pending_connections`` connections are queued or being handled;
+    further connections are closed immediately. A handler may keep a long-lived
+    connection open without holding a pool thread by passing it to ``detach``.
+    Call ``init_pool`` before serving.
+    """
+
+    handler_threads = 16
+    max_pending_connections = 256
+    # Listen backlog, so that bursts of connections are not refused by the kernel
+    request_queue_size = 128
+
+    def init_pool(self, handler_threads: int, max_pending_connections: int) -> None:
+        self.handler_threads = handler_threads
+        self.max_pending_connections = max_pending_connections
+        self.handler_pool = ThreadPoolExecutor(
+            max_workers=handler_threads, thread_name_prefix="handler"
+        )
+        self._pending = threading.BoundedSemaphore(max_pending_connections)
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        self.connections_refused = 0
+
+    def process_request(self, request: socket.socket, client_address: Any) -> None:
+        if not self._pending.acquire(blocking=False):
+            self.connections_refused += 1
+            logging.warning(f"Too many pending connections; refusing {client_address}")
+            self.shutdown_request(request)
+            return
+        self.handler_pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request: socket.socket, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._pending.release()
+            with self._detached_lock:
+                detached = request in self._detached
+                self._detached.discard(request)
+            if not detached:
+                self.shutdown_request(request)
+
+    def detach(self, request: socket.socket, target: Any, *args: Any) -> None:
+        """Continue serving a connection on a dedicated thread running
+        ``target(*args)``, which becomes responsible for closing it"""
+        with self._detached_lock:
+            self._detached.add(request)
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.handler_pool.shutdown(wait=False)
@@ -0,0 +1,102 @@
+"""Policy lag bookkeeping for off-policy ingestion on the learner."""
+
+import collections
+import random
+import threading
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+STALE_POLICIES = ("drop", "downweight")
+
+
+class PolicyLagTracker:
+    """Records the lag (learner version minus data version) of every chunk of
+    transitions the learner ingests, and filters chunks that are too stale.
+
+    Args:
+        max_lag: the largest lag accepted as-is. None disables filtering.
+        stale_policy: what to do with chunks lagging more than ``max_lag``.
+          "drop" discards them, "downweight" keeps a random ``max_lag / lag``
+          fraction of their transitions.
+    """
+
+    def __init__(self, max_lag: Optional[int] = None, stale_policy: str = "drop"):
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"Unknown stale_policy: {stale_policy}")
+
+        self.max_lag = max_lag
+        self.stale_policy = stale_policy
+        self.lags = collections.Counter()
+        self.chunks_dropped = 0
+        self.transitions_dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, semibuffer: Any, data_version: Optional[int], version: int) -> Any:
+        """Record the lag of a chunk and apply the staleness policy to it
+
+        Args:
+            semibuffer: a buffer exposing its transitions as a ``buffer`` deque
+            data_version: the policy version that generated the chunk, if known
+            version: the learner's current policy version
+
+        Returns:
+            the chunk to ingest, or None if it should be dropped
+        """
+        if data_version is None:
+            return semibuffer
+
+        lag = max(version - data_version, 0)
+        with self._lock:
+            self.lags[lag] += 1
+
+        if self.max_lag is None or lag <= self.max_lag:
+            return semibuffer
+
+        n = len(semibuffer)
+        if self.stale_policy == "drop":
+            kept = 0
+            semibuffer = None
+        else:
+            kept = int(n * self.max_lag / lag)
+            transitions = random.sample(list(semibuffer.buffer), kept)
+            semibuffer.buffer.clear()
+            semibuffer.buffer.extend(transitions)
+            semibuffer = semibuffer if kept else None
+
+        with self._lock:
+            self.chunks_dropped += semibuffer is None
+            self.transitions_dropped += n - kept
+        return semibuffer
+
+    def percentile(self, q: float) -> int:
+        """The ``q``-th percentile (0-100) of recorded lags"""
+        with self._lock:
+            lags = sorted(self.lags.items())
+        total = sum(count for _, count in lags)
+        if not total:
+            return 0
+
+        seen = 0
+        for lag, count in lags:
+            seen += count
+            if seen >= q / 100 * total:
+                return lag
+        return lags[-1][0]
+
+    def summary(self) -> Dict[str, float]:
+        """Summary statistics of the lag distribution, for logging"""
+        with self._lock:
+            total = sum(self.lags.values())
+            mean = sum(lag * count for lag, count in self.lags.items()) / max(total, 1)
+            chunks_dropped = self.chunks_dropped
+            transitions_dropped = self.transitions_dropped
+
+        return {
+            "policy_lag/mean": mean,
+            "policy_lag/p50": self.percentile(50),
+            "policy_lag/p90": self.percentile(90),
+            "policy_lag/max": self.percentile(100),
+            "policy_lag/chunks_dropped": chunks_dropped,
+            "policy_lag/transitions_dropped": transitions_dropped,
+        }
@@ -0,0 +1,299 @@
+"""A learner split across two processes: the networking process receives buffers
+and serves policies, while a separate trainer process runs the gradient updates.
+
+The processes share the replay buffer and the latest policy through
+``torch.multiprocessing`` shared tensors, so gradient throughput does not depend
+on how busy the request handlers are.
+"""
+
+import logging
+import queue
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import torch
+import torch.multiprocessing as mp
+
+from distrib_l2r.asynchron.learner import AsyncLearningNode
+from src.config.yamlize import NameToSourcePath
+from src.config.yamlize import create_configurable
+from src.constants import DEVICE
+
+# Slots of the trainer's shared progress tensor
+UPDATES_IDX, EPOCH_IDX, DONE_IDX = range(3)
+
+
+class SharedReplayBuffer:
+    """A fixed-size FIFO replay buffer backed by shared tensors.
+
+    Batches are sampled in the same format as ``SimpleReplayBuffer.sample_batch``.
+    Writers and readers synchronize on a lock that is only held while copying.
+
+    Args:
+        obs_dim: observation dimension
+        act_dim: action dimension
+        size: the number of transitions kept
+        batch_size: the number of transitions per sampled batch
+        ctx: the multiprocessing context the lock is created in
+    """
+
+    def __init__(
+        self,
+        obs_dim: int,
+        act_dim: int,
+        size: int,
+        batch_size: int,
+        ctx: Optional[Any] = None,
+    ) -> None:
+        ctx = ctx or mp.get_context("spawn")
+        self.obs_dim = obs_dim
+        self.act_dim = act_dim
+        self.max_size = size
+        self.batch_size = batch_size
+
+        self.obs = torch.zeros(size, obs_dim).share_memory_()
+        self.obs2 = torch.zeros(size, obs_dim).share_memory_()
+        self.act = torch.zeros(size, act_dim).share_memory_()
+        self.rew = torch.zeros(size, 1).share_memory_()
+        self.done = torch.zeros(size, 1).share_memory_()
+        # Write pointer and number of valid rows
+        self._meta = torch.zeros(2, dtype=torch.int64).share_memory_()
+        self._lock = ctx.Lock()
+
+    def __len__(self) -> int:
+        return int(self._meta[1])
+
+    def store(self, values: Any) -> None:
+        """Append a ``SimpleReplayBuffer`` or a list of transitions in its format"""
+        transitions = list(getattr(values, "buffer", values))[-self.max_size :]
+        n = len(transitions)
+        if n == 0:
+            return
+
+        obs = torch.stack([_row(t["obs"]) for t in transitions])
+        obs2 = torch.stack([_row(t["obs2"]) for t in transitions])
+        act = torch.stack([_row(t["act"]) for t in transitions])
+        rew = torch.tensor([[float(t["rew"])] for t in transitions])
+        done = torch.tensor([[float(t["done"])] for t in transitions])
+
+        with self._lock:
+            ptr = int(self._meta[0])
+            idxs = (ptr + torch.arange(n)) % self.max_size
+            self.obs[idxs] = obs
+            self.obs2[idxs] = obs2
+            self.act[idxs] = act
+            self.rew[idxs] = rew
+            self.done[idxs] = done
+            self._meta[0] = (ptr + n) % self.max_size
+            self._meta[1] = min(int(self._meta[1]) + n, self.max_size)
+
+    def sample_batch(self) -> Dict[str, torch.Tensor]:
+        """Sample a batch, uniformly with replacement, on ``DEVICE``"""
+        with self._lock:
+            idxs = torch.randint(len(self), (self.batch_size,))
+            batch = {
+                "obs": self.obs[idxs],
+                "obs2": self.obs2[idxs],
+                "act": self.act[idxs],
+                "rew": self.rew[idxs],
+                "done": self.done[idxs],
+            }
+        return {k: v.to(DEVICE) for k, v in batch.items()}
+
+
+class SharedPolicy:
+    """The latest actor-critic weights, published by the trainer process.
+
+    Args:
+        state_dict: the initial weights, which also fix the layout
+        ctx: the multiprocessing context the lock is created in
+    """
+
+    def __init__(
+        self, state_dict: Dict[str, torch.Tensor], ctx: Optional[Any] = None
+    ) -> None:
+        ctx = ctx or mp.get_context("spawn")
+        self.tensors = {
+            k: v.detach().cpu().clone().share_memory_() for k, v in state_dict.items()
+        }
+        self._version = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self._lock = ctx.Lock()
+
+    @property
+    def version(self) -> int:
+        return int(self._version[0])
+
+    def write(self, state_dict: Dict[str, torch.Tensor]) -> int:
+        """Publish new weights and return their version"""
+        with self._lock:
+            for key, tensor in self.tensors.items():
+                tensor.copy_(state_dict[key].detach())
+            self._version += 1
+            return int(self._version[0])
+
+    def read(self) -> Dict[str, torch.Tensor]:
+        """A private copy of the latest weights"""
+        with self._lock:
+            return {k: v.clone() for k, v in self.tensors.items()}
+
+
+def run_trainer(
+    agent_config_path: str,
+    replay_buffer: SharedReplayBuffer,
+    policy: SharedPolicy,
+    progress: torch.Tensor,
+    update_steps: int,
+    epochs: int,
+    num_threads: Optional[int] = None,
+) -> None:
+    """Entry point of the trainer process
+
+    Args:
+        agent_config_path: the agent's yaml config, built inside this process
+        replay_buffer: sampled for every update
+        policy: the initial weights, and where new versions are published
+        progress: a shared int64 tensor of (updates, epochs, done)
+        update_steps: the number of gradient updates between published policies
+        epochs: the number of policies to publish before exiting
+        num_threads: torch intra-op threads for this process
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    agent = create_configurable(agent_config_path, NameToSourcePath.agent)
+    agent.actor_critic.load_state_dict(policy.read())
+    agent.actor_critic_target.load_state_dict(policy.read())
+
+    # Wait for enough data for a full batch
+    while len(replay_buffer) < replay_buffer.batch_size:
+        time.sleep(0.1)
+
+    try:
+        for _ in range(epochs):
+            for _ in range(update_steps):
+                agent.update(data=replay_buffer.sample_batch())
+                progress[UPDATES_IDX] += 1
+            policy.write(
+                {k: v.cpu() for k, v in agent.actor_critic.state_dict().items()}
+            )
+            progress[EPOCH_IDX] += 1
+    finally:
+        progress[DONE_IDX] = 1
+
+
+class MultiProcessLearningNode(AsyncLearningNode):
+    """An ``AsyncLearningNode`` whose gradient updates run in a separate process.
+
+    This process only decodes and ingests buffers and serves policies; ``learn``
+    moves ingested buffers into the shared replay buffer and forwards every
+    policy the trainer publishes to workers.
+
+    Args:
+        agent_config_path: the agent's yaml config. The trainer process builds its
+          own agent from it, starting from this process's weights.
+        trainer_threads: torch intra-op threads for the trainer process
+        **kwargs: passed to ``AsyncLearningNode``
+    """
+
+    def __init__(
+        self,
+        agent_config_path: str,
+        trainer_threads: Optional[int] = None,
+        **kwargs,
+    ) -> None:
+        agent = create_configurable(agent_config_path, NameToSourcePath.agent)
+        super().__init__(agent=agent, **kwargs)
+
+        ctx = mp.get_context("spawn")
+        self.shared_policy = SharedPolicy(super().policy_state_dict(), ctx=ctx)
+        self.shared_buffer = SharedReplayBuffer(
+            obs_dim=self.replay_buffer.obs_dim,
+            act_dim=self.replay_buffer.act_dim,
+            size=self.replay_buffer.max_size,
+            batch_size=self.batch_size,
+            ctx=ctx,
+        )
+        self.progress = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self.metrics.counter(
+            "gradient_updates_total",
+            "Agent updates",
+            rate=True,
+            fn=lambda: int(self.progress[UPDATES_IDX]),
+        )
+
+        self.trainer = ctx.Process(
+            target=run_trainer,
+            args=(
+                agent_config_path,
+                self.shared_buffer,
+                self.shared_policy,
+                self.progress,
+                self.update_steps,
+                self.epochs,
+                trainer_threads,
+            ),
+            daemon=True,
+        )
+        self.trainer.start()
+
+    def policy_state_dict(self) -> Dict[str, Any]:
+        """The trainer's latest weights"""
+        if not hasattr(self, "shared_policy"):
+            return super().policy_state_dict()
+        return self.shared_policy.read()
+
+    def learn(self) -> None:
+        """Ingest buffers and publish new policies until the trainer finishes"""
+        version = self.shared_policy.version
+        while True:
+            done = bool(self.progress[DONE_IDX]) or not self.trainer.is_alive()
+            self.ingest_pending(timeout=0.1)
+
+            if self.shared_policy.version != version:
+                version = self.shared_policy.version
+                self.update_agent()
+                self.wandb_logger.log(self.lag_tracker.summary())
+
+            if done:
+                break
+
+        self.trainer.join()
+        if self.trainer.exitcode != 0:
+            raise RuntimeError(
+                f"Trainer process exited with code {self.trainer.exitcode}"
+            )
+
+    def ingest_pending(self, timeout: float) -> List[int]:
+        """Move queued buffers into the shared replay buffer
+
+        Returns:
+            the number of transitions stored from each buffer
+        """
+        stored = []
+        try:
+            policy_id, semibuffer = self.buffer_queue.get(timeout=timeout)
+        except queue.Empty:
+            return stored
+
+        while True:
+            semibuffer = self.lag_tracker.filter(semibuffer, policy_id, self.agent_id)
+            if semibuffer is not None:
+                try:
+                    self.shared_buffer.store(semibuffer)
+                except Exception:
+                    logging.exception("Failed to store buffer")
+                else:
+                    self.metrics.inc("transitions_ingested_total", len(semibuffer))
+                    stored.append(len(semibuffer))
+            try:
+                policy_id, semibuffer = self.buffer_queue.get_nowait()
+            except queue.Empty:
+                return stored
+
+
+def _row(arraylike: Any) -> torch.Tensor:
+    """Flatten a tensor or array-like into a float32 row"""
+    return torch.as_tensor(arraylike, dtype=torch.float32).reshape(-1)
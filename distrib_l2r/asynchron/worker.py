@@ -1,5 +1,10 @@
+import functools
 import logging
+import os
+import random
+import socket
 import subprocess
+import time
 from typing import Any
 from typing import Dict
 from typing import Optional
@@ -17,33 +22,71 @@ from tianshou.env import DummyVectorEnv
 from distrib_l2r.api import BufferMsg
 from distrib_l2r.api import EvalResultsMsg
 from distrib_l2r.api import InitMsg
+from distrib_l2r.api import RetryMsg
+from distrib_l2r.asynchron.inference import RemoteActor
+from distrib_l2r.launcher import StepCounters
+from distrib_l2r.quantize import unpack_policy
+from distrib_l2r.shm import PolicySlot
+from distrib_l2r.shm import SharedRingRef
+from distrib_l2r.shm import TransitionRing
 from distrib_l2r.utils import send_data
 
 
-# pip install git+https://github.com/learn-to-race/l2r.git@aicrowd-environment
-from l2r import build_env
-from l2r import RacingEnv
-
 from src.config.yamlize import create_configurable, NameToSourcePath, yamlize
 from src.constants import DEVICE
 from src.utils.envwrapper import EnvContainer
+from src.utils.fakeenv import build_fake_env
 import numpy as np
 
 
 class AsnycWorker:
-    """An asynchronous worker"""
+    """An asynchronous worker
+
+    Args:
+        learner_address: the (ip, port) of the learner
+        buffer_size: capacity, in transitions, of the shared memory ring
+        env_wrapper: unused
+        transport: "tcp" to send buffers over the network, or "shm" to write them
+          into shared memory when running on the same host as the learner. Buffers
+          that do not fit into the ring fall back to TCP.
+        central_inference: act through the learner's batched inference server
+          instead of a local copy of the policy, except in evaluation episodes
+        step_counters: a (worker index, ``StepCounters``) pair to report collected
+          environment steps to, as set up by the local launcher
+        fake_env: if set, run a ``FakeRacingEnv`` built with these extra arguments
+          (e.g. ``step_latency``) instead of connecting to the simulator
+    """
 
     def __init__(
         self,
         learner_address: Tuple[str, int],
         buffer_size: int = 5000,
         env_wrapper: Optional[Wrapper] = None,
+        transport: str = "tcp",
+        central_inference: bool = False,
+        step_counters: Optional[Tuple[int, StepCounters]] = None,
+        fake_env: Optional[Dict[str, Any]] = None,
         **kwargs,
     ) -> None:
 
+        if transport not in ("tcp", "shm"):
+            raise ValueError(f"Unknown transport: {transport}")
+
         self.learner_address = learner_address
         self.buffer_size = buffer_size
         self.mean_reward = 0.0
+        self.transport = transport
+        self.ring = None
+        self.policy_slot = None
+        self.loaded_policy_id = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.step_counters = step_counters
+
+        if fake_env is not None:
+            build_env = functools.partial(build_fake_env, **fake_env)
+        else:
+            # pip install git+https://github.com/learn-to-race/l2r.git@aicrowd-environment
+            from l2r import build_env
 
         self.env = build_env(controller_kwargs={"quiet": True},
            env_kwargs=
@@ -92,44 +135,156 @@ class AsnycWorker:
         self.runner = create_configurable(
             "config_files/async_sac/worker.yaml", NameToSourcePath.runner
         )
+
+        # Evaluations run a scheduled version, which may not be the learner's
+        # latest, so they keep acting with the local agent
+        self.remote_actor = None
+        self.local_agent = self.runner.agent
+        if central_inference:
+            self.remote_actor = RemoteActor(self.learner_address)
+            self.runner.agent = self.remote_actor
         # print(self.env.action_space)
 
     def work(self) -> None:
-        """Continously collect data"""
+        """Continously collect data, releasing shared memory when stopped"""
+        try:
+            logging.warn("Trying to send data.")
+            response = self.request(InitMsg(sender=self.worker_id))
+            is_train = response.data["is_train"]
+            policy_id, policy = self.read_policy(response.data)
 
-        is_train = True
-        logging.warn("Trying to send data.")
-        response = send_data(data=InitMsg(), addr=self.learner_address, reply=True)
-        policy_id, policy = response.data["policy_id"], response.data["policy"]
+            while True:
+                buffer, result = self.collect_data(
+                    policy_weights=policy, is_train=is_train
+                )
+                logging.warn("Data collection finished! Sending.")
+                if self.step_counters is not None:
+                    index, counters = self.step_counters
+                    counters.add(index, len(buffer))
 
-        while True:
-            buffer, result = self.collect_data(policy_weights=policy, is_train=is_train)
-            logging.warn("Data collection finished! Sending.")
+                if is_train:
+                    # Central inference: the learner's version at acting time counts
+                    if self.remote_actor is not None:
+                        policy_id = self.remote_actor.policy_id
+                    response = self.request(
+                        BufferMsg(
+                            data=self.pack_buffer(buffer),
+                            sender=self.worker_id,
+                            policy_id=policy_id,
+                        )
+                    )
+                    logging.warn("Sent!")
 
-            if is_train:
-                response = send_data(
-                    data=BufferMsg(data=buffer), addr=self.learner_address, reply=True
-                )
-                logging.warn("Sent!")
+                else:
+                    self.mean_reward = (
+                        self.mean_reward * (0.2) + result["reward"] * 0.8
+                    )
+                    logging.warn(f"reward: {self.mean_reward}")
+                    response = self.request(
+                        EvalResultsMsg(
+                            data=result, sender=self.worker_id, policy_id=policy_id
+                        )
+                    )
+                    logging.warn("Sent!")
+
+                is_train = response.data["is_train"]
+                policy_id, policy = self.read_policy(response.data)
+        finally:
+            self.close()
 
+    def close(self) -> None:
+        """Release the shared memory ring and slot, and the acting connection"""
+        if self.ring is not None:
+            # Unlinks the ring, which this worker created
+            self.ring.close()
+            self.ring = None
+        if self.policy_slot is not None:
+            self.policy_slot.close()
+            self.policy_slot = None
+        if self.remote_actor is not None:
+            self.remote_actor.close()
+
+    def request(self, msg: Any, max_delay: float = 30.0) -> Any:
+        """Send a message to the learner and return its reply, backing off and
+        sending it again while the learner is overloaded"""
+        delay = 1.0
+        while True:
+            try:
+                response = send_data(data=msg, addr=self.learner_address, reply=True)
+            except ConnectionError:
+                logging.warn(f"Learner refused the connection. Retrying in {delay}s.")
             else:
-                self.mean_reward = self.mean_reward * (0.2) + result["reward"] * 0.8
-                logging.warn(f"reward: {self.mean_reward}")
-                response = send_data(
-                    data=EvalResultsMsg(data=result),
-                    addr=self.learner_address,
-                    reply=True,
-                )
-                logging.warn("Sent!")
+                if not isinstance(response, RetryMsg):
+                    return response
+                delay = response.data["retry_after"]
+                logging.warn(f"Learner is overloaded. Retrying in {delay}s.")
+            # Jitter so that workers that were turned away together spread out
+            time.sleep(delay * random.uniform(1.0, 2.0))
+            delay = min(2 * delay, max_delay)
 
-            is_train = response.data["is_train"]
-            policy_id, policy = response.data["policy_id"], response.data["policy"]
+    def pack_buffer(self, buffer: Any) -> Any:
+        """Write a buffer into the shared memory ring if possible
+
+        Returns:
+            a ``SharedRingRef`` for the learner to drain, or the buffer itself
+        """
+        if self.transport != "shm":
+            return buffer
+
+        if self.ring is None:
+            self.ring = TransitionRing.create(
+                name=f"l2r_ring_{os.getpid()}",
+                obs_dim=buffer.obs_dim,
+                act_dim=buffer.act_dim,
+                capacity=self.buffer_size,
+            )
+
+        if not self.ring.push(list(buffer.buffer)):
+            logging.warn("Buffer does not fit into the ring. Sending over TCP.")
+            return buffer
+        return SharedRingRef(
+            name=self.ring.name, count=len(buffer), nonce=self.ring.nonce
+        )
+
+    def read_policy(self, reply: dict) -> Tuple[int, dict]:
+        """Get the policy from a learner reply, reading it from the shared memory
+        slot when the reply does not carry weights
+
+        Returns:
+            a tuple of (policy id, policy weights), with weights None when the
+            runner already acts with this version
+        """
+        # Loading weights is skipped, and a compiled act module keeps running
+        # unchanged, until the version changes
+        if reply["policy_id"] == self.loaded_policy_id:
+            return reply["policy_id"], None
+
+        policy_id, policy = self._read_policy(reply)
+        if policy is not None:
+            self.loaded_policy_id = policy_id
+        return policy_id, policy
+
+    def _read_policy(self, reply: dict) -> Tuple[int, dict]:
+        if reply["policy"] is not None:
+            # Dequantize once here rather than on every load
+            return reply["policy_id"], unpack_policy(reply["policy"])
+
+        # The learner acts for us, so there are no weights to read
+        if "policy_slot" not in reply or self.remote_actor is not None:
+            return reply["policy_id"], None
+
+        if self.policy_slot is None:
+            name, layout = reply["policy_slot"]
+            self.policy_slot = PolicySlot.attach(name, layout)
+        return self.policy_slot.read()
 
     def collect_data(
         self, policy_weights: dict, is_train: bool = True
     ) -> Tuple[ReplayBuffer, Any]:
         """Collect 1 episode of data in the environment"""
-        
+        if self.remote_actor is not None:
+            self.runner.agent = self.remote_actor if is_train else self.local_agent
+
         buffer, result = self.runner.run(self.env, policy_weights, is_train)
 
         return buffer, result
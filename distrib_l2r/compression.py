@@ -0,0 +1,185 @@
+"""Optional payload compression for frames sent between workers and the learner.
+
+zlib is always available. lz4 and zstd are used when their packages
+(``lz4``, ``zstandard``) are installed.
+"""
+
+import logging
+import threading
+import time
+import zlib
+from enum import IntEnum
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Payloads smaller than this are sent uncompressed
+COMPRESSION_THRESHOLD = 64 * 1024
+
+# Byte-shuffle preconditioning groups the n-th byte of every 4-byte word
+# together, which makes contiguous float32 data far more compressible. It hurts
+# pickles of many small tensors, so frames keep whichever variant is smaller.
+SHUFFLE_ITEMSIZE = 4
+
+
+class Compression(IntEnum):
+    """Compression applied to a frame payload, in increasing order of preference"""
+
+    NONE = 0
+    ZLIB = 1
+    LZ4 = 2
+    ZSTD = 3
+
+
+def available() -> int:
+    """Bitmask of the compressions this process can decode"""
+    mask = 1 << Compression.NONE | 1 << Compression.ZLIB
+    if lz4 is not None:
+        mask |= 1 << Compression.LZ4
+    if zstandard is not None:
+        mask |= 1 << Compression.ZSTD
+    return mask
+
+
+def choose(size: int, accept: int, preferred: Optional[str] = "auto") -> Compression:
+    """Choose a compression for a payload
+
+    Args:
+        size: the payload size in bytes
+        accept: bitmask of the compressions the receiver can decode
+        preferred: "auto" for the best one both ends support, a compression name
+          to force it (if the receiver accepts it), or None to disable compression
+    """
+    if preferred is None or size < COMPRESSION_THRESHOLD:
+        return Compression.NONE
+
+    common = accept & available()
+    if preferred != "auto":
+        compression = Compression[preferred.upper()]
+        return compression if common & (1 << compression) else Compression.NONE
+
+    for compression in sorted(Compression, reverse=True):
+        if common & (1 << compression):
+            return compression
+    return Compression.NONE
+
+
+def compress(data: bytes, compression: Compression, shuffle: bool = True) -> bytes:
+    """Compress a payload, recording its ratio and CPU time"""
+    if compression == Compression.NONE:
+        return data
+
+    start = time.thread_time()
+    out = _compress(byte_shuffle(data) if shuffle else data, compression)
+    codec_stats.record(compression, len(data), len(out), time.thread_time() - start)
+    return out
+
+
+def compress_smallest(data: bytes, compression: Compression) -> Tuple[bytes, bool]:
+    """Compress a payload with and without byte-shuffling, keeping the smaller
+
+    Returns:
+        a tuple of (compressed payload, whether it was shuffled)
+    """
+    if compression == Compression.NONE:
+        return data, False
+
+    start = time.thread_time()
+    shuffled = _compress(byte_shuffle(data), compression)
+    plain = _compress(data, compression)
+    out = min(shuffled, plain, key=len)
+    codec_stats.record(compression, len(data), len(out), time.thread_time() - start)
+    return out, out is shuffled
+
+
+def _compress(raw: bytes, compression: Compression) -> bytes:
+    if compression == Compression.ZLIB:
+        return zlib.compress(raw, 1)
+    elif compression == Compression.LZ4:
+        return lz4.frame.compress(raw)
+    elif compression == Compression.ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def decompress(data: bytes, compression: Compression, shuffled: bool = True) -> bytes:
+    """Invert ``compress``"""
+    if compression == Compression.NONE:
+        return data
+
+    if compression == Compression.ZLIB:
+        raw = zlib.decompress(data)
+    elif compression == Compression.LZ4:
+        raw = lz4.frame.decompress(data)
+    elif compression == Compression.ZSTD:
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+    return byte_unshuffle(raw) if shuffled else raw
+
+
+def byte_shuffle(data: bytes, itemsize: int = SHUFFLE_ITEMSIZE) -> bytes:
+    """Transpose ``data`` from items of ``itemsize`` bytes into byte lanes"""
+    return b"".join(data[i::itemsize] for i in range(itemsize))
+
+
+def byte_unshuffle(data: bytes, itemsize: int = SHUFFLE_ITEMSIZE) -> bytes:
+    """Invert ``byte_shuffle``"""
+    n = len(data)
+    out = bytearray(n)
+    offset = 0
+    for i in range(itemsize):
+        lane = (n - i + itemsize - 1) // itemsize
+        out[i::itemsize] = data[offset : offset + lane]
+        offset += lane
+    return bytes(out)
+
+
+class CodecStats:
+    """Running totals of compression ratio and CPU time per compression"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.totals = {c: [0, 0, 0, 0.0] for c in Compression}
+
+    def record(
+        self, compression: Compression, raw: int, compressed: int, seconds: float
+    ) -> None:
+        """Record one compressed message"""
+        logging.debug(
+            f"{compression.name}: {raw} -> {compressed} bytes "
+            f"(ratio {raw / max(compressed, 1):.2f}) in {seconds * 1e3:.2f} ms"
+        )
+        with self._lock:
+            total = self.totals[compression]
+            total[0] += 1
+            total[1] += raw
+            total[2] += compressed
+            total[3] += seconds
+
+    def summary(self) -> Dict[str, float]:
+        """Message count, compression ratio and CPU time per compression"""
+        summary = {}
+        with self._lock:
+            for compression, (count, raw, compressed, seconds) in self.totals.items():
+                if not count:
+                    continue
+                name = compression.name.lower()
+                summary[f"codec/{name}/messages"] = count
+                summary[f"codec/{name}/ratio"] = raw / max(compressed, 1)
+                summary[f"codec/{name}/cpu_seconds"] = seconds
+        return summary
+
+
+codec_stats = CodecStats()
@@ -0,0 +1,260 @@
+"""Run a learner and many workers as local subprocesses, without Kubernetes.
+
+Example::
+
+    python -m distrib_l2r.launcher --workers 16 --cpus-per-worker 2 -- <api key>
+
+Workers are restarted when they crash, pinned to disjoint sets of CPUs, and
+report their environment steps into a shared memory counter, from which the
+launcher prints the aggregate collection rate.
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from distrib_l2r.shm import _attach
+
+STEPS_SHM_ENV = "L2R_STEPS_SHM"
+WORKER_INDEX_ENV = "L2R_WORKER_INDEX"
+
+
+class StepCounters:
+    """One int64 environment step counter per worker, in shared memory
+
+    Args:
+        shm: the backing shared memory segment
+        owner: whether this process created (and should unlink) the segment
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False) -> None:
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.counts = np.ndarray((shm.size // 8,), dtype=np.int64, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, name: str, num_workers: int) -> "StepCounters":
+        """Create the counters; called by the launcher"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=8 * num_workers)
+        counters = cls(shm, owner=True)
+        counters.counts[:] = 0
+        return counters
+
+    @classmethod
+    def attach(cls, name: str) -> "StepCounters":
+        """Attach to counters created by the launcher"""
+        return cls(_attach(name))
+
+    @classmethod
+    def from_env(cls) -> Optional[Tuple[int, "StepCounters"]]:
+        """The (worker index, counters) a launched worker should report to"""
+        if STEPS_SHM_ENV not in os.environ:
+            return None
+        index = int(os.environ[WORKER_INDEX_ENV])
+        return index, cls.attach(os.environ[STEPS_SHM_ENV])
+
+    def add(self, index: int, steps: int) -> None:
+        # Each worker owns its slot, so no lock is needed
+        self.counts[index] += steps
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def close(self) -> None:
+        """Detach from the segment, unlinking it if this process created it"""
+        del self.counts
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class LocalLauncher:
+    """Starts a learner and ``num_workers`` workers and keeps the workers running
+
+    Args:
+        num_workers: the number of worker processes
+        learner_cmd: the command starting the learner, or None to use an
+          already running learner at ``learner_host``
+        worker_cmd: the command starting one worker
+        learner_host: the learner address given to workers
+        learner_port: the learner port given to workers
+        cpus_per_worker: the number of CPUs each worker is pinned to. None
+          disables pinning.
+        torch_threads: torch and OpenMP threads per worker
+        max_restarts: the number of times each worker may be restarted
+        report_interval: seconds between collection rate reports
+        env: extra environment variables for every process
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        learner_cmd: Optional[List[str]],
+        worker_cmd: List[str],
+        learner_host: str = "127.0.0.1",
+        learner_port: int = 4444,
+        cpus_per_worker: Optional[int] = None,
+        torch_threads: int = 1,
+        max_restarts: int = 10,
+        report_interval: float = 10.0,
+        env: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.num_workers = num_workers
+        self.learner_cmd = learner_cmd
+        self.worker_cmd = worker_cmd
+        self.learner_host = learner_host
+        self.learner_port = learner_port
+        self.cpus_per_worker = cpus_per_worker
+        self.torch_threads = torch_threads
+        self.max_restarts = max_restarts
+        self.report_interval = report_interval
+        self.env = {**os.environ, **(env or {})}
+
+        self.learner = None
+        self.workers = [None] * num_workers
+        self.restarts = [0] * num_workers
+        self.counters = StepCounters.create(f"l2r_steps_{os.getpid()}", num_workers)
+
+    def worker_cpus(self, index: int) -> Optional[List[int]]:
+        """The CPUs a worker is pinned to, wrapping around the available ones"""
+        if self.cpus_per_worker is None:
+            return None
+        available = sorted(os.sched_getaffinity(0))
+        start = index * self.cpus_per_worker
+        return [
+            available[(start + i) % len(available)] for i in range(self.cpus_per_worker)
+        ]
+
+    def start_worker(self, index: int) -> None:
+        threads = str(self.torch_threads)
+        env = {
+            **self.env,
+            "L2R_LEARNER_HOST": self.learner_host,
+            "L2R_LEARNER_PORT": str(self.learner_port),
+            "L2R_TORCH_THREADS": threads,
+            "OMP_NUM_THREADS": threads,
+            "MKL_NUM_THREADS": threads,
+            STEPS_SHM_ENV: self.counters.name,
+            WORKER_INDEX_ENV: str(index),
+        }
+        process = subprocess.Popen(self.worker_cmd, env=env)
+        cpus = self.worker_cpus(index)
+        if cpus is not None:
+            os.sched_setaffinity(process.pid, cpus)
+        self.workers[index] = process
+        logging.info(f"Started worker {index} (pid {process.pid}, cpus {cpus})")
+
+    def start(self) -> None:
+        if self.learner_cmd is not None:
+            self.learner = subprocess.Popen(
+                self.learner_cmd,
+                env={**self.env, "L2R_LEARNER_PORT": str(self.learner_port)},
+            )
+        for index in range(self.num_workers):
+            self.start_worker(index)
+
+    def check_workers(self) -> None:
+        """Restart workers that exited, up to ``max_restarts`` times each"""
+        for index, process in enumerate(self.workers):
+            if process is None or process.poll() is None:
+                continue
+            if self.restarts[index] >= self.max_restarts:
+                logging.error(f"Worker {index} exited too often; not restarting")
+                self.workers[index] = None
+                continue
+            logging.warning(f"Worker {index} exited with code {process.returncode}")
+            self.restarts[index] += 1
+            self.start_worker(index)
+
+    def monitor(self) -> None:
+        """Keep workers alive and report the collection rate until the learner
+        exits or every worker has given up"""
+        last_time, last_steps = time.monotonic(), self.counters.total()
+        while True:
+            time.sleep(self.report_interval)
+            if self.learner is not None and self.learner.poll() is not None:
+                logging.error(f"Learner exited with code {self.learner.returncode}")
+                return
+            self.check_workers()
+            alive = sum(process is not None for process in self.workers)
+            if not alive:
+                return
+
+            now, steps = time.monotonic(), self.counters.total()
+            rate = (steps - last_steps) / (now - last_time)
+            print(
+                f"{alive}/{self.num_workers} workers, {steps} steps, "
+                f"{rate:.1f} steps/s, {sum(self.restarts)} restarts",
+                flush=True,
+            )
+            last_time, last_steps = now, steps
+
+    def stop(self) -> None:
+        processes = [p for p in self.workers + [self.learner] if p is not None]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.counters.close()
+
+    def run(self) -> None:
+        self.start()
+        try:
+            self.monitor()
+        finally:
+            self.stop()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--learner-host", default="127.0.0.1")
+    parser.add_argument("--learner-port", type=int, default=4444)
+    parser.add_argument(
+        "--no-learner",
+        action="store_true",
+        help="connect workers to an already running learner",
+    )
+    parser.add_argument("--cpus-per-worker", type=int, default=None)
+    parser.add_argument("--torch-threads", type=int, default=1)
+    parser.add_argument("--max-restarts", type=int, default=10)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument("server_args", nargs="*", help="arguments for server.py")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    launcher = LocalLauncher(
+        num_workers=args.workers,
+        learner_cmd=(
+            None
+            if args.no_learner
+            else [sys.executable, "server.py", *args.server_args]
+        ),
+        worker_cmd=[sys.executable, "worker.py"],
+        learner_host=args.learner_host,
+        learner_port=args.learner_port,
+        cpus_per_worker=args.cpus_per_worker,
+        torch_threads=args.torch_threads,
+        max_restarts=args.max_restarts,
+        report_interval=args.report_interval,
+    )
+    launcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""Synthetic load for an ``AsyncLearningNode``, to find how many workers it can
+absorb.
+
+Example::
+
+    python -m distrib_l2r.loadgen --host 127.0.0.1 --stages 1 2 4 8 16 32 64
+
+Each stage runs that many lightweight fake workers (threads) for a fixed time.
+Fake workers send an ``InitMsg`` and then, after a randomly drawn episode time,
+either a ``BufferMsg`` of realistic size or, when the learner assigns an
+evaluation, an ``EvalResultsMsg``. Every request records its round-trip latency
+and reply size. A stage is saturated when adding workers stops adding throughput.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from distrib_l2r.api import BufferMsg
+from distrib_l2r.api import EvalResultsMsg
+from distrib_l2r.api import InitMsg
+from distrib_l2r.api import RetryMsg
+from distrib_l2r.shm import SharedRingRef
+from distrib_l2r.shm import TransitionRing
+from distrib_l2r.utils import FRAME_HEADER
+from distrib_l2r.utils import NO_VERSION
+from distrib_l2r.utils import Frame
+from distrib_l2r.utils import encode_frame
+from distrib_l2r.utils import wait_for_frame
+from src.buffers.SimpleReplayBuffer import SimpleReplayBuffer
+from src.utils.fakeenv import METRIC_KEYS
+
+
+@dataclass
+class Sample:
+    """One request made by a fake worker"""
+
+    kind: str
+    start: float
+    latency: float
+    request_bytes: int
+    reply_bytes: int
+    transitions: int = 0
+
+
+class TcpTransport:
+    """The current protocol: one connection per request, buffers pickled inline
+
+    Buffer payloads are encoded once per buffer; only the header, which carries
+    the policy version, is rebuilt per request.
+
+    Args:
+        address: the (ip, port) of the learner
+    """
+
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self.address = address
+        self._encoded = {}
+
+    def request(self, frame: bytes) -> Tuple[Frame, int]:
+        """Send a frame and wait for the reply
+
+        Returns:
+            a tuple of (reply frame, reply size in bytes)
+        """
+        with socket.create_connection(self.address) as sock:
+            sock.sendall(frame)
+            reply = wait_for_frame(sock=sock)
+        return reply, FRAME_HEADER.size + len(reply.payload)
+
+    def buffer_frame(self, buffer: Any, sender: str, policy_id: int) -> bytes:
+        if id(buffer) not in self._encoded:
+            self._encoded[id(buffer)] = encode_frame(
+                BufferMsg(data=buffer, sender=sender, policy_id=policy_id)
+            )
+        return with_version(self._encoded[id(buffer)], policy_id)
+
+    def close(self) -> None:
+        pass
+
+
+class ShmTransport(TcpTransport):
+    """Co-located workers: transitions go through a shared memory ring and only a
+    ``SharedRingRef`` is sent over TCP
+
+    Args:
+        address: the (ip, port) of the learner, which must be on this host
+        capacity: the ring capacity in transitions
+    """
+
+    def __init__(self, address: Tuple[str, int], capacity: int = 20_000) -> None:
+        super().__init__(address)
+        self.capacity = capacity
+        self.ring = None
+
+    def buffer_frame(self, buffer: Any, sender: str, policy_id: int) -> bytes:
+        if self.ring is None:
+            # Thread idents are reused once a thread exits, so they do not make
+            # ring names unique across stages
+            self.ring = TransitionRing.create(
+                name=f"l2r_loadgen_{os.getpid()}_{uuid.uuid4().hex[:12]}",
+                obs_dim=buffer.obs_dim,
+                act_dim=buffer.act_dim,
+                capacity=self.capacity,
+            )
+        if not self.ring.push(list(buffer.buffer)):
+            return super().buffer_frame(buffer, sender, policy_id)
+        ref = SharedRingRef(
+            name=self.ring.name, count=len(buffer), nonce=self.ring.nonce
+        )
+        return encode_frame(BufferMsg(data=ref, sender=sender, policy_id=policy_id))
+
+    def close(self) -> None:
+        if self.ring is not None:
+            self.ring.close()
+
+
+# Register new transports here to load test them
+TRANSPORTS = {"tcp": TcpTransport, "shm": ShmTransport}
+
+
+def with_version(frame: bytes, version: Optional[int]) -> bytes:
+    """Rewrite the policy version in an encoded frame's header"""
+    kind, codec, accept, _, size = FRAME_HEADER.unpack_from(frame)
+    header = FRAME_HEADER.pack(
+        kind, codec, accept, NO_VERSION if version is None else version, size
+    )
+    return header + frame[FRAME_HEADER.size :]
+
+
+def make_buffer(steps: int, obs_dim: int = 33, act_dim: int = 2) -> SimpleReplayBuffer:
+    """A ``SimpleReplayBuffer`` like the ones workers send, with random contents"""
+    buffer = SimpleReplayBuffer(
+        obs_dim=obs_dim, act_dim=act_dim, size=steps, batch_size=steps
+    )
+    obs = torch.randn(steps + 1, obs_dim)
+    act = torch.rand(steps, act_dim) * 2 - 1
+    for t in range(steps):
+        buffer.buffer.append(
+            {
+                "obs": obs[t],
+                "obs2": obs[t + 1],
+                "act": act[t],
+                "rew": float(np.random.rand()),
+                "done": t == steps - 1,
+            }
+        )
+    return buffer
+
+
+class FakeWorker(threading.Thread):
+    """Imitates the request pattern of an ``AsnycWorker``
+
+    Args:
+        transport: how requests reach the learner
+        buffers: pre-built buffers to pick from, so that generating load is cheap
+        episode_seconds: median simulated episode length. Episode lengths are
+          lognormally distributed with ``episode_sigma``.
+        episode_sigma: the spread of episode lengths
+        stop: set to end the worker after its current request
+        samples: where finished requests are recorded
+    """
+
+    def __init__(
+        self,
+        transport: TcpTransport,
+        buffers: List[SimpleReplayBuffer],
+        episode_seconds: float,
+        episode_sigma: float,
+        stop: threading.Event,
+        samples: List[Sample],
+    ) -> None:
+        super().__init__(daemon=True)
+        self.transport = transport
+        self.buffers = buffers
+        self.episode_seconds = episode_seconds
+        self.episode_sigma = episode_sigma
+        self.stop = stop
+        self.samples = samples
+        self.rng = np.random.default_rng()
+        self.sender = f"loadgen:{os.getpid()}:{id(self)}"
+
+    def timed(self, kind: str, frame: bytes, transitions: int = 0) -> Dict[str, Any]:
+        """Send a frame, resending it while the learner asks to retry later"""
+        while True:
+            start = time.time()
+            reply, reply_bytes = self.transport.request(frame)
+            msg = reply.decode()
+            retry = isinstance(msg, RetryMsg)
+            self.samples.append(
+                Sample(
+                    kind="retry" if retry else kind,
+                    start=start,
+                    latency=time.time() - start,
+                    request_bytes=len(frame),
+                    reply_bytes=reply_bytes,
+                    transitions=0 if retry else transitions,
+                )
+            )
+            if not retry:
+                return msg.data
+            time.sleep(msg.data["retry_after"] * self.rng.uniform(1.0, 2.0))
+
+    def run(self) -> None:
+        try:
+            reply = self.timed("init", encode_frame(InitMsg(sender=self.sender)))
+            while not self.stop.wait(
+                self.rng.lognormal(np.log(self.episode_seconds), self.episode_sigma)
+            ):
+                if reply["is_train"]:
+                    buffer = self.buffers[self.rng.integers(len(self.buffers))]
+                    frame = self.transport.buffer_frame(
+                        buffer, self.sender, reply["policy_id"]
+                    )
+                    reply = self.timed("buffer", frame, len(buffer))
+                else:
+                    result = {key: float(self.rng.random()) for key in METRIC_KEYS}
+                    result["reward"] = float(self.rng.random())
+                    msg = EvalResultsMsg(
+                        data=result, sender=self.sender, policy_id=reply["policy_id"]
+                    )
+                    reply = self.timed("eval", encode_frame(msg))
+        except OSError as e:
+            self.samples.append(Sample("error", time.time(), 0.0, 0, 0))
+            print(f"{self.sender} failed: {e}")
+        finally:
+            self.transport.close()
+
+
+def summarize(samples: List[Sample], workers: int, seconds: float) -> Dict[str, float]:
+    """Throughput and latency of one stage"""
+    done = [s for s in samples if s.kind != "error"]
+    latencies = np.array([s.latency for s in done]) if done else np.zeros(1)
+    buffers = [s for s in done if s.kind == "buffer"]
+    return {
+        "workers": workers,
+        "requests_per_s": len(done) / seconds,
+        "transitions_per_s": sum(s.transitions for s in buffers) / seconds,
+        "mb_in_per_s": sum(s.request_bytes for s in done) / seconds / 1e6,
+        "latency_p50_ms": 1e3 * float(np.percentile(latencies, 50)),
+        "latency_p99_ms": 1e3 * float(np.percentile(latencies, 99)),
+        "reply_kb_mean": np.mean([s.reply_bytes for s in done]) / 1e3 if done else 0,
+        "retries": sum(s.kind == "retry" for s in done),
+        "errors": len(samples) - len(done),
+    }
+
+
+def run_stage(
+    transport: str,
+    address: Tuple[str, int],
+    workers: int,
+    seconds: float,
+    buffers: List[SimpleReplayBuffer],
+    episode_seconds: float,
+    episode_sigma: float,
+) -> Dict[str, float]:
+    """Run ``workers`` fake workers for ``seconds`` and summarize their requests"""
+    stop = threading.Event()
+    samples = []
+    threads = [
+        FakeWorker(
+            TRANSPORTS[transport](address),
+            buffers,
+            episode_seconds,
+            episode_sigma,
+            stop,
+            samples,
+        )
+        for _ in range(workers)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Only count requests that started within the stage
+    samples = [s for s in samples if s.start < start + seconds]
+    return summarize(samples, workers, time.time() - start)
+
+
+def saturation_point(
+    stages: List[Dict[str, float]], efficiency: float = 0.5
+) -> Optional[int]:
+    """The first worker count at which throughput grew by less than
+    ``efficiency`` times the growth in workers, or the learner turned requests
+    away"""
+    for previous, stage in zip(stages, stages[1:]):
+        added_workers = stage["workers"] / previous["workers"] - 1
+        added_rate = (
+            stage["transitions_per_s"] / max(previous["transitions_per_s"], 1e-9) - 1
+        )
+        overloaded = stage["errors"] or stage.get("retries", 0)
+        if added_rate < efficiency * added_workers or overloaded:
+            return stage["workers"]
+    return None
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4444)
+    parser.add_argument("--transport", choices=sorted(TRANSPORTS), default="tcp")
+    parser.add_argument("--stages", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--stage-seconds", type=float, default=30.0)
+    parser.add_argument("--episode-seconds", type=float, default=5.0)
+    parser.add_argument("--episode-sigma", type=float, default=0.5)
+    parser.add_argument("--episode-steps", type=int, default=1000)
+    parser.add_argument("--obs-dim", type=int, default=33)
+    args = parser.parse_args(argv)
+
+    buffers = [
+        make_buffer(int(args.episode_steps * scale), obs_dim=args.obs_dim)
+        for scale in (0.5, 1.0, 1.5)
+    ]
+    stages = []
+    for workers in args.stages:
+        stage = run_stage(
+            args.transport,
+            (args.host, args.port),
+            workers,
+            args.stage_seconds,
+            buffers,
+            args.episode_seconds,
+            args.episode_sigma,
+        )
+        stages.append(stage)
+        print(" ".join(f"{k}={v:.4g}" for k, v in stage.items()), flush=True)
+
+    saturated = saturation_point(stages)
+    if saturated is None:
+        print(f"Not saturated at {args.stages[-1]} workers")
+    else:
+        print(f"Saturated at {saturated} workers")
+
+
+if __name__ == "__main__":
+    main()
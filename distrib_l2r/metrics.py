@@ -0,0 +1,193 @@
+"""A minimal Prometheus-style metrics registry and HTTP endpoint for the learner.
+
+Only the standard library is used. Scrape ``http://<learner>:<port>/metrics``.
+"""
+
+import bisect
+import collections
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+# Window over which *_per_second rates are computed
+RATE_WINDOW = 60.0
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str) -> Iterator[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{le="+Inf"}} {cumulative}'
+        yield f"{name}_sum {self.sum}"
+        yield f"{name}_count {cumulative}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms rendered in Prometheus text
+    format. Counters registered with ``rate=True`` also export a
+    ``<name>_per_second`` gauge over the last ``RATE_WINDOW`` seconds.
+
+    Args:
+        prefix: prepended to every metric name
+    """
+
+    def __init__(self, prefix: str = "l2r_") -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._counter_fns = {}
+        self._rates = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._histograms = {}
+
+    def counter(
+        self,
+        name: str,
+        help: str,
+        rate: bool = False,
+        fn: Optional[Callable[[], float]] = None,
+    ) -> None:
+        """Declare a monotonically increasing counter, optionally read from ``fn``
+        at scrape time"""
+        self._help[name] = ("counter", help)
+        self._counters[name] = 0
+        if fn is not None:
+            self._counter_fns[name] = fn
+        if rate:
+            self._rates[name] = collections.deque([(time.monotonic(), 0)])
+
+    def gauge(
+        self, name: str, help: str, fn: Optional[Callable[[], float]] = None
+    ) -> None:
+        """Declare a gauge, optionally computed by ``fn`` at scrape time"""
+        self._help[name] = ("gauge", help)
+        self._gauges[name] = {}
+        if fn is not None:
+            self._gauge_fns[name] = fn
+
+    def histogram(
+        self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        """Declare a histogram"""
+        self._help[name] = ("histogram", help)
+        self._histograms[name] = Histogram(buckets)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges[name][key] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Observe the wall time of a block into a histogram"""
+        start = time.perf_counter()
+        yield
+        self.observe(name, time.perf_counter() - start)
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format"""
+        computed = {name: fn() for name, fn in self._gauge_fns.items()}
+        counted = {name: fn() for name, fn in self._counter_fns.items()}
+        now = time.monotonic()
+        lines = []
+        with self._lock:
+            self._counters.update(counted)
+            for name, (kind, help) in self._help.items():
+                full = self.prefix + name
+                lines += [f"# HELP {full} {help}", f"# TYPE {full} {kind}"]
+                if kind == "counter":
+                    lines.append(f"{full} {self._counters[name]}")
+                elif kind == "histogram":
+                    lines += list(self._histograms[name].render(full))
+                elif name in computed:
+                    lines.append(f"{full} {computed[name]}")
+                else:
+                    for labels, value in self._gauges[name].items():
+                        lines.append(f"{full}{_format_labels(labels)} {value}")
+
+            for name, snapshots in self._rates.items():
+                value = self._counters[name]
+                snapshots.append((now, value))
+                while len(snapshots) > 2 and now - snapshots[1][0] > RATE_WINDOW:
+                    snapshots.popleft()
+                start, start_value = snapshots[0]
+                rate = (value - start_value) / max(now - start, 1e-9)
+
+                full = f"{self.prefix}{name}_per_second"
+                lines += [f"# TYPE {full} gauge", f"{full} {rate}"]
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves a registry on ``/metrics`` from a daemon thread
+
+    Args:
+        registry: the registry to expose
+        server_address: the (host, port) to listen on
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, registry: MetricsRegistry, server_address: Tuple[str, int]
+    ) -> None:
+        super().__init__(server_address, _MetricsHandler)
+        self.registry = registry
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Scrapes are frequent; keep them out of the learner's logs
+        pass
@@ -0,0 +1,99 @@
+"""Compact policy encodings for broadcasting weights from the learner to workers.
+
+Workers only act, so they only need the policy subnetwork of an ``ActorCritic``.
+The packed form keeps those entries in fp32, fp16 or int8 with per-row scales, or
+is an ONNX export of them for workers acting with onnxruntime.
+"""
+
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+from src.utils import onnx_backend
+
+# State dict prefixes used by ActorCritic.act
+POLICY_PREFIXES = ("policy.", "speed_encoder.")
+BROADCAST_MODES = ("full", "fp32", "fp16", "int8", "onnx")
+
+
+def pack_policy(
+    state_dict: Dict[str, torch.Tensor],
+    mode: str,
+    actor_critic: Optional[nn.Module] = None,
+) -> Dict[str, Any]:
+    """Pack the acting part of an actor-critic state dict for broadcast
+
+    Args:
+        state_dict: the full actor-critic state dict, on cpu
+        mode: "full" returns ``state_dict`` unchanged. "fp32", "fp16" and "int8"
+          keep only the policy and speed encoder in that precision. "onnx"
+          exports them to ONNX, once for every worker.
+        actor_critic: the module ``state_dict`` belongs to, required by "onnx"
+
+    Returns:
+        the state dict, or a packed policy to be passed to ``unpack_policy``
+    """
+    if mode not in BROADCAST_MODES:
+        raise ValueError(f"Unknown broadcast mode: {mode}")
+    if mode == "full":
+        return state_dict
+    if mode == "onnx":
+        if actor_critic is None:
+            raise ValueError("The onnx broadcast mode requires the actor_critic")
+        return onnx_backend.pack_export(actor_critic, state_dict)
+
+    tensors = {}
+    for key, value in state_dict.items():
+        if not key.startswith(POLICY_PREFIXES):
+            continue
+        if mode == "fp32":
+            tensors[key] = value.float()
+        elif mode == "fp16":
+            tensors[key] = value.half()
+        else:
+            tensors[key] = quantize_int8(value)
+    return {"mode": mode, "tensors": tensors}
+
+
+def unpack_policy(packed: Dict[str, Any]) -> Dict[str, torch.Tensor]:
+    """Invert ``pack_policy``, returning a float32 (possibly partial) state dict.
+    ONNX exports are returned as they are, for ``OnnxAgent.load_model``."""
+    if not is_packed(packed):
+        return packed
+
+    state_dict = {}
+    for key, value in packed["tensors"].items():
+        if packed["mode"] == "int8":
+            state_dict[key] = dequantize_int8(*value)
+        else:
+            state_dict[key] = value.float()
+    return state_dict
+
+
+def is_packed(policy: Dict[str, Any]) -> bool:
+    """Whether a policy received from the learner holds tensors packed by
+    ``pack_policy``"""
+    return set(policy.keys()) == {"mode", "tensors"}
+
+
+def quantize_int8(tensor: torch.Tensor) -> tuple:
+    """Symmetric int8 quantization with one scale per output row
+
+    Returns:
+        a tuple of (int8 tensor, float32 scales)
+    """
+    tensor = tensor.float()
+    rows = tensor.reshape(tensor.shape[0], -1) if tensor.dim() > 1 else tensor[None]
+    scale = rows.abs().amax(dim=1, keepdim=True).clamp_min(1e-12) / 127.0
+    quantized = torch.round(rows / scale).to(torch.int8)
+    return quantized.reshape(tensor.shape), scale.squeeze(1)
+
+
+def dequantize_int8(quantized: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    """Invert ``quantize_int8``"""
+    rows = quantized.float()
+    rows = rows.reshape(rows.shape[0], -1) if rows.dim() > 1 else rows[None]
+    return (rows * scale[:, None]).reshape(quantized.shape)
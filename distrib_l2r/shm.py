@@ -0,0 +1,309 @@
+"""Shared-memory transport for workers running on the same host as the learner.
+
+Workers write transitions into a per-worker ring of float32 rows and the learner
+publishes policy weights into a single versioned slot. Only small control
+messages (``SharedRingRef`` and a weightless ``PolicyMsg``) go over TCP.
+"""
+
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import torch
+
+# Header layouts, in int64 words. Padded to a cache line.
+HEADER_BYTES = 64
+WRITE_IDX, READ_IDX, OBS_DIM_IDX, ACT_DIM_IDX, CAPACITY_IDX, NONCE_IDX = range(6)
+SEQ_IDX, VERSION_IDX = range(2)
+
+
+@dataclass
+class SharedRingRef:
+    """Reference to transitions a worker has written into its ring"""
+
+    name: str
+    count: int
+    # Identifies the ring behind ``name``, in case it was unlinked and recreated
+    nonce: int = 0
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing segment without handing its lifetime to this process.
+
+    The resource tracker otherwise unlinks the segment when the attaching process
+    exits, which would tear it down underneath its owner.
+    """
+    shm = shared_memory.SharedMemory(name=name, create=False)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _create(name: str, size: int) -> shared_memory.SharedMemory:
+    """Create a segment, replacing a stale one of the same name.
+
+    A process that was killed before closing its segments leaves them behind,
+    which would otherwise make every later run under the same name fail.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        logging.warning(f"Replacing stale shared memory segment {name}")
+        stale = shared_memory.SharedMemory(name=name, create=False)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+class TransitionRing:
+    """Single-producer, single-consumer ring of transitions in shared memory.
+
+    Each row holds ``obs | obs2 | act | rew | done`` as float32. The producer only
+    advances the write index and the consumer only advances the read index, so no
+    lock is required. The ring geometry lives in the header, so the consumer can
+    attach by name alone. A random nonce in the header tells apart rings that
+    were recreated under the same name.
+
+    Args:
+        shm: the backing shared memory segment
+        owner: whether this process created (and should unlink) the segment
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False) -> None:
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self._header = np.ndarray((6,), dtype=np.int64, buffer=shm.buf)
+        self.obs_dim = int(self._header[OBS_DIM_IDX])
+        self.act_dim = int(self._header[ACT_DIM_IDX])
+        self.capacity = int(self._header[CAPACITY_IDX])
+        self.nonce = int(self._header[NONCE_IDX])
+        self.width = 2 * self.obs_dim + self.act_dim + 2
+        self._rows = np.ndarray(
+            (self.capacity, self.width),
+            dtype=np.float32,
+            buffer=shm.buf,
+            offset=HEADER_BYTES,
+        )
+
+    @classmethod
+    def create(
+        cls, name: str, obs_dim: int, act_dim: int, capacity: int
+    ) -> "TransitionRing":
+        """Create a new ring; called by the worker that will write into it"""
+        width = 2 * obs_dim + act_dim + 2
+        shm = _create(name, HEADER_BYTES + capacity * width * 4)
+        header = np.ndarray((6,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (0, 0, obs_dim, act_dim, capacity, secrets.randbits(62))
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "TransitionRing":
+        """Attach to a ring created by another process"""
+        return cls(_attach(name))
+
+    def __len__(self) -> int:
+        return int(self._header[WRITE_IDX] - self._header[READ_IDX])
+
+    def free(self) -> int:
+        """Number of rows that can be pushed without overwriting unread data"""
+        return self.capacity - len(self)
+
+    def push(self, transitions: List[Dict[str, Any]]) -> int:
+        """Write transitions, in ``SimpleReplayBuffer`` format, into the ring
+
+        :param transitions: dicts with keys obs, obs2, act, rew, done
+        :return: the number of transitions written; 0 if they do not all fit
+        """
+        n = len(transitions)
+        if n > self.free():
+            return 0
+
+        o, a = self.obs_dim, self.act_dim
+        write_idx = int(self._header[WRITE_IDX])
+        for i, transition in enumerate(transitions):
+            row = self._rows[(write_idx + i) % self.capacity]
+            row[:o] = _as_numpy(transition["obs"])
+            row[o : 2 * o] = _as_numpy(transition["obs2"])
+            row[2 * o : 2 * o + a] = _as_numpy(transition["act"])
+            row[-2] = float(transition["rew"])
+            row[-1] = float(transition["done"])
+
+        # Publish only after the rows are fully written
+        self._header[WRITE_IDX] = write_idx + n
+        return n
+
+    def pop(self, count: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Read up to ``count`` transitions (default: all available) from the ring
+
+        :return: transitions in ``SimpleReplayBuffer`` format
+        """
+        available = len(self)
+        count = available if count is None else min(count, available)
+
+        o, a = self.obs_dim, self.act_dim
+        read_idx = int(self._header[READ_IDX])
+        idxs = (read_idx + np.arange(count)) % self.capacity
+        rows = torch.from_numpy(self._rows[idxs])  # fancy indexing copies
+
+        transitions = [
+            {
+                "obs": row[:o],
+                "obs2": row[o : 2 * o],
+                "act": row[2 * o : 2 * o + a],
+                "rew": float(row[-2]),
+                "done": bool(row[-1]),
+            }
+            for row in rows
+        ]
+        self._header[READ_IDX] = read_idx + count
+        return transitions
+
+    def close(self) -> None:
+        """Detach from the segment, unlinking it if this process created it"""
+        del self._header, self._rows
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class PolicySlot:
+    """A versioned, single-writer slot holding a flattened policy state dict.
+
+    Entries are stored back to back in their own dtype, each aligned to its
+    element size.
+
+    Readers use a sequence lock: the writer makes the sequence number odd while
+    copying weights in, and readers retry until they observe the same even
+    sequence number before and after their copy.
+
+    Args:
+        shm: the backing shared memory segment
+        layout: ``(key, shape, dtype)`` for every entry of the state dict
+        owner: whether this process created (and should unlink) the segment
+    """
+
+    def __init__(
+        self,
+        shm: shared_memory.SharedMemory,
+        layout: List[Tuple[str, Tuple[int, ...], torch.dtype]],
+        owner: bool = False,
+    ) -> None:
+        self.shm = shm
+        self.name = shm.name
+        self.layout = layout
+        self.offsets, self.nbytes = self.offsets_of(layout)
+        self.owner = owner
+        self._header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        self._bytes = torch.frombuffer(
+            shm.buf, dtype=torch.uint8, count=self.nbytes, offset=HEADER_BYTES
+        )
+
+    @classmethod
+    def create(cls, name: str, state_dict: Dict[str, torch.Tensor]) -> "PolicySlot":
+        """Create a slot sized for ``state_dict``; called by the learner"""
+        layout = cls.layout_of(state_dict)
+        _, nbytes = cls.offsets_of(layout)
+        shm = _create(name, HEADER_BYTES + nbytes)
+        slot = cls(shm, layout, owner=True)
+        slot._header[:] = 0
+        return slot
+
+    @classmethod
+    def attach(
+        cls, name: str, layout: List[Tuple[str, Tuple[int, ...], torch.dtype]]
+    ) -> "PolicySlot":
+        """Attach to a slot created by the learner"""
+        return cls(_attach(name), layout)
+
+    @staticmethod
+    def layout_of(
+        state_dict: Dict[str, torch.Tensor],
+    ) -> List[Tuple[str, Tuple[int, ...], torch.dtype]]:
+        """Describe a state dict so that both ends agree on the flat layout"""
+        return [(k, tuple(v.shape), v.dtype) for k, v in state_dict.items()]
+
+    @staticmethod
+    def offsets_of(
+        layout: List[Tuple[str, Tuple[int, ...], torch.dtype]],
+    ) -> Tuple[List[int], int]:
+        """The byte offset of every entry of a layout, and the total size"""
+        offsets = []
+        nbytes = 0
+        for _, shape, dtype in layout:
+            itemsize = torch.empty((), dtype=dtype).element_size()
+            nbytes = -(-nbytes // itemsize) * itemsize
+            offsets.append(nbytes)
+            nbytes += int(np.prod(shape)) * itemsize
+        return offsets, nbytes
+
+    @property
+    def version(self) -> int:
+        return int(self._header[VERSION_IDX])
+
+    def write(self, state_dict: Dict[str, torch.Tensor], version: int) -> None:
+        """Publish a new policy version"""
+        self._header[SEQ_IDX] += 1
+        for (key, _, dtype), offset in zip(self.layout, self.offsets):
+            value = state_dict[key].detach().cpu().reshape(-1).to(dtype)
+            self._entry(self._bytes, offset, value.numel(), dtype).copy_(value)
+        self._header[VERSION_IDX] = version
+        self._header[SEQ_IDX] += 1
+
+    def read(self, timeout: float = 1.0) -> Tuple[int, Dict[str, torch.Tensor]]:
+        """Copy out a consistent snapshot of the latest policy
+
+        :return: a tuple of (policy version, state dict)
+        """
+        start_time = time.time()
+        while True:
+            seq = int(self._header[SEQ_IDX])
+            if seq % 2 == 0:
+                version = int(self._header[VERSION_IDX])
+                flat = self._bytes.clone()
+                if seq == int(self._header[SEQ_IDX]):
+                    break
+            if time.time() - start_time > timeout:
+                raise TimeoutError(
+                    f"Could not read a consistent policy from {self.name}"
+                )
+
+        state_dict = {}
+        for (key, shape, dtype), offset in zip(self.layout, self.offsets):
+            size = int(np.prod(shape))
+            state_dict[key] = self._entry(flat, offset, size, dtype).reshape(shape)
+        return version, state_dict
+
+    @staticmethod
+    def _entry(
+        flat: torch.Tensor, offset: int, size: int, dtype: torch.dtype
+    ) -> torch.Tensor:
+        """View ``size`` elements of ``dtype`` starting at byte ``offset``"""
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        return flat[offset : offset + size * itemsize].view(dtype)
+
+    def close(self) -> None:
+        """Detach from the segment, unlinking it if this process created it"""
+        del self._header, self._bytes
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _as_numpy(arraylike: Any) -> np.ndarray:
+    """Flatten a tensor or array-like into a float32 numpy array"""
+    if isinstance(arraylike, torch.Tensor):
+        return arraylike.detach().cpu().reshape(-1).float().numpy()
+    return np.asarray(arraylike, dtype=np.float32).reshape(-1)
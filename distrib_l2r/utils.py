@@ -1,22 +1,102 @@
 import pickle
 import socket
 import struct
+from dataclasses import dataclass
+from enum import IntEnum
 from select import poll
 from select import POLLIN
 from typing import Any
+from typing import Dict
+from typing import Optional
 from typing import Tuple
 from typing import Union
+import threading
 import time
 
+from distrib_l2r import compression as comp
+
 
 INT_SIZE = 4
 
+# Every message is prefixed with a fixed-size header of
+# (kind, codec, accepted compressions, policy version, payload length) so that
+# receivers can route frames before, or without, decoding the payload
+FRAME_HEADER = struct.Struct(">BBBqI")
+NO_VERSION = -1
+
+# The codec byte packs the serialization (low nibble), the compression (bits 4-6)
+# and whether the payload was byte-shuffled (bit 7)
+SHUFFLED = 0x80
+
+# Compressions accepted by peers, learned from the headers of their replies and
+# shared by every connection this process makes to the same address. A reply
+# overwrites the entry, so a restarted peer is re-learned after one exchange.
+# Peers we have not heard from yet are assumed to only support the stdlib.
+DEFAULT_ACCEPT = 1 << comp.Compression.NONE | 1 << comp.Compression.ZLIB
+_peer_accept: Dict[Tuple[str, Union[int, str]], int] = {}
+_peer_lock = threading.Lock()
+
+
+class TrafficStats:
+    """Bytes sent and received by this process through send_data/receive_frame"""
+
+    def __init__(self) -> None:
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def add(self, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+
+traffic_stats = TrafficStats()
+
+
+class MsgKind(IntEnum):
+    """The kind of message carried by a frame"""
+
+    OTHER = 0
+    INIT = 1
+    BUFFER = 2
+    BUFFER_REF = 3
+    EVAL = 4
+    POLICY = 5
+    ACT = 6
+    ACTION = 7
+    RETRY = 8
+
+
+class Codec(IntEnum):
+    """How the payload of a frame is encoded"""
+
+    PICKLE = 0
+    RAW = 1
+
+
+@dataclass
+class Frame:
+    """A received, not yet decoded, message"""
+
+    kind: int
+    codec: int
+    accept: int
+    policy_version: Optional[int]
+    payload: bytes
+
+    def decode(self) -> Any:
+        """Decode the payload into the message that was sent"""
+        return decode_payload(self.payload, self.codec)
+
 
 def send_data(
     data: Any,
     addr: Tuple[str, Union[int, str]] = None,
     sock: socket.socket = None,
     reply: bool = False,
+    compression: Optional[str] = "auto",
+    accept: Optional[int] = None,
 ) -> Any:
     """Creates a TCP socket, optionally, and sends data to the specified address.
     If specified, listen for a response.
@@ -26,12 +106,21 @@ def send_data(
     :param sock: a socket, if not provided, addr must not be none
     :param reply: listen on the same socket for a reply. if True, this
       function returns unpickled data
+    :param compression: "auto" to compress large payloads with the best codec
+      both ends support, a codec name ("zlib", "lz4", "zstd") or None
+    :param accept: the compressions the receiver accepts, e.g. ``frame.accept``
+      of the request being replied to. Defaults to what this process last
+      learned from ``addr``, on any connection.
     """
-    if not isinstance(data, bytes):
-        data = pickle.dumps(data)
+    if accept is None:
+        with _peer_lock:
+            accept = _peer_accept.get(addr, DEFAULT_ACCEPT)
+    frame = encode_frame(data, compression=compression, accept=accept)
+
+    traffic_stats.add(bytes_out=len(frame))
 
     if sock:
-        send_bytes_with_prefix_size(msg=data, sock=sock)
+        sock.sendall(frame)
         return wait_for_response(sock=sock) if reply else None
 
     else:
@@ -40,12 +129,63 @@ def send_data(
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.connect(addr)
-            send_bytes_with_prefix_size(msg=data, sock=sock)
-            return wait_for_response(sock=sock) if reply else None
+            sock.sendall(frame)
+            if not reply:
+                return None
+
+            response = wait_for_frame(sock=sock)
+            with _peer_lock:
+                _peer_accept[addr] = response.accept
+            return response.decode()
+
+
+def encode_frame(
+    data: Any, compression: Optional[str] = "auto", accept: int = DEFAULT_ACCEPT
+) -> bytes:
+    """Serialize data into a frame. Messages may declare their ``kind`` and
+    ``policy_version`` to have them exposed in the header."""
+    if isinstance(data, bytes):
+        codec, payload = Codec.RAW, data
+    else:
+        codec, payload = Codec.PICKLE, pickle.dumps(data)
+
+    compressor = comp.choose(len(payload), accept, compression)
+    if compressor != comp.Compression.NONE:
+        payload, shuffled = comp.compress_smallest(payload, compressor)
+        codec |= compressor << 4 | (SHUFFLED if shuffled else 0)
+
+    kind = getattr(data, "kind", MsgKind.OTHER)
+    version = getattr(data, "policy_version", None)
+    header = FRAME_HEADER.pack(
+        kind,
+        codec,
+        comp.available(),
+        NO_VERSION if version is None else version,
+        len(payload),
+    )
+    return header + payload
+
+
+def decode_payload(payload: bytes, codec: int) -> Any:
+    """Decode a frame payload"""
+    payload = comp.decompress(
+        payload, comp.Compression((codec >> 4) & 0x07), bool(codec & SHUFFLED)
+    )
+    serialization = codec & 0x0F
+    if serialization == Codec.RAW:
+        return payload
+    elif serialization == Codec.PICKLE:
+        return pickle.loads(payload)
+    raise ValueError(f"Unknown codec: {codec}")
 
 
 def wait_for_response(sock: socket.socket) -> Any:
     """Wait and return a response from a socket"""
+    return wait_for_frame(sock=sock).decode()
+
+
+def wait_for_frame(sock: socket.socket) -> Frame:
+    """Wait and return an undecoded response from a socket"""
     response = None
     polly = poll()
     polly.register(sock.fileno(), POLLIN)
@@ -55,15 +195,65 @@ def wait_for_response(sock: socket.socket) -> Any:
         events = polly.poll(1)
         for fileno, event in events:
             if fileno == sock.fileno():
-                return receive_data(sock=sock)
+                return receive_frame(sock=sock)
         total_time = time.time() - start_time
         if total_time > 10:
             print("WARNING: BLOCKING CALL IN SERVER.")
 
 
 def receive_data(sock: socket.socket) -> Any:
-    """Receive from a socket and unpickle"""
-    return pickle.loads(recv_bytes_with_prefix_size(sock=sock))
+    """Receive from a socket and decode"""
+    return receive_frame(sock=sock).decode()
+
+
+def receive_frame(sock: socket.socket) -> Frame:
+    """Receive a frame from a socket without decoding its payload"""
+    frame, size = receive_frame_header(sock)
+    frame.payload = recv_exactly(size=size, sock=sock)
+    return frame
+
+
+def receive_frame_header(sock: socket.socket) -> Tuple[Frame, int]:
+    """Receive only the header of a frame, so the receiver can decide whether to
+    read or discard the payload
+
+    :return: a tuple of (frame with an empty payload, payload size)
+    """
+    kind, codec, accept, version, size = FRAME_HEADER.unpack(
+        recv_exactly(size=FRAME_HEADER.size, sock=sock)
+    )
+    traffic_stats.add(bytes_in=FRAME_HEADER.size + size)
+    frame = Frame(
+        kind=kind,
+        codec=codec,
+        accept=accept,
+        policy_version=None if version == NO_VERSION else version,
+        payload=b"",
+    )
+    return frame, size
+
+
+def recv_exactly(size: int, sock: socket.socket) -> bytes:
+    """Receive exactly ``size`` bytes from a socket"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError(f"Socket closed with {remaining} bytes outstanding")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def discard_exactly(size: int, sock: socket.socket) -> None:
+    """Receive and drop exactly ``size`` bytes from a socket"""
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError(f"Socket closed with {remaining} bytes outstanding")
+        remaining -= len(chunk)
 
 
 def send_bytes_with_prefix_size(msg: bytes, sock: socket.socket) -> None:
@@ -0,0 +1,44 @@
+"""Per-step acting latency of ActorCritic.act against its TorchScript-compiled forward.
+
+Usage: python -m scripts.bench_act [batch_size] [iterations]
+"""
+
+import sys
+import time
+
+import torch
+
+from src.networks.critic import ActorCritic
+
+
+def time_act(act, obs, deterministic, iterations):
+    """Mean seconds per call, including the conversion to numpy."""
+    for i in range(iterations + 100):
+        if i == 100:  # warm up, which also lets TorchScript optimize
+            start = time.perf_counter()
+        with torch.no_grad():
+            act(obs, deterministic)
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    actor_critic = ActorCritic()
+    compiled = actor_critic.compile_act()
+    obs = torch.randn(batch_size, 33)
+
+    for deterministic in (False, True):
+        eager = time_act(actor_critic.act, obs, deterministic, iterations)
+        scripted = time_act(
+            lambda o, d: compiled(o, d).squeeze(0).numpy(),
+            obs,
+            deterministic,
+            iterations,
+        )
+        mode = "deterministic" if deterministic else "stochastic"
+        print(
+            f"{mode}: eager {1e6 * eager:.1f} us, compiled {1e6 * scripted:.1f} us, "
+            f"speedup {eager / scripted:.2f}x"
+        )
@@ -0,0 +1,67 @@
+"""Accuracy and per-step latency of the int8 policy and encoder against float32 on CPU.
+
+Usage: python -m scripts.bench_quantization [frames.npy] [iterations]
+
+Without stored frames, random frames are used, which calibrate poorly; pass real
+camera frames to judge accuracy.
+"""
+
+import sys
+import time
+
+import numpy as np
+import torch
+
+from src.encoders.vae import VAE
+from src.networks.critic import ActorCritic
+from src.utils import quantization
+
+
+def time_call(fn, iterations):
+    """Mean seconds per call."""
+    for i in range(iterations + 10):
+        if i == 10:  # warm up
+            start = time.perf_counter()
+        with torch.no_grad():
+            fn()
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        frames = quantization.load_frames(sys.argv[1])
+    else:
+        frames = np.random.randint(0, 256, (256, 384, 512, 3), dtype=np.uint8)
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    calibration, held_out = frames[: len(frames) // 2], frames[len(frames) // 2 :]
+
+    actor_critic = ActorCritic().cpu()
+    vae = VAE().cpu()
+    policy = quantization.quantize_policy(actor_critic)
+    encoder = quantization.QuantizedEncoder(vae, calibration)
+
+    obs = torch.randn(1024, 33)
+    for key, value in {
+        **quantization.policy_error(actor_critic, policy, obs),
+        **quantization.encoder_error(vae, encoder, held_out),
+    }.items():
+        print(f"{key}: {value:.5f}")
+
+    step_obs = obs[:1]
+    image = quantization.preprocess(held_out[:1])
+    timings = {
+        "act": (
+            lambda: actor_critic.act(step_obs, True),
+            lambda: policy(step_obs, True),
+        ),
+        "encode": (
+            lambda: vae.fc1(vae.encoder(image)),
+            lambda: encoder.distribution(image),
+        ),
+    }
+    for name, (fp32, int8) in timings.items():
+        fp32, int8 = time_call(fp32, iterations), time_call(int8, iterations)
+        print(
+            f"{name}: float32 {1e6 * fp32:.1f} us, int8 {1e6 * int8:.1f} us, "
+            f"speedup {fp32 / int8:.2f}x"
+        )
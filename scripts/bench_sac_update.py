@@ -0,0 +1,57 @@
+"""Regression benchmark for the SAC policy step with and without a frozen critic.
+
+Usage: python -m scripts.bench_sac_update [batch_size] [iterations]
+
+Before q_params was a reusable list, freezing the critic silently did nothing, which
+is what the "unfrozen" row reproduces.
+"""
+
+import contextlib
+import sys
+import time
+
+import torch
+
+from src.agents.SACAgent import SACAgent
+from src.constants import DEVICE
+
+
+def time_policy_backward(agent, batch, frozen, iterations):
+    """Mean seconds per policy loss forward and backward."""
+    context = agent.frozen_critic if frozen else contextlib.nullcontext
+    for i in range(iterations + 10):
+        if i == 10:  # warm up
+            if DEVICE != "cpu":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+        with context():
+            agent.pi_optimizer.zero_grad()
+            agent.q_optimizer.zero_grad(set_to_none=True)
+            loss_pi, _ = agent._compute_loss_pi(batch)
+            loss_pi.backward()
+    if DEVICE != "cpu":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    batch = {"obs": torch.randn(batch_size, 33, device=DEVICE)}
+
+    unfrozen = time_policy_backward(agent, batch, False, iterations)
+    frozen = time_policy_backward(agent, batch, True, iterations)
+    assert all(p.grad is None for p in agent.q_params), "critic received gradients"
+
+    print(f"policy step, critic unfrozen: {1e3 * unfrozen:.3f} ms")
+    print(f"policy step, critic frozen:   {1e3 * frozen:.3f} ms")
+    print(f"saved: {100 * (1 - frozen / unfrozen):.1f}%")
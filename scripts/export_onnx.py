@@ -0,0 +1,29 @@
+"""Export the policy and the VAE encoder to ONNX, for workers using the onnxruntime backend.
+
+Usage: python -m scripts.export_onnx <output dir> [actor-critic state dict]
+"""
+
+import os
+import sys
+
+import torch
+
+from src.config.yamlize import create_configurable, NameToSourcePath
+from src.utils.onnx_backend import export_encoder, export_policy
+
+if __name__ == "__main__":
+    output_dir = sys.argv[1]
+    os.makedirs(output_dir, exist_ok=True)
+
+    actor_critic = create_configurable(
+        "config_files/async_sac/network.yaml", NameToSourcePath.network
+    )
+    if len(sys.argv) > 2:
+        actor_critic.load_state_dict(torch.load(sys.argv[2], map_location="cpu"))
+    encoder = create_configurable(
+        "config_files/async_sac/encoder.yaml", NameToSourcePath.encoder
+    )
+
+    export_policy(actor_critic, os.path.join(output_dir, "policy.onnx"))
+    export_encoder(encoder, os.path.join(output_dir, "encoder.onnx"))
+    print(f"Wrote policy.onnx and encoder.onnx to {output_dir}")
@@ -1,13 +1,19 @@
-from l2r import build_env
+import functools
 
 # from l2r import RacingEnv
 from src.config.yamlize import NameToSourcePath, create_configurable
+from src.utils.fakeenv import build_fake_env, fake_env_from_environ
 import sys
 import logging
 
 
 if __name__ == "__main__":
-    # Build environment
+    # Build environment, or a stand-in to run without the simulator
+    fake_env = fake_env_from_environ()
+    if fake_env is not None:
+        build_env = functools.partial(build_fake_env, **fake_env)
+    else:
+        from l2r import build_env
     env = build_env(
         controller_kwargs={"quiet": True},
         camera_cfg=[
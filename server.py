@@ -1,4 +1,6 @@
 from distrib_l2r.asynchron.learner import AsyncLearningNode
+from distrib_l2r.asynchron.parallel import DataParallelLearningNode
+from distrib_l2r.asynchron.trainer import MultiProcessLearningNode
 from src.config.yamlize import NameToSourcePath, create_configurable
 from tianshou.policy import SACPolicy
 from tianshou.utils.net.common import Net
@@ -9,20 +11,68 @@ import threading
 import numpy as np
 import time
 import sys
+import os
 
 state_shape = (33,)
 action_shape = (2,)
 
 if __name__ == "__main__":
-    learner = AsyncLearningNode(
-        agent=create_configurable(
-            "config_files/async_sac/agent.yaml", NameToSourcePath.agent
-        ),
+    options = dict(
         api_key=sys.argv[1],
+        policy_slot_name=os.environ.get("L2R_POLICY_SLOT"),
+        policy_broadcast=os.environ.get("L2R_POLICY_BROADCAST", "full"),
+        central_inference=os.environ.get("L2R_CENTRAL_INFERENCE", "0") == "1",
+        # Metrics are only served when a port is given
+        metrics_port=os.environ.get("L2R_METRICS_PORT"),
     )
+    if options["metrics_port"] is not None:
+        options["metrics_port"] = int(options["metrics_port"])
+    port = int(os.environ.get("L2R_LEARNER_PORT", 4444))
+    # Run gradient updates in their own process
+    trainer_process = os.environ.get("L2R_TRAINER_PROCESS", "0") == "1"
+    # Data-parallel replicas listen on consecutive ports
+    world_size = int(os.environ.get("L2R_LEARNER_REPLICAS", 1))
+    if world_size > 1:
+        rank = int(os.environ["L2R_LEARNER_RANK"])
+        if options["metrics_port"] is not None:
+            options["metrics_port"] += rank
+        if options["policy_slot_name"]:
+            options["policy_slot_name"] += f"_{rank}"
+        learner = DataParallelLearningNode(
+            rank=rank,
+            world_size=world_size,
+            init_method=os.environ.get("L2R_DIST_INIT", "tcp://127.0.0.1:29500"),
+            agent=create_configurable(
+                "config_files/async_sac/agent.yaml", NameToSourcePath.agent
+            ),
+            server_address=("0.0.0.0", port + rank),
+            **options,
+        )
+    elif trainer_process:
+        learner = MultiProcessLearningNode(
+            agent_config_path="config_files/async_sac/agent.yaml",
+            server_address=("0.0.0.0", port),
+            **options,
+        )
+    else:
+        learner = AsyncLearningNode(
+            agent=create_configurable(
+                "config_files/async_sac/agent.yaml", NameToSourcePath.agent
+            ),
+            server_address=("0.0.0.0", port),
+            **options,
+        )
     print("Initialized!!.")
     server_thread = threading.Thread(target=learner.serve_forever)
     server_thread.start()
     print("Learning?")
-    while True:
-        learner.learn()
+    try:
+        if trainer_process:
+            learner.learn()
+        else:
+            while True:
+                learner.learn()
+    finally:
+        # Release shared memory, which would otherwise outlive the process
+        learner.shutdown()
+        learner.server_close()
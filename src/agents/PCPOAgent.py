@@ -1,13 +1,17 @@
 import itertools
+import math
 from copy import deepcopy
 
 import torch
 import numpy as np
 from gym.spaces import Box
+from torch.distributions.kl import kl_divergence
+from torch.func import functional_call, grad, linearize, vmap
 from torch.optim import Adam
 
 from src.agents.base import BaseAgent
 from src.config.yamlize import yamlize, create_configurable, NameToSourcePath
+from src.networks.critic import PolicyDistribution
 from src.utils.utils import ActionSample
 
 from src.constants import DEVICE
@@ -59,6 +63,8 @@ class PCPOAgent(BaseAgent):
         self.loss_c_before = 0.0
         self.deterministic = False
         self.cg_damping = cg_damping
+        self.cg_iters = 10
+        self.entropy_coef = 0.0
 
         self.record = {"transition_actor": ""}  # rename
         self.use_cost_value_function = True
@@ -71,6 +77,10 @@ class PCPOAgent(BaseAgent):
         )
         self.actor_critic.to(DEVICE)
         self.actor_critic_target = deepcopy(self.actor_critic)
+        # The policy as a distribution with flat parameters, for the Fisher-vector
+        # products and the line search
+        self.policy_dist = PolicyDistribution(self.actor_critic)
+        self.policy_flat = FlatParameters(self.policy_dist)
 
         if self.load_checkpoint_from != "":
             self.load_model(self.load_checkpoint_from)
@@ -125,30 +135,28 @@ class PCPOAgent(BaseAgent):
     ):
         """
             PCPO algorithm performs line-search to ensure constraint satisfaction for rewards and costs.
+            All candidate step fractions decay ** j are evaluated in one vmapped pass, without writing
+            parameters into the model; then the first acceptable one is taken.
         """
-        step_frac = 1.0
-        _theta_old = self.get_flat_params_from(self.actor_critic.policy.net)
-        _, old_log_p = self.actor_critic.pi(data['obs']) 
+        step_fracs = [decay**j for j in range(total_steps)]
+        flat = self.policy_flat
+        thetas = flat.values() + step_dir.new_tensor(step_fracs)[:, None] * step_dir
         expected_rew_improve = g_flat.dot(step_dir)
 
+        losses = line_search_losses(
+            self.policy_dist, flat, thetas, data, p_dist, self.entropy_coef
+        )
+        # One host copy for all candidates
+        losses = torch.stack(losses, dim=1).tolist()
+
         # while not within_trust_region:
-        for j in range(total_steps):
-            new_theta = _theta_old + step_frac * step_dir
-            self.set_param_values_to_model(self.actor_critic.policy.net, new_theta)
+        for j, (loss_pi_rew, loss_pi_cost, torch_kl) in enumerate(losses):
+            step_frac = step_fracs[j]
             acceptance_step = j + 1
+            loss_rew_improve = self.loss_pi_before - loss_pi_rew
+            cost_diff = loss_pi_cost - self.loss_pi_cost_before
 
-            with torch.no_grad():
-                loss_pi_rew, _ = self.compute_loss_pi(data=data)
-                loss_pi_cost, _ = self.compute_loss_cost_performance(data=data)
-                # determine KL div between new and old policy
-                q_dist = self.actor_critic.policy.dist(data['obs'])
-                torch_kl = torch.distributions.kl.kl_divergence(
-                    p_dist, q_dist).mean().item()
-            loss_rew_improve = self.loss_pi_before - loss_pi_rew.item()
-            cost_diff = loss_pi_cost.item() - self.loss_pi_cost_before
-
-            if not torch.isfinite(loss_pi_rew) and not torch.isfinite(
-                    loss_pi_cost):
+            if not math.isfinite(loss_pi_rew) and not math.isfinite(loss_pi_cost):
                 print('WARNING: loss_pi not finite')
             elif loss_rew_improve < 0 if optim_case > 1 else False:
                 print('INFO: did not improve improve <0')
@@ -161,13 +169,11 @@ class PCPOAgent(BaseAgent):
                 # within the trust region
                 print(f'Accept step at i={j + 1}')
                 break
-            step_frac *= decay
         else:
             print('INFO: no suitable step found...')
             step_dir = torch.zeros_like(step_dir)
             acceptance_step = 0
 
-        self.set_param_values_to_model(self.actor_critic.policy.net, _theta_old)
         return step_frac * step_dir, acceptance_step
 
     
@@ -205,6 +211,33 @@ class PCPOAgent(BaseAgent):
         self.t = self.t + 1
         return action_obj
 
+    def select_actions(self, obs):
+        """Select actions for several environments with one forward pass.
+
+        Args:
+            obs (torch.Tensor): Observations of shape (n_envs, obs_dim).
+
+        Returns:
+            ActionObj: Action object with actions of shape (n_envs, act_dim), and values, costs and log-probs of shape (n_envs,).
+        """
+        n = obs.shape[0]
+        action_obj = ActionSample()
+        if self.t > self.steps_to_sample_randomly:
+            packed = self.actor_critic.fused_step(obs.to(DEVICE), self.deterministic)
+            action_obj.action = packed[:, : self.act_dim]
+            action_obj.logp = packed[:, self.act_dim]
+            action_obj.value = packed[:, self.act_dim + 1]
+            action_obj.cost = packed[:, self.act_dim + 2]
+            self.record["transition_actor"] = "learner"
+        else:
+            action_obj.action = self.sample_random_actions(n)
+            action_obj.value = np.ones((n,))
+            action_obj.cost = np.ones((n,))
+            action_obj.logp = np.ones((n,))
+            self.record["transition_actor"] = "random"
+        self.t = self.t + n
+        return action_obj
+
     def register_reset(self, obs):
         """
         Same input/output as select_action, except this method is called at episodal reset.
@@ -228,7 +261,8 @@ class PCPOAgent(BaseAgent):
         torch.save(self.actor_critic.state_dict(), path)
 
     def compute_loss_cost_performance(self, data):
-        dist, _log_p = self.actor_critic.pi(data['obs'], data['act'])
+        dist = self.policy_dist(data['obs'])
+        _log_p = dist.log_prob(data['act']).sum(axis=-1)
         ratio = torch.exp(_log_p - data['log_p'])
         cost_loss = (ratio * data['cost_adv']).mean()
         # ent = dist.entropy().mean().item()
@@ -247,7 +281,8 @@ class PCPOAgent(BaseAgent):
     def compute_loss_pi(self, data):
         """Set up function for computing SAC pi loss."""
         # Policy loss
-        dist, _log_p = self.ac.pi(data['obs'], data['act'])
+        dist = self.policy_dist(data['obs'])
+        _log_p = dist.log_prob(data['act']).sum(axis=-1)
         ratio = torch.exp(_log_p - data['log_p'])
 
         # Compute loss via ratio and advantage
@@ -274,13 +309,15 @@ class PCPOAgent(BaseAgent):
         return ((self.actor_critic.c(obs) - ret) ** 2).mean()
 
 
-    def update(self):
+    def update(self, data):
         """
             Update actor, critic, running statistics
+
+        Args:
+            data (dict): Batch from PCPOBuffer.sample_batch, with "obs", "act", "log_p", "adv", "cost_adv", "target_v" and "target_c".
         """
-        raw_data = self.buf.get()
         # pre-process data
-        data = self.pre_process_data(raw_data)
+        data = self.pre_process_data(data)
         # sub-sampling accelerates calculations
         self.fvp_obs = data['obs'][::4]
         # Update Policy Network
@@ -290,6 +327,16 @@ class PCPOAgent(BaseAgent):
         if self.use_cost_value_function:
             self.update_cost_net(data=data)
     
+    def pre_process_data(self, data):
+        """
+            Express the stored squashed actions and their log-probs in terms of the pre-squash Gaussian of self.policy_dist.
+        """
+        data = dict(data)
+        data['act'], data['log_p'] = self.policy_dist.unsquash(
+            data['act'], data['log_p']
+        )
+        return data
+
     def update_value_net(self, data: dict) -> None:
         # Divide whole local epoch data into mini_batches which is mbs size
 
@@ -321,7 +368,7 @@ class PCPOAgent(BaseAgent):
     
     def update_policy_net(self, data):
         # Get loss and info values before update
-        theta_old = self.get_flat_params_from(self.ac.pi.net)
+        theta_old = self.policy_flat.values()
         self.pi_optimizer.zero_grad()
         loss_pi, pi_info = self.compute_loss_pi(data=data)
         self.loss_pi_before = loss_pi.item()
@@ -330,11 +377,16 @@ class PCPOAgent(BaseAgent):
         self.loss_c_before = self.compute_loss_c(data['obs'],
                                                  data['target_c']).item()
         # get prob. distribution before updates
-        p_dist = self.actor_critic.pi.dist(data['obs'])
+        with torch.no_grad():
+            p_dist = self.policy_dist(data['obs'])
+        # Linearize the KL gradient once; every Fvp below reuses it
+        self.fvp = FisherVectorProduct(
+            self.policy_dist, self.fvp_obs, self.cg_damping
+        )
         # Train policy with multiple steps of gradient descent
         loss_pi.backward()
         
-        g_flat = self.get_flat_gradients_from(self.actor_critic.pi.net)
+        g_flat = self.get_flat_gradients_from(self.actor_critic.policy)
 
         # flip sign since policy_loss = -(ration * adv)
         g_flat *= -1
@@ -343,9 +395,8 @@ class PCPOAgent(BaseAgent):
         assert torch.isfinite(x).all()
         eps = 1.0e-8
         # Note that xHx = g^T x, but calculating xHx is faster than g^T x
+        H_inv_g = x
         xHx = torch.dot(x, self.Fvp(x))  # equivalent to : g^T x
-        H_inv_g = self.Fvp(x)
-        alpha = torch.sqrt(2 * self.target_kl / (xHx + eps))
         assert xHx.item() >= 0, 'No negative values'
 
         # get the policy cost performance gradient b (flat as vector)
@@ -354,7 +405,7 @@ class PCPOAgent(BaseAgent):
         loss_cost.backward()
         
         self.loss_pi_cost_before = loss_cost.item()
-        b_flat = self.get_flat_gradients_from(self.actor_critic.pi.net)
+        b_flat = self.get_flat_gradients_from(self.actor_critic.policy)
 
 
         # set variable names as used in the paper
@@ -362,8 +413,10 @@ class PCPOAgent(BaseAgent):
         q = xHx
         r = g_flat.dot(p)  # g^T H^{-1} b
         s = b_flat.dot(p)  # b^T H^{-1} b
+        # Constraint violation, estimating the episode cost by the mean cost-to-go target
+        c = data['target_c'].mean() - self.cost_limit
         
-        step_dir = torch.sqrt(2 * self.target_kl / (q + 1e-8)) * H_inv_g - torch.clamp_min((torch.sqrt(2 * self.target_kl/q) * r + c)/ s, torch.tensor(0.0)) * p
+        step_dir = torch.sqrt(2 * self.target_kl / (q + 1e-8)) * H_inv_g - torch.clamp_min((torch.sqrt(2 * self.target_kl/q) * r + c)/ s, 0.0) * p
 
         final_step_dir, accept_step = self.adjust_cpo_step_direction(
             step_dir,
@@ -375,11 +428,7 @@ class PCPOAgent(BaseAgent):
         )
         # update actor network parameters
         new_theta = theta_old + final_step_dir
-        self.set_param_values_to_model(self.actor_critic.pi.net, new_theta)
-
-        q_dist = self.ac.pi.dist(data['obs'])
-        torch_kl = torch.distributions.kl.kl_divergence(
-            p_dist, q_dist).mean().item()
+        self.policy_flat.assign(new_theta)
 
 
     def conjugate_gradients(self, Avp, b, nsteps, residual_tol=1e-10, eps=1e-6):
@@ -430,22 +479,124 @@ class PCPOAgent(BaseAgent):
         """ 
             Build the Hessian-vector product based on an approximation of the KL-divergence.
             For details see John Schulman's PhD thesis (pp. 40) http://joschu.net/docs/thesis.pdf
+            Evaluated with the FisherVectorProduct built at the start of update_policy_net.
         """
-        self.ac.pi.net.zero_grad()
-        q_dist = self.actor_critic.pi.dist(self.fvp_obs)
+        return self.fvp(p)
+
+
+class FisherVectorProduct:
+    """Damped Fisher-vector products F p + damping * p of a policy, where F is the Hessian of the
+    KL divergence from the current policy at the current parameters.
+
+    The gradient of the KL is linearized once with torch.func, so each product costs one
+    evaluation of the cached linear map instead of a forward and two backward passes.
+    Build a new instance whenever the parameters change.
+    """
+
+    def __init__(self, policy, obs, damping, submodule="policy"):
+        """Linearize the KL gradient
+
+        Args:
+            policy (PolicyDistribution): Policy whose forward(obs) returns a distribution. The distribution must be built with validate_args=False, as validation cannot be traced by linearize.
+            obs (torch.Tensor): Observations to average the KL over.
+            damping (float): Damping coefficient added to every product.
+            submodule (str, optional): Submodule whose parameters F is taken over, flattened in named_parameters order. Defaults to "policy".
+        """
+        self.policy = policy
+        self.obs = obs
+        self.damping = damping
+        self.flat = FlatParameters(policy, submodule)
+        theta = self.flat.values()
+
         with torch.no_grad():
-            p_dist = self.actor_critic.pi.dist(self.fvp_obs)
-        kl = torch.distributions.kl.kl_divergence(p_dist, q_dist).mean()
-
-        grads = torch.autograd.grad(kl, self.actor_critic.pi.net.parameters(),
-                                    create_graph=True)
-        flat_grad_kl = torch.cat([grad.view(-1) for grad in grads])
-
-        kl_p = (flat_grad_kl * p).sum()
-        grads = torch.autograd.grad(kl_p, self.ac.pi.net.parameters(),
-                                    retain_graph=False)
-        # contiguous indicating, if the memory is contiguously stored or not
-        flat_grad_grad_kl = torch.cat([grad.contiguous().view(-1)
-                                       for grad in grads])
-        
-        return flat_grad_grad_kl + p * self.cg_damping
\ No newline at end of file
+            p_dist = self._dist(theta)
+
+        def kl(flat):
+            return kl_divergence(p_dist, self._dist(flat)).mean()
+
+        _, self._hvp = linearize(grad(kl), theta)
+
+    def _dist(self, flat):
+        return functional_call(self.policy, self.flat.unflatten(flat), (self.obs,))
+
+    def __call__(self, p):
+        """Compute F p + damping * p
+
+        Args:
+            p (torch.Tensor): Flat vector over the submodule parameters.
+
+        Returns:
+            torch.Tensor: Flat vector of the same shape
+        """
+        return self._hvp(p) + self.damping * p
+
+
+class FlatParameters:
+    """Maps between a flat vector and the trainable parameters of a policy submodule, for
+    evaluating the policy at other parameters with torch.func.functional_call. Flat vectors
+    are ordered like the submodule's named_parameters, as get_flat_gradients_from is."""
+
+    def __init__(self, policy, submodule="policy"):
+        """Collect parameter names and shapes
+
+        Args:
+            policy (nn.Module): Policy module.
+            submodule (str, optional): Submodule holding the parameters. Defaults to "policy".
+        """
+        self.params = dict(policy.named_parameters())
+        self.names = [
+            f"{submodule}.{name}"
+            for name, param in getattr(policy, submodule).named_parameters()
+            if param.requires_grad
+        ]
+        self.shapes = [self.params[name].shape for name in self.names]
+        self.sizes = [self.params[name].numel() for name in self.names]
+
+    def values(self):
+        """Current parameters as one detached flat vector"""
+        return torch.cat(
+            [self.params[name].detach().reshape(-1) for name in self.names]
+        )
+
+    def assign(self, flat):
+        """Write a flat vector into the parameters in place"""
+        with torch.no_grad():
+            for name, value in self.unflatten(flat).items():
+                self.params[name].copy_(value)
+
+    def unflatten(self, flat):
+        """Parameter dict for functional_call from a flat vector"""
+        return {
+            name: value.view(shape)
+            for name, value, shape in zip(
+                self.names, torch.split(flat, self.sizes), self.shapes
+            )
+        }
+
+
+def line_search_losses(policy, flat, thetas, data, p_dist, entropy_coef):
+    """Evaluate the PCPO line search objectives at many candidate parameters in one vmapped pass.
+    The policy's own parameters are left untouched.
+
+    Args:
+        policy (PolicyDistribution): Policy whose forward(obs) returns a distribution, built with validate_args=False as vmap cannot batch validation.
+        flat (FlatParameters): Layout of the candidate parameter vectors.
+        thetas (torch.Tensor): Candidate flat parameters of shape (n_candidates, n_params).
+        data (dict): Batch with "obs", "act", "log_p", "adv" and "cost_adv", with pre-squash actions and log-probs (see PolicyDistribution.unsquash).
+        p_dist (torch.distributions.Distribution): Policy distribution before the update.
+        entropy_coef (float): Entropy bonus coefficient of the reward loss.
+
+    Returns:
+        tuple: Tuple of reward losses, cost losses and mean KL from p_dist, each of shape (n_candidates,)
+    """
+
+    def losses(theta):
+        dist = functional_call(policy, flat.unflatten(theta), (data["obs"],))
+        ratio = torch.exp(dist.log_prob(data["act"]).sum(axis=-1) - data["log_p"])
+        loss_rew = -(ratio * data["adv"]).mean() - entropy_coef * dist.entropy().mean()
+        loss_cost = (ratio * data["cost_adv"]).mean()
+        kl = kl_divergence(p_dist, dist).mean()
+        return loss_rew, loss_cost, kl
+
+    with torch.no_grad():
+        return vmap(losses)(thetas)
@@ -1,5 +1,4 @@
 """PPOAgent Definition. """
-import itertools
 from copy import deepcopy
 
 import torch
@@ -70,7 +69,7 @@ class PPOAgent(BaseAgent):
 
         self.actor_critic_target = deepcopy(self.actor_critic)
 
-        self.v_params = itertools.chain(self.actor_critic.v.parameters())
+        self.v_params = list(self.actor_critic.v.parameters())
 
         # Set up optimizers for policy and q-function
         self.pi_optimizer = Adam(self.actor_critic.policy.parameters(), lr=self.lr)
@@ -90,12 +89,11 @@ class PPOAgent(BaseAgent):
         """
         action_obj = ActionSample()
         if self.t > self.steps_to_sample_randomly:
-            a, logp = self.actor_critic.pi(obs.to(DEVICE), self.deterministic)
-            action_obj.action = a.squeeze().detach().cpu().numpy()
-            action_obj.value = (
-                self.actor_critic.v(obs.to(DEVICE)).detach().cpu().numpy()
-            )
-            action_obj.logp = logp.squeeze().detach().cpu().numpy()
+            # Action, log-prob and value in one forward and one host copy
+            packed = self.actor_critic.fused_step(obs.to(DEVICE), self.deterministic)
+            action_obj.action = packed[..., : self.act_dim].squeeze()
+            action_obj.logp = packed[..., self.act_dim].squeeze()
+            action_obj.value = packed[..., self.act_dim + 1]
             self.record["transition_actor"] = "learner"
         else:
             a = self.action_space.sample()
@@ -111,6 +109,31 @@ class PPOAgent(BaseAgent):
         self.t = self.t + 1
         return action_obj
 
+    def select_actions(self, obs):
+        """Select actions for several environments with one forward pass.
+
+        Args:
+            obs (torch.Tensor): Observations of shape (n_envs, obs_dim).
+
+        Returns:
+            ActionSample: Action object with actions of shape (n_envs, act_dim), and values and log-probs of shape (n_envs,).
+        """
+        n = obs.shape[0]
+        action_obj = ActionSample()
+        if self.t > self.steps_to_sample_randomly:
+            packed = self.actor_critic.fused_step(obs.to(DEVICE), self.deterministic)
+            action_obj.action = packed[:, : self.act_dim]
+            action_obj.logp = packed[:, self.act_dim]
+            action_obj.value = packed[:, self.act_dim + 1]
+            self.record["transition_actor"] = "learner"
+        else:
+            action_obj.action = self.sample_random_actions(n)
+            action_obj.value = np.ones((n,))
+            action_obj.logp = np.ones((n,))
+            self.record["transition_actor"] = "random"
+        self.t = self.t + n
+        return action_obj
+
     def register_reset(self, obs):
         """Handle reset of episode."""
         pass
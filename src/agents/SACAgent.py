@@ -5,7 +5,7 @@ https://spinningup.openai.com/en/latest/algorithms/sac.html#documentation-pytorc
 Source:
 https://github.com/openai/spinningup/blob/master/spinup/algos/pytorch/sac/sac.py
 """
-import itertools
+from contextlib import contextmanager
 from copy import deepcopy
 
 import torch
@@ -33,6 +33,7 @@ class SACAgent(BaseAgent):
         lr: float,
         actor_critic_cfg_path: str,
         load_checkpoint_from: str = "",
+        compile_act: bool = False,
     ):
         """Initialize Soft Actor-Critic Agent
 
@@ -44,6 +45,7 @@ class SACAgent(BaseAgent):
             lr (float): Learning rate parameter.
             actor_critic_cfg_path (str): Actor Critic Config Path
             load_checkpoint_from (str, optional): Load checkpoint from path. If '', then doesn't load anything. Defaults to ''.
+            compile_act (bool, optional): Act through a TorchScript-compiled policy forward. Defaults to False.
         """
 
         super(SACAgent, self).__init__()
@@ -70,12 +72,18 @@ class SACAgent(BaseAgent):
         self.actor_critic.to(DEVICE)
         self.actor_critic_target = deepcopy(self.actor_critic)
 
+        # Parameters live in one contiguous buffer per network, so the target
+        # update is a single kernel instead of a Python loop over tensors
+        self.flat_params = flatten_parameters(self.actor_critic)
+        self.flat_target_params = flatten_parameters(self.actor_critic_target)
+
         if self.load_checkpoint_from != "":
             self.load_model(self.load_checkpoint_from)
 
-        self.q_params = itertools.chain(
-            self.actor_critic.q1.parameters(), self.actor_critic.q2.parameters()
-        )
+        self.q_params = self.actor_critic.q_parameters()
+
+        # Compiled after the parameters are flattened, whose views it then shares
+        self.act_module = self.actor_critic.compile_act() if compile_act else None
 
         # Set up optimizers for policy and q-function
         self.pi_optimizer = Adam(self.actor_critic.policy.parameters(), lr=self.lr)
@@ -104,8 +112,12 @@ class SACAgent(BaseAgent):
         # use the learned policy.
         action_obj = ActionSample()
         if self.t > self.steps_to_sample_randomly:
-            a = self.actor_critic.act(obs.to(DEVICE), self.deterministic)
-            a = a  # numpy array...
+            if self.act_module is not None:
+                with torch.no_grad():
+                    a = self.act_module(obs.to(DEVICE), self.deterministic)
+                a = a.squeeze(0).cpu().numpy()
+            else:
+                a = self.actor_critic.act(obs.to(DEVICE), self.deterministic)
             action_obj.action = a
             self.record["transition_actor"] = "learner"
         else:
@@ -115,6 +127,32 @@ class SACAgent(BaseAgent):
         self.t = self.t + 1
         return action_obj
 
+    def select_actions(self, obs):
+        """Select actions for several environments with one forward pass.
+
+        Args:
+            obs (torch.Tensor): Observations of shape (n_envs, obs_dim).
+
+        Returns:
+            ActionSample: Action object with actions of shape (n_envs, act_dim).
+        """
+        n = obs.shape[0]
+        action_obj = ActionSample()
+        if self.t > self.steps_to_sample_randomly:
+            if self.act_module is not None:
+                with torch.no_grad():
+                    a = self.act_module(obs.to(DEVICE), self.deterministic)
+                a = a.cpu().numpy()
+            else:
+                a = self.actor_critic.act(obs.to(DEVICE), self.deterministic)
+            action_obj.action = np.asarray(a).reshape(n, self.act_dim)
+            self.record["transition_actor"] = "learner"
+        else:
+            action_obj.action = self.sample_random_actions(n)
+            self.record["transition_actor"] = "random"
+        self.t = self.t + n
+        return action_obj
+
     def register_reset(self, obs):
         """
         Same input/output as select_action, except this method is called at episodal reset.
@@ -122,12 +160,15 @@ class SACAgent(BaseAgent):
         pass
 
     def load_model(self, path):
-        """Load model from path.
+        """Load model from path, or from a state dict.
 
         Args:
-            path (str): Load model from path.
+            path (str or dict): Load model from path. A dict is loaded as a state dict, which may only contain the policy (as broadcast to workers).
         """
-        self.actor_critic.load_state_dict(torch.load(path))
+        if isinstance(path, dict):
+            self.actor_critic.load_state_dict(path, strict=False)
+        else:
+            self.actor_critic.load_state_dict(torch.load(path))
 
     def save_model(self, path):
         """Save model to path
@@ -147,8 +188,8 @@ class SACAgent(BaseAgent):
             data["done"],
         )
 
-        q1 = self.actor_critic.q1(o, a)
-        q2 = self.actor_critic.q2(o, a)
+        # All Q heads at once; a single pass with an EnsembleQfunction critic
+        q = self.actor_critic.q_values(o, a)
 
         # Bellman backup for Q functions
         with torch.no_grad():
@@ -156,19 +197,15 @@ class SACAgent(BaseAgent):
             a2, logp_a2 = self.actor_critic.pi(o2)
 
             # Target Q-values
-            q1_pi_targ = self.actor_critic_target.q1(o2, a2)
-            q2_pi_targ = self.actor_critic_target.q2(o2, a2)
-            q_pi_targ = torch.min(q1_pi_targ, q2_pi_targ)
+            q_pi_targ = self.actor_critic_target.q_values(o2, a2).min(dim=0).values
             backup = r + self.gamma * (1 - d) * (q_pi_targ - self.alpha * logp_a2)
 
         # MSE loss against Bellman backup
-        loss_q1 = ((q1 - backup) ** 2).mean()
-        loss_q2 = ((q2 - backup) ** 2).mean()
-        loss_q = loss_q1 + loss_q2
+        loss_q = sum(((q_head - backup) ** 2).mean() for q_head in q)
 
         # Useful info for logging
         q_info = dict(
-            Q1Vals=q1.detach().cpu().numpy(), Q2Vals=q2.detach().cpu().numpy()
+            Q1Vals=q[0].detach().cpu().numpy(), Q2Vals=q[1].detach().cpu().numpy()
         )
 
         return loss_q, q_info
@@ -177,9 +214,7 @@ class SACAgent(BaseAgent):
         """Set up function for computing SAC pi loss."""
         o = data["obs"]
         pi, logp_pi = self.actor_critic.pi(o)
-        q1_pi = self.actor_critic.q1(o, pi)
-        q2_pi = self.actor_critic.q2(o, pi)
-        q_pi = torch.min(q1_pi, q2_pi)
+        q_pi = self.actor_critic.q_values(o, pi).min(dim=0).values
 
         # Entropy-regularized policy loss
         loss_pi = (self.alpha * logp_pi - q_pi).mean()
@@ -189,6 +224,21 @@ class SACAgent(BaseAgent):
 
         return loss_pi, pi_info
 
+    @contextmanager
+    def frozen_critic(self):
+        """Disable gradients of the Q-networks for the duration of the block.
+
+        self.q_params is a list, not a one-shot iterator, so the critic is really frozen on every call.
+        """
+        for p in self.q_params:
+            p.requires_grad = False
+        try:
+            yield
+        finally:
+            # Unfreeze Q-networks so you can optimize it at next DDPG step.
+            for p in self.q_params:
+                p.requires_grad = True
+
     def update(self, data):
         """Update SAC Agent given data
 
@@ -201,27 +251,37 @@ class SACAgent(BaseAgent):
         loss_q.backward()
         self.q_optimizer.step()
 
-        # Freeze Q-networks so you don't waste computational effort
-        # computing gradients for them during the policy learning step.
-        for p in self.q_params:
-            p.requires_grad = False
+        # Next run one gradient descent step for pi, with the Q-networks frozen so
+        # that no effort is wasted computing gradients for them.
+        with self.frozen_critic():
+            self.pi_optimizer.zero_grad()
+            loss_pi, _ = self._compute_loss_pi(data)
+            loss_pi.backward()
+            self.pi_optimizer.step()
 
-        # Next run one gradient descent step for pi.
-        self.pi_optimizer.zero_grad()
-        loss_pi, _ = self._compute_loss_pi(data)
-        loss_pi.backward()
-        self.pi_optimizer.step()
+        # Finally, update target networks by polyak averaging:
+        # p_targ = polyak * p_targ + (1 - polyak) * p, in place and without temporaries.
+        with torch.no_grad():
+            self.flat_target_params.lerp_(self.flat_params, 1 - self.polyak)
 
-        # Unfreeze Q-networks so you can optimize it at next DDPG step.
-        for p in self.q_params:
-            p.requires_grad = True
 
-        # Finally, update target networks by polyak averaging.
-        with torch.no_grad():
-            for p, p_targ in zip(
-                self.actor_critic.parameters(), self.actor_critic_target.parameters()
-            ):
-                # NB: We use an in-place operations "mul_", "add_" to update target
-                # params, as opposed to "mul" and "add", which would make new tensors.
-                p_targ.data.mul_(self.polyak)
-                p_targ.data.add_((1 - self.polyak) * p.data)
+def flatten_parameters(module):
+    """Move the parameters of a module into one contiguous buffer and make each parameter a view of it.
+
+    In-place updates of the parameters (optimizer steps, load_state_dict) write through to the buffer
+    and vice versa. Call after moving the module to its device.
+
+    Args:
+        module (nn.Module): Module whose parameters to flatten.
+
+    Returns:
+        torch.Tensor: The flat buffer, ordered like module.parameters().
+    """
+    params = list(module.parameters())
+    flat = torch.cat([p.detach().reshape(-1) for p in params])
+    offset = 0
+    for p in params:
+        numel = p.numel()
+        p.data = flat[offset : offset + numel].view_as(p)
+        offset += numel
+    return flat
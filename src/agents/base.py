@@ -4,6 +4,8 @@ from ast import Not
 import numpy as np
 import gym
 
+from src.utils.utils import ActionSample
+
 
 class BaseAgent(ABC):
     """Base Agent Definition."""
@@ -32,6 +34,40 @@ class BaseAgent(ABC):
         """
         raise NotImplementedError
 
+    def select_actions(self, obs):
+        """Select one action per environment, for several environments stepped together.
+        Subclasses should override this with a single forward pass; by default it calls select_action per row.
+
+        Args:
+            obs (torch.Tensor): Observations of shape (n_envs, obs_dim).
+
+        Returns:
+            ActionSample: Action object whose fields are arrays with a leading n_envs axis
+        """
+        samples = [self.select_action(o) for o in obs]
+        batch = ActionSample()
+        for name in ("action", "value", "cost", "logp"):
+            values = [getattr(sample, name, None) for sample in samples]
+            if all(v is not None for v in values):
+                setattr(
+                    batch, name, np.stack([np.asarray(v).squeeze() for v in values])
+                )
+        return batch
+
+    def sample_random_actions(self, n) -> np.array:
+        """Sample n actions uniformly from the action space at once.
+
+        Args:
+            n (int): Number of actions
+
+        Returns:
+            np.array: Actions of shape (n, act_dim)
+        """
+        space = self.action_space
+        return space.np_random.uniform(
+            space.low, space.high, (n,) + space.shape
+        ).astype(space.dtype)
+
     def register_reset(self, obs) -> np.array:  # pragma: no cover
         """Handle reset of episode.
 
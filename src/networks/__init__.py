@@ -1,3 +1,10 @@
 """Network definitions"""
-from .critic import Qfunction, ActorCritic, Vfunction
+
+from .critic import (
+    Qfunction,
+    EnsembleQfunction,
+    ActorCritic,
+    ConstraintActorCritic,
+    Vfunction,
+)
 from .pets import DynamicsNetwork
@@ -5,7 +5,7 @@ import numpy as np
 import torch.nn.functional as F
 from torch.distributions import Normal
 from enum import Enum
-from typing import List
+from typing import Final, List
 from src.config.yamlize import (
     yamlize,
     ConfigurableDict,
@@ -242,6 +242,151 @@ class Qfunction(nn.Module):
         return out.view(-1)
 
 
+class EnsembleLinear(nn.Module):
+    """A stack of independent linear layers evaluated with one batched matmul,
+    like ``Ensemble_FC_Layer`` in pets.py but initialized like ``nn.Linear``."""
+
+    def __init__(self, in_features, out_features, ensemble_size):
+        """Initialize stacked weights
+
+        Args:
+            in_features (int): Input dimension
+            out_features (int): Output dimension
+            ensemble_size (int): Number of stacked layers
+        """
+        super().__init__()
+        self.weight = nn.Parameter(
+            torch.empty(ensemble_size, in_features, out_features)
+        )
+        self.bias = nn.Parameter(torch.empty(ensemble_size, 1, out_features))
+        bound = 1 / np.sqrt(in_features)
+        nn.init.uniform_(self.weight, -bound, bound)
+        nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x):
+        """Apply every layer to its own slice of x
+
+        Args:
+            x (torch.Tensor): Input of shape (ensemble_size, bs, in_features)
+
+        Returns:
+            torch.Tensor: Output of shape (ensemble_size, bs, out_features)
+        """
+        return torch.baddbmm(self.bias, x, self.weight)
+
+
+def ensemble_mlp(sizes, ensemble_size, activation=nn.ReLU):
+    """Generate an ensemble of MLPs with the layout of mlp(sizes)
+
+    Args:
+        sizes (list[int]): List of sizes
+        ensemble_size (int): Number of MLPs
+        activation (nn.Module, optional): Activation function for hidden layers. Defaults to nn.ReLU.
+
+    Returns:
+        nn.Module: Ensemble MLP mapping (ensemble_size, bs, sizes[0]) to (ensemble_size, bs, sizes[-1])
+    """
+    layers = []
+    for j in range(len(sizes) - 1):
+        act = activation if j < len(sizes) - 2 else nn.Identity
+        layers += [EnsembleLinear(sizes[j], sizes[j + 1], ensemble_size), act()]
+    return nn.Sequential(*layers)
+
+
+@yamlize
+class EnsembleQfunction(nn.Module):
+    """Several Qfunction critics with stacked weights, evaluated together in one batched matmul per layer."""
+
+    def __init__(
+        self,
+        state_dim: int = 32,
+        action_dim: int = 2,
+        speed_encoder_hiddens: List[int] = [8, 8],
+        fusion_hiddens: List[int] = [32, 64, 64, 32, 32],
+        use_speed: bool = True,
+        ensemble_size: int = 2,
+    ):
+        """Initialize an ensemble of Q (State, Action) -> Value Regressors
+
+        Args:
+            state_dim (int, optional): State dimension. Defaults to 32.
+            action_dim (int, optional): Action dimension. Defaults to 2.
+            speed_encoder_hiddens (List[int], optional): List of hidden layer dims for the speed encoder. Defaults to [8,8].
+            fusion_hiddens (List[int], optional): List of hidden layer dims for the fusion section. Defaults to [32,64,64,32,32].
+            use_speed (bool, optional): Whether to include a speed encoder or not. Defaults to True.
+            ensemble_size (int, optional): Number of Q heads, at least 2. Defaults to 2.
+        """
+        super().__init__()
+        if ensemble_size < 2:
+            # ActorCritic reads heads 0 and 1 as q1 and q2
+            raise ValueError(f"ensemble_size must be at least 2, got {ensemble_size}")
+
+        self.state_dim = state_dim
+        self.use_speed = use_speed
+        self.ensemble_size = ensemble_size
+
+        if use_speed:
+            self.speed_encoder = ensemble_mlp(
+                [1] + speed_encoder_hiddens, ensemble_size
+            )
+            self.regressor = ensemble_mlp(
+                [state_dim + speed_encoder_hiddens[-1] + action_dim]
+                + fusion_hiddens
+                + [1],
+                ensemble_size,
+            )
+        else:
+            self.regressor = ensemble_mlp(
+                [state_dim + action_dim] + fusion_hiddens + [1], ensemble_size
+            )
+
+    def forward(self, obs_feat: torch.Tensor, action: torch.Tensor) -> torch.Tensor:
+        """Get (s,a) value estimates of every head
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+            action (torch.Tensor): Action tensor (bs, action_dim)
+
+        Returns:
+            value: torch.Tensor of dim (ensemble_size, bs)
+        """
+        obs_feat = obs_feat.reshape(-1, obs_feat.shape[-1])
+        action = action.reshape(-1, action.shape[-1])
+        expand = lambda x: x.unsqueeze(0).expand(self.ensemble_size, *x.shape)
+
+        if self.use_speed:
+            img_embed = obs_feat[..., : self.state_dim]
+            spd_embed = self.speed_encoder(expand(obs_feat[..., self.state_dim :]))
+            out = self.regressor(
+                torch.cat([expand(img_embed), spd_embed, expand(action)], dim=-1)
+            )
+        else:
+            out = self.regressor(
+                expand(torch.cat([obs_feat[..., : self.state_dim], action], dim=-1))
+            )
+
+        return out.squeeze(-1)
+
+
+class QHead(nn.Module):
+    """One head of an EnsembleQfunction, callable like a Qfunction. It owns no parameters; they belong to the ensemble."""
+
+    def __init__(self, ensemble, index):
+        """Initialize head
+
+        Args:
+            ensemble (EnsembleQfunction): The ensemble, not registered as a submodule.
+            index (int): Head index
+        """
+        super().__init__()
+        self._ensemble = [ensemble]
+        self.index = index
+
+    def forward(self, obs_feat, action):
+        """Get (s,a) value estimates of this head. Use ActorCritic.q_values to get all heads at once."""
+        return self._ensemble[0](obs_feat, action)[self.index]
+
+
 @yamlize
 class Vfunction(nn.Module):
     """ "Multimodal Architecture Fusing State, and a Speed Embedding together to regress rewards."""
@@ -295,6 +440,133 @@ class Vfunction(nn.Module):
         return out.view(-1)
 
 
+class ActModule(nn.Module):
+    """Acting forward of an ActorCritic without the distribution object and log-prob path, written to compile with TorchScript.
+
+    It shares its parameters with the actor-critic, so weights loaded into the actor-critic take effect without compiling again.
+    """
+
+    # TorchScript cannot read module globals, so the log std bounds are constants here
+    log_std_min: Final[float]
+    log_std_max: Final[float]
+
+    def __init__(self, actor_critic):
+        """Initialize from an actor-critic
+
+        Args:
+            actor_critic (ActorCritic): Actor-critic whose policy and speed encoder to use.
+        """
+        super().__init__()
+        self.state_dim = actor_critic.state_dim
+        self.use_speed = actor_critic.use_speed
+        self.speed_encoder = (
+            actor_critic.speed_encoder if actor_critic.use_speed else nn.Identity()
+        )
+        self.net = actor_critic.policy.net
+        self.mu_layer = actor_critic.policy.mu_layer
+        self.log_std_layer = actor_critic.policy.log_std_layer
+        self.act_limit = float(actor_critic.policy.act_limit)
+        self.log_std_min = float(LOG_STD_MIN)
+        self.log_std_max = float(LOG_STD_MAX)
+
+    def forward(self, obs_feat: torch.Tensor, deterministic: bool = False):
+        """Get action from obs, like ActorCritic.act but returning a tensor.
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+            deterministic (bool, optional): Whether to use means instead of sampling. Defaults to False.
+
+        Returns:
+            torch.Tensor: Actions of dim (bs, act_dim)
+        """
+        mu, log_std = self.mean_log_std(obs_feat)
+        if deterministic:
+            pi_action = mu
+        else:
+            pi_action = mu + torch.exp(log_std) * torch.randn_like(mu)
+        return self.act_limit * torch.tanh(pi_action)
+
+    def mean_log_std(self, obs_feat: torch.Tensor):
+        """Get the parameters of the pre-squash Gaussian.
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+
+        Returns:
+            tuple: Tuple of mean, clamped log std, each of dim (bs, act_dim)
+        """
+        feat = obs_feat[..., : self.state_dim]
+        if self.use_speed:
+            speed = self.speed_encoder(obs_feat[..., self.state_dim :])
+            feat = torch.cat([feat, speed], dim=-1)
+
+        net_out = self.net(feat)
+        mu = self.mu_layer(net_out)
+        log_std = torch.clamp(
+            self.log_std_layer(net_out), self.log_std_min, self.log_std_max
+        )
+        return mu, log_std
+
+
+class PolicyDistribution(nn.Module):
+    """The policy of an ActorCritic as its pre-squash Gaussian, for trust-region updates with torch.func (see PCPOAgent).
+
+    It shares its parameters with the actor-critic. Only the parameters under ``policy`` are updated; the speed encoder is treated as fixed.
+    """
+
+    def __init__(self, actor_critic):
+        """Initialize from an actor-critic
+
+        Args:
+            actor_critic (ActorCritic): Actor-critic whose SquashedGaussianMLPActor and speed encoder to use.
+        """
+        super().__init__()
+        self.state_dim = actor_critic.state_dim
+        self.use_speed = actor_critic.use_speed
+        if self.use_speed:
+            self.speed_encoder = actor_critic.speed_encoder
+        self.policy = actor_critic.policy
+
+    def forward(self, obs_feat):
+        """Get the pre-squash Gaussian at obs.
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+
+        Returns:
+            Normal: Distribution over pre-squash actions of dim (bs, act_dim)
+        """
+        feat = obs_feat[..., : self.state_dim]
+        if self.use_speed:
+            speed = self.speed_encoder(obs_feat[..., self.state_dim :]).detach()
+            feat = torch.cat([feat, speed], dim=-1)
+
+        net_out = self.policy.net(feat)
+        mu = self.policy.mu_layer(net_out)
+        log_std = torch.clamp(
+            self.policy.log_std_layer(net_out), LOG_STD_MIN, LOG_STD_MAX
+        )
+        # Argument validation branches on tensor values, which torch.func cannot trace
+        return Normal(mu, torch.exp(log_std), validate_args=False)
+
+    def unsquash(self, act, logp):
+        """Map squashed actions and their log-probs, as returned by the policy, to pre-squash actions and their log-probs under forward.
+        Log-prob differences, and so probability ratios, are unchanged.
+
+        Args:
+            act (torch.Tensor): Squashed actions (bs, act_dim)
+            logp (torch.Tensor): Their log-probs (bs,)
+
+        Returns:
+            tuple: Tuple of pre-squash actions, log-probs
+        """
+        eps = 1e-6
+        u = torch.atanh(torch.clamp(act / self.policy.act_limit, -1 + eps, 1 - eps))
+        # Undo the tanh correction of SquashedGaussianMLPActor
+        logp = logp + (2 * (np.log(2) - u - F.softplus(-2 * u))).sum(axis=-1)
+        return u, logp
+
+
 class ActivationType(Enum):
     """
     Enum class to indicate the type of activation
@@ -364,9 +636,37 @@ class ActorCritic(nn.Module):
             self.q2 = create_configurable_from_dict(
                 critic_cfg, NameToSourcePath.network
             )
+        elif critic_cfg["name"] == "EnsembleQfunction":
+            self.q = create_configurable_from_dict(critic_cfg, NameToSourcePath.network)
+            self.q1 = QHead(self.q, 0)
+            self.q2 = QHead(self.q, 1)
         elif critic_cfg["name"] == "Vfunction":
             self.v = create_configurable_from_dict(critic_cfg, NameToSourcePath.network)
 
+    def q_values(self, obs_feat, action):
+        """Evaluate every Q head, in a single pass for an EnsembleQfunction critic.
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+            action (torch.Tensor): Action tensor (bs, action_dim)
+
+        Returns:
+            torch.Tensor: Values of dim (n_heads, bs)
+        """
+        if hasattr(self, "q"):
+            return self.q(obs_feat, action)
+        return torch.stack([self.q1(obs_feat, action), self.q2(obs_feat, action)])
+
+    def q_parameters(self):
+        """Parameters of all Q heads.
+
+        Returns:
+            list: List of parameters
+        """
+        if hasattr(self, "q"):
+            return list(self.q.parameters())
+        return list(self.q1.parameters()) + list(self.q2.parameters())
+
     def pi(self, obs_feat, deterministic=False):
         """
         Wrapper around the policy. Helps manage dimensions and add/remove features from the input space.
@@ -389,6 +689,39 @@ class ActorCritic(nn.Module):
             )
         return self.policy(feat, deterministic, True)
 
+    def value_heads(self):
+        """State-value heads evaluated by fused_step.
+
+        Returns:
+            list: List of Vfunction modules, empty for Q critics
+        """
+        return [self.v] if hasattr(self, "v") else []
+
+    def fused_step(self, obs_feat, deterministic=False):
+        """Single acting forward computing the action, its log-prob and every value head, with one copy to the host.
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+            deterministic (bool, optional): Whether to use means instead of rsample. Defaults to False.
+
+        Returns:
+            np.array: Packed array of dim (bs, act_dim + 1 + len(value_heads())) with columns action, logp, then one per value head
+        """
+        with torch.inference_mode():
+            a, logp = self.pi(obs_feat, deterministic)
+            columns = [a, logp.unsqueeze(-1)]
+            columns += [head(obs_feat).unsqueeze(-1) for head in self.value_heads()]
+            packed = torch.cat(columns, dim=-1)
+        return packed.cpu().numpy()
+
+    def compile_act(self):
+        """Compile the acting forward with TorchScript. Compile once; loading new weights into this module updates it.
+
+        Returns:
+            torch.jit.ScriptModule: An ActModule mapping (obs_feat, deterministic) to actions
+        """
+        return torch.jit.script(ActModule(self))
+
     def act(self, obs_feat, deterministic=False):
         """
         Uses the policy to get and return an action on the appropriate device in the right format.
@@ -451,6 +784,14 @@ class ConstraintActorCritic(ActorCritic):
         
         self.c  = create_configurable_from_dict(critic_cfg, NameToSourcePath.network)
 
+    def value_heads(self):
+        """Value and cost heads evaluated by fused_step.
+
+        Returns:
+            list: List of [v, c]
+        """
+        return [self.v, self.c]
+
     def pi(self, obs_feat, deterministic=False):
         """
         Wrapper around the policy. Helps manage dimensions and add/remove features from the input space.
@@ -478,35 +819,19 @@ class ConstraintActorCritic(ActorCritic):
         """
         Uses the policy to get and return an action on the appropriate device in the right format.
         """
-        # if obs_feat.ndimension() == 1:
-        #    obs_feat = obs_feat.unsqueeze(0)
-        with torch.no_grad():
-            if self.use_speed:
-                img_embed = obs_feat[..., : self.state_dim]
-                speed = self.speed_encoder(obs_feat[..., self.state_dim :])
-                feat = torch.cat([img_embed, speed], dim=-1)
-            else:
-                img_embed = obs_feat[..., : self.state_dim]  # n x latent_dims
-                feat = torch.cat(
-                    [
-                        img_embed,
-                    ],
-                    dim=-1,
-                )
-            a, logp_a = self.policy(feat, deterministic, False)
+        # One forward under inference_mode; the value and cost heads read the
+        # raw features, as they have their own speed encoders
+        packed = self.fused_step(obs_feat, deterministic)
+        act_dim = self.policy.mu_layer.out_features
+        a = packed[..., :act_dim]
+        if a.shape[0] == 1:
+            # Like torch's squeeze(0), which np.squeeze(0) only matches for one row
             a = a.squeeze(0)
-
-        v = self.v(feat)
-        c = self.c(feat)
-
-        a = a.numpy() if a.device == "cpu" else a.cpu().numpy()
-        logp_a = logp_a.numpy() if logp_a.device == "cpu" else logp_a.cpu().numpy()
-        v =  v.numpy() if v.device == "cpu" else v.cpu().numpy()
-        c = c.numpy() if c.device == "cpu" else c.cpu().numpy()
+        logp_a, v, c = (packed[..., act_dim + i] for i in range(3))
         return a, v, c, logp_a
     
     def act(self, obs_feat, deterministic = False):
-        return self.step(obs_feat)[0]
+        return self.step(obs_feat, deterministic)[0]
     
     def forward(self,
                 obs: torch.Tensor
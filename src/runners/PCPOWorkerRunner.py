@@ -34,10 +34,11 @@ class WorkerRunner(BaseRunner):
 
         Args:
             env (_type_): _description_
-            agent (_type_): some agent
+            agent_params: policy weights to load, or None to keep acting with the loaded ones
             is_train: Whether to collect data in train mode or eval mode
         """
-        self.agent.load_model(agent_params)
+        if agent_params is not None:
+            self.agent.load_model(agent_params)
         t = 0
         done = False
         state_encoded = env.reset()
@@ -1,7 +1,11 @@
+import logging
+
 from src.runners.base import BaseRunner
 
 from src.config.yamlize import create_configurable, NameToSourcePath, yamlize
 from src.constants import DEVICE
+from src.utils import onnx_backend
+from src.utils import quantization
 
 from torch.optim import Adam
 
@@ -14,8 +18,24 @@ class WorkerRunner(BaseRunner):
     """
 
     def __init__(
-        self, agent_config_path: str, buffer_config_path: str, max_episode_length: int
+        self,
+        agent_config_path: str,
+        buffer_config_path: str,
+        max_episode_length: int,
+        inference_backend: str = "torch",
+        calibration_frames: str = "",
+        compile_act: bool = True,
     ):
+        """Initialize worker runner
+
+        Args:
+            agent_config_path (str): Agent config path
+            buffer_config_path (str): Buffer config path
+            max_episode_length (int): Max episode length
+            inference_backend (str, optional): "torch", "onnxruntime" to act and encode through ONNX exports of the policy and encoder (the learner exports the policy once per version with policy_broadcast "onnx"), or "int8" to act and encode with int8 quantized copies of them. Falls back to torch when onnxruntime is not installed. Defaults to "torch".
+            calibration_frames (str, optional): .npy or .npz file of raw camera frames to calibrate the int8 encoder on. If '', the int8 backend keeps the encoder in float32. Defaults to ''.
+            compile_act (bool, optional): With the torch backend, act through a TorchScript-compiled policy forward, whatever the agent config says. Defaults to True.
+        """
         super().__init__()
         # Moved initialization of env to run to allow for yamlization of this class.
         # This would allow a common runner for all model-free approaches
@@ -25,8 +45,30 @@ class WorkerRunner(BaseRunner):
         self.buffer_config_path = buffer_config_path
         self.max_episode_length = max_episode_length
 
+        if inference_backend not in ("torch", "onnxruntime", "int8"):
+            raise ValueError(f"Unknown inference_backend: {inference_backend}")
+        if inference_backend == "onnxruntime" and not onnx_backend.available():
+            logging.warning("onnxruntime is not installed; acting with torch")
+            inference_backend = "torch"
+        self.inference_backend = inference_backend
+        self.calibration_frames = calibration_frames
+        self.encoder_converted = False
+
         ## AGENT Declaration
-        self.agent = create_configurable(self.agent_config_path, NameToSourcePath.agent)
+        if self.inference_backend == "onnxruntime":
+            # Acts with the exports the learner broadcasts, without torch networks
+            self.agent = onnx_backend.OnnxAgent.from_agent_config(self.agent_config_path)
+        else:
+            self.agent = create_configurable(
+                self.agent_config_path, NameToSourcePath.agent
+            )
+        # Compiled once; loading new weights into the actor-critic updates it
+        if (
+            compile_act
+            and self.inference_backend == "torch"
+            and getattr(self.agent, "act_module", False) is None
+        ):
+            self.agent.act_module = self.agent.actor_critic.compile_act()
 
     def run(self, env, agent_params, is_train):
         """Grab data for system that's needed, and send a buffer accordingly. Note: does a single 'episode'
@@ -34,10 +76,18 @@ class WorkerRunner(BaseRunner):
 
         Args:
             env (_type_): _description_
-            agent (_type_): some agent
+            agent_params: policy weights to load, or None to keep acting with the loaded ones
             is_train: Whether to collect data in train mode or eval mode
         """
-        self.agent.load_model(agent_params)
+        if agent_params is not None:
+            # OnnxAgent loads ONNX exports, or exports weights, by itself
+            self.agent.load_model(agent_params)
+            # Convert once per policy version; agents without act_module act with torch
+            if self.inference_backend == "int8" and hasattr(self.agent, "act_module"):
+                self.agent.act_module = self.convert_policy(self.agent.actor_critic)
+        if self.inference_backend != "torch" and not self.encoder_converted:
+            env.encoder = self.convert_encoder(env.encoder)
+            self.encoder_converted = True
         t = 0
         done = False
         state_encoded = env.reset()
@@ -71,3 +121,17 @@ class WorkerRunner(BaseRunner):
         info["metrics"]["reward"] = ep_ret
         print(info["metrics"])
         return deepcopy(self.replay_buffer), info["metrics"]
+
+    def convert_policy(self, actor_critic):
+        """Build the int8 act module from the float32 policy."""
+        return quantization.quantize_policy(actor_critic)
+
+    def convert_encoder(self, vae):
+        """Build the encoder of the inference backend from the float32 VAE."""
+        if self.inference_backend == "onnxruntime":
+            return onnx_backend.OnnxEncoder.from_module(vae)
+        if self.calibration_frames == "":
+            logging.warning("No calibration_frames; keeping the encoder in float32")
+            return vae
+        frames = quantization.load_frames(self.calibration_frames)
+        return quantization.QuantizedEncoder(vae, frames)
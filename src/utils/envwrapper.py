@@ -9,11 +9,12 @@ import gym
 class EnvContainer:
     """Container for the pip-installed L2R Environment."""
 
-    def __init__(self, encoder=None):
+    def __init__(self, encoder=None, env=None):
         """Initialize container around encoder object
 
         Args:
             encoder (nn.Module, optional): Encoder object to encoder inputs. Defaults to None.
+            env (gym.env, optional): Environment to wrap. Defaults to None.
         """
         self.encoder = encoder
         self.env = env
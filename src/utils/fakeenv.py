@@ -0,0 +1,200 @@
+"""A stand-in for the L2R ``RacingEnv`` that needs neither the simulator nor its
+sockets. It follows the same ``reset``/``step`` contract and observation format,
+so the whole worker to learner pipeline can be benchmarked and profiled on any
+Linux host."""
+
+import os
+import time
+
+import gym
+import numpy as np
+
+# The keys runners read from info["metrics"] at the end of an episode
+METRIC_KEYS = (
+    "pct_complete",
+    "total_time",
+    "total_distance",
+    "average_speed_kph",
+    "average_displacement_error",
+    "trajectory_efficiency",
+    "trajectory_admissibility",
+    "movement_smoothness",
+    "timestep/sec",
+    "laps_completed",
+    "num_infractions",
+)
+FRAME_MODES = ("static", "noise", "random")
+FAKE_ENV_ARGS = (
+    "width",
+    "height",
+    "max_timesteps",
+    "step_latency",
+    "frame_mode",
+    "seed",
+)
+
+
+class FakeRacingEnv(gym.Env):
+    """Emits ``CameraFrontRGB`` frames and poses shaped like the simulator's
+
+    Args:
+        width: camera width
+        height: camera height
+        max_timesteps: the episode length
+        step_latency: seconds each ``step`` and ``reset`` sleeps, standing in for
+          the simulator's frame interval
+        frame_mode: how frames are generated, from cheapest to most expensive.
+          "static" returns the same frame every step, "noise" perturbs a band of
+          rows of it, and "random" draws a new frame every step.
+        seed: seed of the frame and pose generator
+    """
+
+    def __init__(
+        self,
+        width: int = 512,
+        height: int = 384,
+        max_timesteps: int = 5000,
+        step_latency: float = 0.0,
+        frame_mode: str = "static",
+        seed: int = 0,
+    ):
+        if frame_mode not in FRAME_MODES:
+            raise ValueError(f"Unknown frame_mode: {frame_mode}")
+
+        self.width = width
+        self.height = height
+        self.max_timesteps = max_timesteps
+        self.step_latency = step_latency
+        self.frame_mode = frame_mode
+        self.rng = np.random.default_rng(seed)
+
+        self.action_space = gym.spaces.Box(np.array([-1.0, -1.0]), np.array([1.0, 1.0]))
+        self.observation_space = gym.spaces.Dict(
+            {
+                "images": gym.spaces.Dict(
+                    {
+                        "CameraFrontRGB": gym.spaces.Box(
+                            0, 255, (height, width, 3), dtype=np.uint8
+                        )
+                    }
+                ),
+                "pose": gym.spaces.Box(-np.inf, np.inf, (30,), dtype=np.float64),
+            }
+        )
+
+        self.frame = self._random_frame()
+        self.pose = np.zeros(30)
+        self.t = 0
+        self.distance = 0.0
+        self.episode_start = time.time()
+
+    def _random_frame(self) -> np.ndarray:
+        return self.rng.integers(0, 256, (self.height, self.width, 3), dtype=np.uint8)
+
+    def _frame(self) -> np.ndarray:
+        if self.frame_mode == "random":
+            return self._random_frame()
+        frame = self.frame.copy()
+        if self.frame_mode == "noise":
+            row = self.rng.integers(0, self.height - 8)
+            frame[row : row + 8] = self.rng.integers(
+                0, 256, (8, self.width, 3), dtype=np.uint8
+            )
+        return frame
+
+    def _obs(self) -> dict:
+        return {"images": {"CameraFrontRGB": self._frame()}, "pose": self.pose.copy()}
+
+    def reset(self, random_pos: bool = False) -> dict:
+        """Start a new episode
+
+        Args:
+            random_pos (bool, optional): Accepted for compatibility. Defaults to False.
+
+        Returns:
+            dict: Observation with "images" and "pose".
+        """
+        time.sleep(self.step_latency)
+        self.t = 0
+        self.distance = 0.0
+        self.episode_start = time.time()
+        self.pose = np.zeros(30)
+        return self._obs()
+
+    def step(self, action: np.ndarray) -> tuple:
+        """Advance one timestep; throttle (``action[1]``) sets the speed
+
+        Args:
+            action (np.array): Steering and acceleration.
+
+        Returns:
+            tuple: Tuple of obs, reward, done, info
+        """
+        time.sleep(self.step_latency)
+        self.t += 1
+        steering, throttle = np.clip(np.asarray(action, dtype=np.float64), -1, 1)[:2]
+
+        # Velocity lives at pose[3:6], which is where EnvContainer reads speed
+        speed = max(0.0, np.linalg.norm(self.pose[3:6]) + throttle)
+        heading = self.pose[12] + 0.1 * steering
+        self.pose[3:6] = (speed * np.cos(heading), speed * np.sin(heading), 0.0)
+        self.pose[12] = heading
+        self.pose[15:18] += self.pose[3:6] * 0.1
+        self.distance += speed * 0.1
+
+        reward = float(speed * 0.1)
+        done = self.t >= self.max_timesteps
+        info = {"metrics": self.metrics()} if done else {}
+        return self._obs(), reward, done, info
+
+    def metrics(self) -> dict:
+        """Episode metrics with every key the runners read"""
+        elapsed = max(time.time() - self.episode_start, 1e-9)
+        metrics = dict.fromkeys(METRIC_KEYS, 0.0)
+        metrics.update(
+            {
+                "total_time": elapsed,
+                "total_distance": self.distance,
+                "average_speed_kph": 3.6 * self.distance / (max(self.t, 1) * 0.1),
+                "timestep/sec": self.t / elapsed,
+                "laps_completed": 0,
+                "num_infractions": 0,
+            }
+        )
+        return metrics
+
+
+def build_fake_env(env_kwargs: dict = None, camera_cfg: list = None, **kwargs):
+    """Build a ``FakeRacingEnv`` from ``l2r.build_env`` arguments
+
+    Args:
+        env_kwargs (dict, optional): ``max_timesteps`` is honoured, the rest ignored.
+        camera_cfg (list, optional): ``Width`` and ``Height`` of the first camera.
+        **kwargs: other ``build_env`` arguments (ignored), or ``FakeRacingEnv``
+          arguments.
+
+    Returns:
+        FakeRacingEnv: The environment.
+    """
+    options = {k: v for k, v in kwargs.items() if k in FAKE_ENV_ARGS}
+    if env_kwargs and "max_timesteps" in env_kwargs:
+        options.setdefault("max_timesteps", env_kwargs["max_timesteps"])
+    if camera_cfg:
+        options.setdefault("width", camera_cfg[0]["Width"])
+        options.setdefault("height", camera_cfg[0]["Height"])
+    return FakeRacingEnv(**options)
+
+
+def fake_env_from_environ():
+    """``FakeRacingEnv`` arguments when ``L2R_FAKE_ENV=1``, read from
+    ``L2R_FAKE_ENV_LATENCY`` and ``L2R_FAKE_ENV_FRAMES``; otherwise None
+
+    Returns:
+        dict: Extra ``build_fake_env`` arguments, or None to use the simulator.
+    """
+    if os.environ.get("L2R_FAKE_ENV", "0") != "1":
+        return None
+    return {
+        "step_latency": float(os.environ.get("L2R_FAKE_ENV_LATENCY", 0.0)),
+        "frame_mode": os.environ.get("L2R_FAKE_ENV_FRAMES", "static"),
+    }
@@ -0,0 +1,294 @@
+"""ONNX export of the networks a worker acts with, the policy and the VAE encoder,
+and onnxruntime stand-ins for them.
+
+Only the deterministic parts of the networks are exported. Sampling from the
+policy Gaussian, tanh squashing and the VAE reparameterization run in numpy.
+onnxruntime is optional; check ``available()`` before building a stand-in.
+
+The learner can export the policy once per version and broadcast the export
+(``pack_export``), so that workers load it into ``OnnxAgent`` without building
+any torch networks.
+"""
+
+import io
+from copy import deepcopy
+
+import numpy as np
+import torch
+import torch.nn as nn
+import yaml
+from gym.spaces import Box
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+from src.config.yamlize import NameToSourcePath
+from src.config.yamlize import create_configurable
+from src.encoders.transforms.preprocessing import crop_resize_center
+from src.networks.critic import ActModule
+from src.utils.utils import ActionSample
+
+OPSET_VERSION = 13
+
+
+def available():
+    """Whether onnxruntime is installed"""
+    return onnxruntime is not None
+
+
+class _PolicyHead(nn.Module):
+    """Exportable policy: observation features to the mean and log std of the
+    pre-squash Gaussian"""
+
+    def __init__(self, actor_critic):
+        super().__init__()
+        self.act = ActModule(actor_critic)
+
+    def forward(self, obs_feat):
+        return self.act.mean_log_std(obs_feat)
+
+
+class _EncoderHead(nn.Module):
+    """Exportable VAE encoder: preprocessed images to latent mean and log variance"""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.encoder = vae.encoder
+        self.fc1 = vae.fc1
+        self.fc2 = vae.fc2
+
+    def forward(self, x):
+        h = self.encoder(x)
+        return self.fc1(h), self.fc2(h)
+
+
+def _export(module, example, f, input_name, output_names):
+    # Export a cpu copy, so that the exported module stays where it is
+    module = deepcopy(module).cpu().eval()
+    batch = {0: "batch"}
+    torch.onnx.export(
+        module,
+        example,
+        f,
+        input_names=[input_name],
+        output_names=output_names,
+        dynamic_axes={name: batch for name in [input_name] + output_names},
+        opset_version=OPSET_VERSION,
+    )
+
+
+def export_policy(actor_critic, f):
+    """Write the acting part of an actor-critic (speed encoder and policy head) to ONNX.
+
+    Args:
+        actor_critic (ActorCritic): Actor-critic to export.
+        f (str or file-like): Destination.
+    """
+    obs_dim = actor_critic.state_dim + (1 if actor_critic.use_speed else 0)
+    _export(
+        _PolicyHead(actor_critic),
+        torch.zeros(1, obs_dim),
+        f,
+        "obs",
+        ["mu", "log_std"],
+    )
+
+
+def export_encoder(vae, f):
+    """Write the encoder half of a VAE to ONNX.
+
+    Args:
+        vae (VAE): VAE to export.
+        f (str or file-like): Destination.
+    """
+    _export(
+        _EncoderHead(vae),
+        torch.zeros(1, vae.im_c, vae.im_h, vae.im_w),
+        f,
+        "image",
+        ["mu", "logvar"],
+    )
+
+
+def _session(model):
+    options = onnxruntime.SessionOptions()
+    # Honour the thread budget the launcher gave the worker
+    options.intra_op_num_threads = torch.get_num_threads()
+    return onnxruntime.InferenceSession(
+        model, options, providers=["CPUExecutionProvider"]
+    )
+
+
+def _to_bytes(export, module):
+    f = io.BytesIO()
+    export(module, f)
+    return f.getvalue()
+
+
+def pack_export(actor_critic, state_dict=None):
+    """Export the policy of an actor-critic for broadcast to workers
+
+    Args:
+        actor_critic (ActorCritic): Actor-critic to export.
+        state_dict (dict, optional): Weights to export instead of the current ones. Defaults to None.
+
+    Returns:
+        dict: The ONNX model and action limit, for ``OnnxPolicy.from_export``.
+    """
+    if state_dict is not None:
+        actor_critic = deepcopy(actor_critic).cpu()
+        actor_critic.load_state_dict(state_dict)
+    return {
+        "mode": "onnx",
+        "model": _to_bytes(export_policy, actor_critic),
+        "act_limit": float(actor_critic.policy.act_limit),
+    }
+
+
+def is_export(policy):
+    """Whether a policy received from the learner was packed by ``pack_export``"""
+    return isinstance(policy, dict) and policy.get("mode") == "onnx"
+
+
+class OnnxPolicy:
+    """Stands in for ``ActorCritic.compile_act()``, evaluating the policy with onnxruntime.
+
+    Args:
+        model (bytes or str): ONNX model written by ``export_policy``, or its path.
+        act_limit (float, optional): Action limit. Defaults to 1.0.
+    """
+
+    def __init__(self, model, act_limit=1.0):
+        self.session = _session(model)
+        self.act_limit = act_limit
+        self.rng = np.random.default_rng()
+
+    @classmethod
+    def from_module(cls, actor_critic):
+        """Export an actor-critic and load it into a session"""
+        return cls.from_export(pack_export(actor_critic))
+
+    @classmethod
+    def from_export(cls, packed):
+        """Load an export written by ``pack_export`` into a session"""
+        return cls(packed["model"], packed["act_limit"])
+
+    def __call__(self, obs_feat, deterministic=False):
+        """Get action from obs, like ``ActModule``
+
+        Args:
+            obs_feat (torch.Tensor): Input encoded and concatenated with speed (bs, dim)
+            deterministic (bool, optional): Whether to use means instead of sampling. Defaults to False.
+
+        Returns:
+            torch.Tensor: Actions of dim (bs, act_dim), on cpu
+        """
+        obs = obs_feat.detach().cpu().numpy().astype(np.float32, copy=False)
+        mu, log_std = self.session.run(None, {"obs": obs})
+        if not deterministic:
+            noise = self.rng.standard_normal(mu.shape, dtype=np.float32)
+            mu = mu + np.exp(log_std) * noise
+        return torch.from_numpy(self.act_limit * np.tanh(mu))
+
+
+class OnnxEncoder:
+    """Stands in for a VAE in ``EnvContainer``, encoding images with onnxruntime.
+
+    Args:
+        model (bytes or str): ONNX model written by ``export_encoder``, or its path.
+    """
+
+    def __init__(self, model):
+        self.session = _session(model)
+        self.rng = np.random.default_rng()
+
+    @classmethod
+    def from_module(cls, vae):
+        """Export a VAE and load it into a session"""
+        return cls(_to_bytes(export_encoder, vae))
+
+    def encode(self, x):
+        """Encode an RGB image of shape (H, W, 3) like ``VAE.encode``
+
+        Returns:
+            torch.Tensor: Sampled latent of dim (1, z_dim), on cpu
+        """
+        h = crop_resize_center(x).unsqueeze(0).cpu().numpy()
+        mu, logvar = self.session.run(None, {"image": h})
+        noise = self.rng.standard_normal(mu.shape, dtype=np.float32)
+        return torch.from_numpy(mu + np.exp(0.5 * logvar) * noise)
+
+
+class OnnxAgent:
+    """Stands in for a worker's ``SACAgent``, acting only through an ``OnnxPolicy``.
+
+    Torch networks are only built if the learner sends weights rather than an
+    export, to export them locally.
+
+    Args:
+        actor_critic_cfg_path (str): Actor-critic config, to build one for exporting received weights.
+        steps_to_sample_randomly (int, optional): Steps acting uniformly at random before using the policy. Defaults to 0.
+    """
+
+    def __init__(self, actor_critic_cfg_path, steps_to_sample_randomly=0):
+        self.actor_critic_cfg_path = actor_critic_cfg_path
+        self.steps_to_sample_randomly = steps_to_sample_randomly
+        self.actor_critic = None
+        self.act_module = None
+
+        self.t = 0
+        self.deterministic = False
+        self.record = {"transition_actor": ""}
+        self.action_space = Box(-1, 1, (2,))
+
+    @classmethod
+    def from_agent_config(cls, agent_config_path):
+        """Read the acting parameters of a ``SACAgent`` config"""
+        with open(agent_config_path, "r") as f:
+            config = yaml.safe_load(f)["config"]
+        return cls(
+            config["actor_critic_cfg_path"],
+            int(config.get("steps_to_sample_randomly", 0)),
+        )
+
+    def select_action(self, obs):
+        """Select action from obs, like ``SACAgent.select_action``
+
+        Args:
+            obs (torch.Tensor): Observation to act on.
+
+        Returns:
+            ActionSample: Action object.
+        """
+        action_obj = ActionSample()
+        if self.t > self.steps_to_sample_randomly:
+            a = self.act_module(obs, self.deterministic)
+            action_obj.action = a.squeeze(0).numpy()
+            self.record["transition_actor"] = "learner"
+        else:
+            action_obj.action = self.action_space.sample()
+            self.record["transition_actor"] = "random"
+        self.t = self.t + 1
+        return action_obj
+
+    def register_reset(self, obs):
+        pass
+
+    def load_model(self, policy):
+        """Load a policy received from the learner
+
+        Args:
+            policy (dict): An export packed by ``pack_export``, or a (possibly partial) state dict.
+        """
+        if is_export(policy):
+            self.act_module = OnnxPolicy.from_export(policy)
+            return
+
+        if self.actor_critic is None:
+            self.actor_critic = create_configurable(
+                self.actor_critic_cfg_path, NameToSourcePath.network
+            )
+        self.actor_critic.load_state_dict(policy, strict=False)
+        self.act_module = OnnxPolicy.from_module(self.actor_critic)
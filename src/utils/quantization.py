@@ -0,0 +1,161 @@
+"""Int8 inference for CPU workers: dynamically quantized policy Linear layers and a
+statically quantized VAE encoder conv stack, calibrated on stored camera frames.
+
+Both are built from copies of the float32 networks, so they must be rebuilt when
+the weights change. ``policy_error`` and ``encoder_error`` measure how far they
+drift from float32.
+"""
+
+from copy import deepcopy
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization
+
+from src.encoders.transforms.preprocessing import crop_resize_center
+from src.networks.critic import ActModule
+
+
+def quantize_policy(actor_critic):
+    """Quantize the acting forward of an actor-critic, with int8 weights and
+    dynamically quantized activations in every Linear layer.
+
+    Args:
+        actor_critic (ActorCritic): Actor-critic to quantize, left unchanged.
+
+    Returns:
+        nn.Module: An ActModule mapping (obs_feat, deterministic) to actions, on cpu
+    """
+    # Copy only the acting part, not the critics
+    act = deepcopy(ActModule(actor_critic)).cpu().eval()
+    return quantization.quantize_dynamic(act, {nn.Linear}, dtype=torch.qint8)
+
+
+class _EncoderHead(nn.Module):
+    """VAE encoder with quantization stubs around the conv stack; fc1 and fc2
+    stay in float32 to keep the latents accurate"""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.quant = quantization.QuantStub()
+        self.encoder = deepcopy(vae.encoder)
+        self.dequant = quantization.DeQuantStub()
+        self.fc1 = deepcopy(vae.fc1)
+        self.fc2 = deepcopy(vae.fc2)
+
+    def forward(self, x):
+        h = self.dequant(self.encoder(self.quant(x)))
+        return self.fc1(h), self.fc2(h)
+
+
+def preprocess(frames):
+    """Crop and resize raw camera frames for the VAE
+
+    Args:
+        frames (np.array): Frames of shape (N, 384, 512, 3).
+
+    Returns:
+        torch.Tensor: Images of shape (N, 3, 42, 144), on cpu
+    """
+    return torch.stack([crop_resize_center(frame).cpu() for frame in frames])
+
+
+class QuantizedEncoder:
+    """Stands in for a VAE in ``EnvContainer``, with an int8 conv stack.
+
+    Args:
+        vae (VAE): VAE to quantize, left unchanged.
+        frames (np.array): Raw camera frames of shape (N, 384, 512, 3) to calibrate
+            activation ranges on; a few hundred from real episodes suffice.
+        batch_size (int, optional): Calibration batch size. Defaults to 64.
+    """
+
+    def __init__(self, vae, frames, batch_size=64):
+        head = _EncoderHead(vae).cpu().eval()
+        head.qconfig = quantization.get_default_qconfig(torch.backends.quantized.engine)
+        head.fc1.qconfig = None
+        head.fc2.qconfig = None
+        # Conv + ReLU pairs become single quantized kernels
+        quantization.fuse_modules(
+            head.encoder, [["0", "1"], ["2", "3"], ["4", "5"], ["6", "7"]], inplace=True
+        )
+        quantization.prepare(head, inplace=True)
+        with torch.no_grad():
+            for start in range(0, len(frames), batch_size):
+                head(preprocess(frames[start : start + batch_size]))
+        self.head = quantization.convert(head)
+
+    def distribution(self, images):
+        """Latent mean and log variance of preprocessed images
+
+        Args:
+            images (torch.Tensor): Images of shape (N, 3, 42, 144).
+
+        Returns:
+            tuple: Tuple of mu, logvar, each of dim (N, z_dim)
+        """
+        with torch.no_grad():
+            return self.head(images.cpu())
+
+    def encode(self, x):
+        """Encode an RGB image of shape (H, W, 3) like ``VAE.encode``
+
+        Returns:
+            torch.Tensor: Sampled latent of dim (1, z_dim), on cpu
+        """
+        mu, logvar = self.distribution(crop_resize_center(x).unsqueeze(0))
+        return mu + torch.exp(0.5 * logvar) * torch.randn_like(mu)
+
+
+def policy_error(actor_critic, quantized, obs):
+    """Deviation of quantized deterministic actions from float32
+
+    Args:
+        actor_critic (ActorCritic): Float32 actor-critic.
+        quantized (nn.Module): Result of ``quantize_policy``.
+        obs (torch.Tensor): Encoded observations (bs, dim).
+
+    Returns:
+        dict: Max and mean absolute action error
+    """
+    with torch.no_grad():
+        expected = torch.as_tensor(actor_critic.act(obs, deterministic=True))
+        error = (quantized(obs.cpu(), True) - expected.cpu()).abs()
+    return {
+        "action_max_error": error.max().item(),
+        "action_mean_error": error.mean().item(),
+    }
+
+
+def encoder_error(vae, quantized, frames):
+    """Deviation of quantized latent means from float32
+
+    Args:
+        vae (VAE): Float32 VAE.
+        quantized (QuantizedEncoder): Its quantized encoder.
+        frames (np.array): Raw camera frames of shape (N, 384, 512, 3), ideally
+            not the calibration frames.
+
+    Returns:
+        dict: Max and mean absolute latent error, and the mean cosine similarity
+    """
+    images = preprocess(frames)
+    with torch.no_grad():
+        expected = vae.fc1(vae.encoder(images.to(next(vae.parameters()).device))).cpu()
+    mu, _ = quantized.distribution(images)
+    error = (mu - expected).abs()
+    cosine = nn.functional.cosine_similarity(mu, expected, dim=-1)
+    return {
+        "latent_max_error": error.max().item(),
+        "latent_mean_error": error.mean().item(),
+        "latent_cosine": cosine.mean().item(),
+    }
+
+
+def load_frames(path):
+    """Load stored camera frames from a .npy file, or the first array of a .npz file"""
+    frames = np.load(path)
+    if isinstance(frames, np.lib.npyio.NpzFile):
+        frames = frames[frames.files[0]]
+    return frames
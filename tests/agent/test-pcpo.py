@@ -0,0 +1,131 @@
+from copy import deepcopy
+
+import torch
+from src.agents.PCPOAgent import FisherVectorProduct
+from src.agents.PCPOAgent import PCPOAgent
+from src.agents.PCPOAgent import line_search_losses
+from src.networks.critic import PolicyDistribution
+
+
+def _agent():
+    return PCPOAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        cost_limit=25.0,
+        target_kl=0.01,
+        cg_damping=0.1,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/pcpo_config/network.yaml",
+    )
+
+
+def _batch(agent, n=16):
+    """A batch like PCPOBuffer.sample_batch, acted by the agent's policy"""
+    obs = torch.randn(n, 33)
+    with torch.no_grad():
+        act, log_p = agent.actor_critic.pi(obs)
+    return {
+        "obs": obs,
+        "act": act,
+        "log_p": log_p,
+        "adv": torch.randn(n),
+        "cost_adv": torch.randn(n),
+        "target_v": torch.randn(n),
+        "target_c": torch.randn(n),
+    }
+
+
+def test_line_search_losses_match_per_candidate_evaluation():
+    agent = _agent()
+    data = _batch(agent)
+    data["act"], data["log_p"] = agent.policy_dist.unsquash(data["act"], data["log_p"])
+    with torch.no_grad():
+        p_dist = agent.policy_dist(data["obs"])
+    flat = agent.policy_flat
+    theta_old = flat.values()
+    step_dir = 0.01 * torch.randn_like(theta_old)
+    thetas = theta_old + torch.tensor([1.0, 0.8, 0.64])[:, None] * step_dir
+
+    loss_rew, loss_cost, kl = line_search_losses(
+        agent.policy_dist, flat, thetas, data, p_dist, 0.01
+    )
+    # The policy itself is never modified
+    assert torch.equal(flat.values(), theta_old)
+
+    for i, theta in enumerate(thetas):
+        candidate = deepcopy(agent.actor_critic)
+        torch.nn.utils.vector_to_parameters(theta, candidate.policy.parameters())
+        with torch.no_grad():
+            dist = PolicyDistribution(candidate)(data["obs"])
+            log_p = dist.log_prob(data["act"]).sum(-1)
+            ratio = torch.exp(log_p - data["log_p"])
+            expected_rew = -(ratio * data["adv"]).mean() - 0.01 * dist.entropy().mean()
+            expected_kl = torch.distributions.kl.kl_divergence(p_dist, dist).mean()
+        assert torch.allclose(loss_rew[i], expected_rew, atol=1e-5)
+        assert torch.allclose(
+            loss_cost[i], (ratio * data["cost_adv"]).mean(), atol=1e-5
+        )
+        assert torch.allclose(kl[i], expected_kl, atol=1e-5)
+
+    # The agent's line search runs on the same policy
+    step, accepted = agent.adjust_cpo_step_direction(
+        step_dir, torch.zeros_like(step_dir), 2, p_dist, data, total_steps=3
+    )
+    assert step.shape == step_dir.shape and 0 <= accepted <= 3
+
+
+def test_unsquash_keeps_probability_ratios():
+    agent = _agent()
+    data = _batch(agent)
+    act, log_p = agent.policy_dist.unsquash(data["act"], data["log_p"])
+    with torch.no_grad():
+        dist = agent.policy_dist(data["obs"])
+    assert torch.allclose(dist.log_prob(act).sum(-1), log_p, atol=1e-4)
+
+
+def reference_fvp(policy, obs, p, damping):
+    """The double-backward Fisher-vector product PCPOAgent used before"""
+    params = list(policy.policy.parameters())
+    q_dist = policy(obs)
+    with torch.no_grad():
+        p_dist = policy(obs)
+    kl = torch.distributions.kl.kl_divergence(p_dist, q_dist).mean()
+    grads = torch.autograd.grad(kl, params, create_graph=True)
+    flat_grad_kl = torch.cat([g.view(-1) for g in grads])
+    grads = torch.autograd.grad((flat_grad_kl * p).sum(), params)
+    return torch.cat([g.reshape(-1) for g in grads]) + damping * p
+
+
+def test_fisher_vector_product_matches_double_backward():
+    agent = _agent()
+    obs = torch.randn(32, 33)
+    fvp = FisherVectorProduct(agent.policy_dist, obs, damping=0.1)
+
+    n = agent.policy_flat.values().numel()
+    # The linearization is reused across products
+    for _ in range(3):
+        p = torch.randn(n)
+        expected = reference_fvp(agent.policy_dist, obs, p, 0.1)
+        assert torch.allclose(fvp(p), expected, atol=1e-4)
+
+
+def test_update_on_constraint_actor_critic():
+    agent = _agent()
+    data = _batch(agent, n=64)
+    policy_before = agent.policy_flat.values()
+    v_before = [p.detach().clone() for p in agent.actor_critic.v.parameters()]
+    with torch.no_grad():
+        p_dist = agent.policy_dist(data["obs"])
+
+    agent.update(data=data)
+
+    # The accepted step moves the policy within the trust region
+    assert not torch.equal(agent.policy_flat.values(), policy_before)
+    with torch.no_grad():
+        q_dist = agent.policy_dist(data["obs"])
+    kl = torch.distributions.kl.kl_divergence(p_dist, q_dist).mean()
+    assert kl <= 1.5 * agent.target_kl
+    v_after = list(agent.actor_critic.v.parameters())
+    assert any(not torch.equal(a, b) for a, b in zip(v_after, v_before))
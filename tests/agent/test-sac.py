@@ -0,0 +1,120 @@
+import torch
+from src.agents.PCPOAgent import PCPOAgent
+from src.agents.PPOAgent import PPOAgent
+from src.agents.SACAgent import SACAgent
+from src.agents.SACAgent import flatten_parameters
+
+
+def test_flat_parameters_are_shared_views():
+    module = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    before = [p.detach().clone() for p in module.parameters()]
+    flat = flatten_parameters(module)
+
+    assert flat.numel() == sum(p.numel() for p in before)
+    assert all(torch.equal(p, b) for p, b in zip(module.parameters(), before))
+
+    # Optimizer steps write through to the flat buffer
+    optimizer = torch.optim.SGD(module.parameters(), lr=1.0)
+    module(torch.randn(5, 3)).sum().backward()
+    optimizer.step()
+    assert torch.equal(
+        flat, torch.cat([p.detach().reshape(-1) for p in module.parameters()])
+    )
+
+
+def test_flat_polyak_matches_per_parameter_update():
+    online = torch.nn.Linear(3, 2)
+    target = torch.nn.Linear(3, 2)
+    expected = [
+        0.995 * t + 0.005 * p for p, t in zip(online.parameters(), target.parameters())
+    ]
+
+    flat, flat_target = flatten_parameters(online), flatten_parameters(target)
+    with torch.no_grad():
+        flat_target.lerp_(flat, 1 - 0.995)
+    assert all(torch.allclose(t, e) for t, e in zip(target.parameters(), expected))
+
+
+def test_frozen_critic_gets_no_gradients():
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    batch = {"obs": torch.randn(8, 33)}
+
+    # Freezing works more than once
+    for _ in range(2):
+        agent.q_optimizer.zero_grad(set_to_none=True)
+        with agent.frozen_critic():
+            loss_pi, _ = agent._compute_loss_pi(batch)
+            loss_pi.backward()
+        assert all(p.grad is None for p in agent.q_params)
+        assert all(p.requires_grad for p in agent.q_params)
+
+
+def test_select_actions_batched():
+    agent = SACAgent(
+        steps_to_sample_randomly=4,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    obs = torch.randn(5, 33)
+
+    # Random warmup, sampled for all environments at once
+    random = agent.select_actions(obs)
+    assert random.action.shape == (5, 2) and agent.t == 5
+    assert agent.record["transition_actor"] == "random"
+
+    learned = agent.select_actions(obs)
+    assert learned.action.shape == (5, 2) and agent.t == 10
+    assert agent.record["transition_actor"] == "learner"
+    assert agent.select_actions(obs[:1]).action.shape == (1, 2)
+
+
+def test_ppo_select_actions_batched():
+    agent = PPOAgent(
+        steps_to_sample_randomly=4,
+        lr=0.003,
+        clip_ratio=0.2,
+        actor_critic_cfg_path="config_files/ppo_config/network.yaml",
+    )
+    obs = torch.randn(5, 33)
+
+    for actor in ["random", "learner"]:
+        batch = agent.select_actions(obs)
+        assert agent.record["transition_actor"] == actor
+        assert batch.action.shape == (5, 2)
+        assert batch.value.shape == batch.logp.shape == (5,)
+    assert agent.t == 10
+
+
+def test_pcpo_select_actions_batched():
+    agent = PCPOAgent(
+        steps_to_sample_randomly=4,
+        gamma=0.99,
+        alpha=0.2,
+        cost_limit=25.0,
+        target_kl=0.01,
+        cg_damping=0.1,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/pcpo_config/network.yaml",
+    )
+    obs = torch.randn(5, 33)
+
+    for actor in ["random", "learner"]:
+        batch = agent.select_actions(obs)
+        assert agent.record["transition_actor"] == actor
+        assert batch.action.shape == (5, 2)
+        assert batch.value.shape == batch.cost.shape == batch.logp.shape == (5,)
+    assert agent.t == 10
+
+    single = agent.select_actions(obs[:1])
+    assert single.action.shape == (1, 2) and single.cost.shape == (1,)
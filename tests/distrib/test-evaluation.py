@@ -0,0 +1,42 @@
+from distrib_l2r.asynchron.evaluation import EvalAggregator
+from distrib_l2r.asynchron.evaluation import EvalScheduler
+
+
+class ListLogger:
+    def __init__(self):
+        self.logged = []
+
+    def log(self, data):
+        self.logged.append(data)
+
+
+def test_eval_results_are_aggregated_per_version():
+    logger = ListLogger()
+    aggregator = EvalAggregator(loggers=[logger], flush_interval=3600)
+    aggregator.put({"reward": 1.0, "laps_completed": 1}, policy_version=3)
+    aggregator.put({"reward": 3.0, "laps_completed": 0}, policy_version=3)
+    aggregator.put({"reward": 5.0, "name": "ignored"}, policy_version=4)
+    aggregator.close()
+
+    stats = {s["eval/policy_version"]: s for s in logger.logged}
+    assert stats[3]["eval/episodes"] == 2
+    assert stats[3]["eval/reward/mean"] == 2.0
+    assert stats[3]["eval/reward/std"] == 1.0
+    assert stats[4]["eval/reward/max"] == 5.0
+    assert "eval/name/mean" not in stats[4]
+
+
+def test_eval_scheduler_assigns_exactly_k_episodes():
+    scheduler = EvalScheduler(eval_every=2, episodes=2)
+    scheduler.publish(1, "w1")
+    assert scheduler.assign() is None
+
+    scheduler.publish(2, "w2")
+    scheduler.publish(4, "w4")
+    assignments = [scheduler.assign() for _ in range(5)]
+    assert assignments == [(2, "w2"), (2, "w2"), (4, "w4"), (4, "w4"), None]
+
+    # Unreported episodes are reassigned after the timeout
+    scheduler.complete(2)
+    scheduler.timeout = -1
+    assert scheduler.assign() == (2, "w2")
@@ -0,0 +1,157 @@
+import threading
+
+import numpy as np
+import torch
+from distrib_l2r.api import InitMsg
+from distrib_l2r.asynchron.inference import BatchedInferenceServer
+from distrib_l2r.asynchron.inference import RemoteActor
+from distrib_l2r.asynchron.learner import AsyncLearningNode
+from distrib_l2r.quantize import unpack_policy
+from distrib_l2r.utils import send_data
+from src.agents.SACAgent import SACAgent
+
+
+class ScaleActor(torch.nn.Module):
+    """Acts with obs * scale, adding 1 when deterministic, and records batch sizes"""
+
+    def __init__(self):
+        super().__init__()
+        self.scale = torch.nn.Parameter(torch.ones(1))
+        self.batches = []
+        self.gate = None
+
+    def act(self, obs, deterministic=False):
+        self.batches.append(len(obs))
+        if self.gate is not None:
+            self.gate.wait()
+        return (obs * self.scale).detach().cpu().numpy() + float(deterministic)
+
+
+def _act_concurrently(server, observations, deterministic=False):
+    if not isinstance(deterministic, list):
+        deterministic = [deterministic] * len(observations)
+    results = [None] * len(observations)
+
+    def act(i):
+        results[i] = server.act(observations[i], deterministic[i])
+
+    threads = [threading.Thread(target=act, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_concurrent_requests_share_a_batch():
+    server = BatchedInferenceServer(ScaleActor(), deadline=0.5)
+    server.load({"scale": torch.full((1,), 2.0)}, policy_id=7)
+    observations = [torch.full((3,), float(i)) for i in range(8)]
+    deterministic = [i % 2 == 1 for i in range(8)]
+
+    results = _act_concurrently(server, observations, deterministic)
+
+    # Every caller gets the action for its own observation and mode
+    for i, (action, policy_id) in enumerate(results):
+        assert policy_id == 7
+        assert np.allclose(action, 2.0 * i + deterministic[i])
+    # Requests arriving within the deadline are evaluated together, one forward
+    # pass per acting mode
+    batches = server.actor_critic.batches
+    assert sum(batches) == 8 and len(batches) < 8
+
+
+def test_batches_are_split_at_max_batch_size():
+    server = BatchedInferenceServer(ScaleActor(), max_batch_size=3, deadline=0.5)
+    observations = [torch.full((3,), float(i)) for i in range(7)]
+
+    results = _act_concurrently(server, observations)
+
+    assert [float(action[0]) for action, _ in results] == list(range(7))
+    batches = server.actor_critic.batches
+    assert sum(batches) == 7 and max(batches) == 3
+
+
+def test_load_waits_for_the_batch_in_flight():
+    server = BatchedInferenceServer(ScaleActor(), deadline=0.01)
+    server.actor_critic.gate = threading.Event()
+    observations = [torch.ones(3)]
+
+    results = []
+    running = threading.Thread(
+        target=lambda: results.extend(_act_concurrently(server, observations))
+    )
+    running.start()
+    while not server.actor_critic.batches:
+        pass
+    loading = threading.Thread(
+        target=server.load, args=({"scale": torch.full((1,), 3.0)}, 1)
+    )
+    loading.start()
+    server.actor_critic.gate.set()
+    running.join(timeout=10)
+    loading.join(timeout=10)
+
+    # The batch in flight finishes with the version it started with
+    ((action, policy_id),) = results
+    assert np.allclose(action, 1.0) and policy_id == 0
+    action, policy_id = server.act(torch.ones(3))
+    assert np.allclose(action, 3.0) and policy_id == 1
+
+
+def _learner(monkeypatch, **kwargs):
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    learner = AsyncLearningNode(
+        agent=agent, server_address=("127.0.0.1", 0), central_inference=True, **kwargs
+    )
+    threading.Thread(target=learner.serve_forever, daemon=True).start()
+    return learner
+
+
+def test_remote_actor_acts_through_learner(monkeypatch):
+    learner = _learner(monkeypatch)
+    actor = RemoteActor(learner.socket.getsockname())
+    try:
+        # One connection serves every step of the episode
+        for _ in range(3):
+            assert actor.select_action(torch.randn(33)).action.shape == (2,)
+            assert actor.policy_id == 1
+
+        learner.update_agent()
+        actor.select_action(torch.randn(33))
+        assert actor.policy_id == 2
+    finally:
+        actor.close()
+        learner.shutdown()
+        learner.server_close()
+
+
+def test_central_inference_evaluations_carry_weights(monkeypatch):
+    learner = _learner(monkeypatch, eval_every=2, eval_episodes=1)
+    address = learner.socket.getsockname()
+    try:
+        learner.update_agent()
+        learner.update_agent()
+
+        # The scheduled version is not the latest, so the worker evaluates it
+        # locally with the weights the reply carries
+        reply = send_data(data=InitMsg(), addr=address, reply=True).data
+        assert not reply["is_train"] and reply["policy_id"] == 2
+        weights = unpack_policy(reply["policy"])
+        assert weights.keys() == learner.agent.actor_critic.state_dict().keys()
+
+        # Training episodes act through the learner
+        reply = send_data(data=InitMsg(), addr=address, reply=True).data
+        assert reply["is_train"] and reply["policy_id"] == 3
+        assert reply["policy"] is None
+    finally:
+        learner.shutdown()
+        learner.server_close()
@@ -0,0 +1,29 @@
+import sys
+from distrib_l2r.launcher import LocalLauncher
+
+# Reports 5 steps, then crashes
+CRASHING_WORKER = """
+from distrib_l2r.launcher import StepCounters
+index, counters = StepCounters.from_env()
+counters.add(index, 5)
+raise SystemExit(1)
+"""
+
+
+def test_restarts_crashed_workers():
+    launcher = LocalLauncher(
+        num_workers=2,
+        learner_cmd=None,
+        worker_cmd=[sys.executable, "-c", CRASHING_WORKER],
+        cpus_per_worker=1,
+        max_restarts=2,
+        report_interval=0.2,
+    )
+    launcher.start()
+    try:
+        # Returns once every worker has used up its restarts
+        launcher.monitor()
+        assert launcher.restarts == [2, 2]
+        assert launcher.counters.total() == 2 * 3 * 5
+    finally:
+        launcher.stop()
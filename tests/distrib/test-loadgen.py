@@ -0,0 +1,63 @@
+import threading
+import time
+
+from distrib_l2r.api import InitMsg
+from distrib_l2r.asynchron.learner import AsyncLearningNode
+from distrib_l2r.loadgen import make_buffer
+from distrib_l2r.loadgen import run_stage
+from distrib_l2r.loadgen import saturation_point
+from distrib_l2r.loadgen import with_version
+from distrib_l2r.utils import FRAME_HEADER
+from distrib_l2r.utils import encode_frame
+from src.agents.SACAgent import SACAgent
+
+
+def test_with_version_rewrites_header_only():
+    frame = encode_frame(InitMsg(sender="a"))
+    rewritten = with_version(frame, 42)
+    assert FRAME_HEADER.unpack_from(rewritten)[3] == 42
+    assert rewritten[FRAME_HEADER.size :] == frame[FRAME_HEADER.size :]
+
+
+def test_saturation_point():
+    def stage(workers, rate):
+        return {"workers": workers, "transitions_per_s": rate, "errors": 0}
+
+    stages = [stage(1, 100), stage(2, 195), stage(4, 380), stage(8, 420)]
+    assert saturation_point(stages) == 8
+    assert saturation_point(stages[:3]) is None
+
+
+def test_shm_stages_deliver_transitions(monkeypatch):
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    learner = AsyncLearningNode(
+        agent=agent, server_address=("127.0.0.1", 0), eval_every=1000
+    )
+    threading.Thread(target=learner.serve_forever, daemon=True).start()
+    address = learner.socket.getsockname()
+    try:
+        buffers = [make_buffer(20)]
+        # Each stage runs a new fake worker, which creates a new ring
+        stages = [
+            run_stage("shm", address, 1, 1.5, buffers, 0.05, 0.1) for _ in range(3)
+        ]
+        assert all(stage["transitions_per_s"] > 0 for stage in stages)
+
+        # Let the ingest pool catch up with the last requests
+        time.sleep(0.5)
+        received = []
+        while not learner.buffer_queue.empty():
+            received.append(len(learner.buffer_queue.get()[1]))
+        # Every ring reference is drained from the ring the worker wrote into
+        assert len(received) >= 3 and all(count == 20 for count in received)
+    finally:
+        learner.shutdown()
+        learner.server_close()
@@ -0,0 +1,35 @@
+import urllib.request
+from distrib_l2r.metrics import MetricsRegistry
+from distrib_l2r.metrics import MetricsServer
+
+
+def test_registry_renders_prometheus_text():
+    metrics = MetricsRegistry()
+    metrics.counter("buffers_received_total", "Buffers", rate=True)
+    metrics.gauge("queue_depth", "Depth", fn=lambda: 3)
+    metrics.gauge("last_seen", "Last seen")
+    metrics.histogram("update_seconds", "Update latency", buckets=(0.1, 1.0))
+
+    metrics.inc("buffers_received_total", 2)
+    metrics.set("last_seen", 10.0, worker="a:1")
+    metrics.observe("update_seconds", 0.5)
+
+    text = metrics.render()
+    assert "l2r_buffers_received_total 2" in text
+    assert "l2r_queue_depth 3" in text
+    assert 'l2r_last_seen{worker="a:1"} 10.0' in text
+    assert 'l2r_update_seconds_bucket{le="0.1"} 0' in text
+    assert 'l2r_update_seconds_bucket{le="1.0"} 1' in text
+    assert "l2r_buffers_received_total_per_second" in text
+
+
+def test_metrics_endpoint():
+    metrics = MetricsRegistry()
+    metrics.counter("x_total", "X")
+    server = MetricsServer(metrics, ("127.0.0.1", 0))
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        assert "l2r_x_total 0" in urllib.request.urlopen(url).read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
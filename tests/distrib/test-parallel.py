@@ -0,0 +1,36 @@
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from distrib_l2r.asynchron.parallel import AllReduceOptimizer
+from distrib_l2r.asynchron.parallel import broadcast_module
+
+
+def _replica(rank, world_size, init_method, results):
+    dist.init_process_group(
+        "gloo", init_method=init_method, rank=rank, world_size=world_size
+    )
+    torch.manual_seed(rank)
+    model = torch.nn.Linear(4, 2)
+    with torch.no_grad():
+        broadcast_module(model)
+    optimizer = AllReduceOptimizer(torch.optim.Adam(model.parameters(), lr=0.1))
+
+    # Every replica sees different data
+    for _ in range(3):
+        optimizer.zero_grad()
+        model(torch.randn(8, 4)).pow(2).mean().backward()
+        optimizer.step()
+
+    results[rank] = torch.cat([p.detach().reshape(-1) for p in model.parameters()])
+    dist.destroy_process_group()
+
+
+def test_replicas_stay_identical(tmp_path):
+    world_size = 2
+    results = mp.Manager().dict()
+    mp.spawn(
+        _replica,
+        args=(world_size, f"file://{tmp_path}/rendezvous", results),
+        nprocs=world_size,
+    )
+    assert torch.allclose(results[0], results[1])
@@ -0,0 +1,81 @@
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from distrib_l2r.api import BufferMsg
+from distrib_l2r.asynchron.learner import ThreadedTCPRequestHandler
+from distrib_l2r.asynchron.pool import BoundedThreadPoolMixIn
+from distrib_l2r.asynchron.pool import ByteBudget
+from distrib_l2r.utils import encode_frame
+
+
+def test_byte_budget():
+    budget = ByteBudget(max_bytes=100)
+    assert budget.try_acquire(60)
+    assert not budget.try_acquire(60)
+    budget.release(60)
+    # An oversized frame is admitted when nothing else is in flight
+    assert budget.try_acquire(500)
+    assert not budget.try_acquire(1)
+    budget.release(500)
+    assert budget.in_flight == 0
+
+
+class _EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(threading.current_thread().name.encode())
+
+
+class _PoolServer(BoundedThreadPoolMixIn, socketserver.TCPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _EchoHandler)
+        self.init_pool(handler_threads=2, max_pending_connections=8)
+
+
+def test_requests_run_on_bounded_pool():
+    server = _PoolServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        names = set()
+        for _ in range(10):
+            with socket.create_connection(server.server_address) as sock:
+                names.add(sock.recv(64).decode())
+        assert len(names) <= 2
+        assert all(name.startswith("handler") for name in names)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _Metrics:
+    def inc(self, name, value=1, **labels):
+        pass
+
+
+class _ClosedIngestServer:
+    """The parts of an AsyncLearningNode a handler uses, with its ingest pool shut
+    down, so that buffers cannot be handed off"""
+
+    policy_slot = None
+
+    def __init__(self):
+        self.byte_budget = ByteBudget(max_bytes=2**20)
+        self.metrics = _Metrics()
+        self.ingest_pool = ThreadPoolExecutor(max_workers=1)
+        self.ingest_pool.shutdown()
+
+    def ingest(self, frame, admitted=0):
+        self.byte_budget.release(admitted)
+
+
+def test_budget_released_when_buffer_is_not_handed_off():
+    server = _ClosedIngestServer()
+    worker, learner = socket.socketpair()
+    with worker, learner:
+        worker.sendall(encode_frame(BufferMsg(data=list(range(1000)))))
+        with pytest.raises(RuntimeError):
+            ThreadedTCPRequestHandler(learner, ("worker", 0), server)
+    assert server.byte_budget.in_flight == 0
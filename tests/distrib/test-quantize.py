@@ -0,0 +1,115 @@
+import pytest
+import torch
+from distrib_l2r.asynchron.learner import AsyncLearningNode
+from distrib_l2r.quantize import pack_policy
+from distrib_l2r.quantize import unpack_policy
+from src.agents.SACAgent import SACAgent
+
+
+def _learner(monkeypatch, policy_broadcast):
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    return AsyncLearningNode(
+        agent=agent,
+        server_address=("127.0.0.1", 0),
+        eval_every=1000,
+        policy_broadcast=policy_broadcast,
+    )
+
+
+def test_policy_broadcast_modes():
+    state_dict = {
+        "policy.net.0.weight": torch.randn(16, 8),
+        "policy.net.0.bias": torch.randn(16),
+        "speed_encoder.0.weight": torch.randn(8, 1),
+        "q1.regressor.0.weight": torch.randn(32, 8),
+    }
+    assert pack_policy(state_dict, "full") is state_dict
+
+    for mode, tol in (("fp32", 0), ("fp16", 1e-2), ("int8", 5e-2)):
+        policy = unpack_policy(pack_policy(state_dict, mode))
+        # Critics are never broadcast
+        assert set(policy) == {k for k in state_dict if not k.startswith("q1")}
+        for k, v in policy.items():
+            assert v.dtype == torch.float32
+            assert torch.allclose(
+                v, state_dict[k], atol=tol * state_dict[k].abs().max()
+            )
+
+
+def test_onnx_broadcast_exports_the_given_weights():
+    pytest.importorskip("onnxruntime")
+    from src.networks.critic import ActorCritic
+    from src.utils import onnx_backend
+
+    actor_critic = ActorCritic()
+    trained = ActorCritic().state_dict()
+    packed = pack_policy(trained, "onnx", actor_critic=actor_critic)
+    # Workers receive the export as it is
+    assert unpack_policy(packed) is packed and onnx_backend.is_export(packed)
+
+    expected = ActorCritic()
+    expected.load_state_dict(trained)
+    obs = torch.randn(4, 33)
+    policy = onnx_backend.OnnxPolicy.from_export(packed)
+    assert torch.allclose(
+        policy(obs, True), torch.as_tensor(expected.act(obs, True)), atol=1e-5
+    )
+    with pytest.raises(ValueError):
+        pack_policy(trained, "onnx")
+
+
+def test_learner_exports_once_per_version(monkeypatch):
+    pytest.importorskip("onnxruntime")
+    from src.utils import onnx_backend
+
+    exports = []
+    pack_export = onnx_backend.pack_export
+    monkeypatch.setattr(
+        onnx_backend,
+        "pack_export",
+        lambda *args: exports.append(1) or pack_export(*args),
+    )
+    learner = _learner(monkeypatch, "onnx")
+    try:
+        learner.update_agent()
+        replies = [learner.get_agent_dict()["policy"] for _ in range(3)]
+        assert len(exports) == 2
+        assert onnx_backend.is_export(replies[0])
+        assert all(reply is replies[0] for reply in replies)
+    finally:
+        learner.server_close()
+
+
+def test_replies_pair_versions_with_their_weights(monkeypatch):
+    learner = _learner(monkeypatch, "fp32")
+    key = "policy.mu_layer.bias"
+    replies = []
+    put = learner.agent_queue.put
+
+    def put_then_reply(item):
+        # A handler replying while update_agent is still publishing
+        put(item)
+        replies.append(learner.get_agent_dict())
+
+    monkeypatch.setattr(learner.agent_queue, "put", put_then_reply)
+    try:
+        for version in (2, 3):
+            with torch.no_grad():
+                learner.agent.actor_critic.state_dict()[key].fill_(version)
+            learner.update_agent()
+        replies.append(learner.get_agent_dict())
+
+        for reply in replies:
+            weights = unpack_policy(reply["policy"])
+            assert torch.all(weights[key] == reply["policy_id"])
+        assert replies[-1]["policy_id"] == 3
+    finally:
+        learner.server_close()
@@ -0,0 +1,128 @@
+import os
+import pytest
+import torch
+from distrib_l2r.shm import PolicySlot
+from distrib_l2r.shm import TransitionRing
+
+
+def test_ring_roundtrip():
+    ring = TransitionRing.create(f"test_ring_{os.getpid()}", 3, 2, capacity=4)
+    reader = TransitionRing.attach(ring.name)
+    transitions = [
+        {
+            "obs": torch.ones(3) * i,
+            "obs2": torch.ones(3) * (i + 1),
+            "act": torch.zeros(2),
+            "rew": float(i),
+            "done": i == 2,
+        }
+        for i in range(3)
+    ]
+    assert ring.push(transitions) == 3
+    # Does not fit until the reader catches up
+    assert ring.push(transitions) == 0
+
+    out = reader.pop()
+    assert len(out) == 3 and len(reader) == 0
+    assert torch.equal(out[1]["obs2"], torch.ones(3) * 2)
+    assert out[2]["rew"] == 2.0 and out[2]["done"]
+
+    # Wraps around the end of the ring
+    assert ring.push(transitions) == 3
+    assert [t["rew"] for t in reader.pop()] == [0.0, 1.0, 2.0]
+    reader.close()
+    ring.close()
+
+
+def test_policy_slot_versions():
+    state_dict = {"w": torch.randn(4, 3), "b": torch.randn(4)}
+    slot = PolicySlot.create(f"test_slot_{os.getpid()}", state_dict)
+    reader = PolicySlot.attach(slot.name, slot.layout)
+
+    slot.write(state_dict, version=7)
+    version, read = reader.read()
+    assert version == 7
+    assert all(torch.equal(read[k], state_dict[k]) for k in state_dict)
+    reader.close()
+    slot.close()
+
+
+def test_recreated_ring_has_a_new_nonce():
+    name = f"test_ring_{os.getpid()}"
+    ring = TransitionRing.create(name, 3, 2, capacity=4)
+    reader = TransitionRing.attach(name)
+    assert reader.nonce == ring.nonce
+    ring.close()
+
+    ring = TransitionRing.create(name, 3, 2, capacity=4)
+    recreated = TransitionRing.attach(name)
+    assert recreated.nonce != reader.nonce
+    recreated.close()
+    reader.close()
+    ring.close()
+
+
+def test_policy_slot_keeps_dtypes():
+    state_dict = {
+        "w": torch.randn(4, 3).half(),
+        "steps": torch.tensor(12345678901, dtype=torch.int64),
+        "mask": torch.tensor([True, False, True]),
+        "b": torch.randn(5, dtype=torch.float64),
+    }
+    slot = PolicySlot.create(f"test_slot_{os.getpid()}", state_dict)
+    reader = PolicySlot.attach(slot.name, slot.layout)
+
+    slot.write(state_dict, version=1)
+    _, read = reader.read()
+    for key, value in state_dict.items():
+        assert read[key].dtype == value.dtype and torch.equal(read[key], value)
+    reader.close()
+    slot.close()
+
+
+def test_stale_slot_is_replaced():
+    state_dict = {"w": torch.randn(4, 3)}
+    name = f"test_slot_{os.getpid()}"
+    stale = PolicySlot.create(name, {"w": torch.randn(2)})
+    # A learner that crashed leaves its segment behind
+    stale.owner = False
+
+    slot = PolicySlot.create(name, state_dict)
+    slot.write(state_dict, version=3)
+    reader = PolicySlot.attach(name, slot.layout)
+    version, read = reader.read()
+    assert version == 3 and torch.equal(read["w"], state_dict["w"])
+    reader.close()
+    stale.close()
+    slot.close()
+
+
+def test_learner_releases_shared_memory(monkeypatch):
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    from distrib_l2r.asynchron.learner import AsyncLearningNode
+    from distrib_l2r.shm import SharedRingRef
+    from src.agents.SACAgent import SACAgent
+
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    name = f"test_learner_slot_{os.getpid()}"
+    learner = AsyncLearningNode(
+        agent=agent, server_address=("127.0.0.1", 0), policy_slot_name=name
+    )
+    ring = TransitionRing.create(f"test_ring_{os.getpid()}", 33, 2, capacity=4)
+    learner.drain_ring(SharedRingRef(name=ring.name, count=0, nonce=ring.nonce))
+    attached = learner.rings[ring.name]
+
+    learner.server_close()
+    assert learner.policy_slot is None and not learner.rings
+    # The slot is unlinked, and the learner detached from the ring
+    with pytest.raises(FileNotFoundError):
+        PolicySlot.attach(name, [])
+    assert not hasattr(attached, "_rows")
+    ring.close()
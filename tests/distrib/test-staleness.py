@@ -0,0 +1,85 @@
+import collections
+from distrib_l2r.asynchron.staleness import PolicyLagTracker
+
+
+class FakeBuffer:
+    def __init__(self, n):
+        self.buffer = collections.deque(range(n))
+
+    def __len__(self):
+        return len(self.buffer)
+
+
+def test_lag_filtering():
+    tracker = PolicyLagTracker(max_lag=2, stale_policy="drop")
+    assert tracker.filter(FakeBuffer(10), data_version=5, version=6) is not None
+    assert tracker.filter(FakeBuffer(10), data_version=1, version=6) is None
+    # Unversioned buffers are always accepted
+    assert tracker.filter(FakeBuffer(10), data_version=None, version=6) is not None
+
+    summary = tracker.summary()
+    assert summary["policy_lag/max"] == 5
+    assert summary["policy_lag/p50"] == 1
+    assert summary["policy_lag/chunks_dropped"] == 1
+    assert summary["policy_lag/transitions_dropped"] == 10
+
+
+def test_lag_downweighting():
+    tracker = PolicyLagTracker(max_lag=2, stale_policy="downweight")
+    kept = tracker.filter(FakeBuffer(100), data_version=0, version=4)
+    assert len(kept) == 50
+    assert tracker.summary()["policy_lag/transitions_dropped"] == 50
+
+
+class CountingReplay:
+    def __init__(self):
+        self.stored = 0
+
+    def store(self, semibuffer):
+        self.stored += len(semibuffer)
+
+    def sample_batch(self):
+        return None
+
+    def __len__(self):
+        return self.stored
+
+
+def test_learner_skips_updates_for_dropped_buffers(monkeypatch):
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    from distrib_l2r.asynchron.learner import AsyncLearningNode
+    from src.agents.SACAgent import SACAgent
+
+    agent = SACAgent(
+        steps_to_sample_randomly=0,
+        gamma=0.99,
+        alpha=0.2,
+        polyak=0.995,
+        lr=0.003,
+        actor_critic_cfg_path="config_files/async_sac/network.yaml",
+    )
+    learner = AsyncLearningNode(
+        agent=agent,
+        update_steps=4,
+        epochs=1,
+        server_address=("127.0.0.1", 0),
+        max_policy_lag=2,
+        stale_policy="downweight",
+    )
+    try:
+        updates = []
+        learner.replay_buffer = CountingReplay()
+        monkeypatch.setattr(learner.agent, "update", lambda data: updates.append(1))
+        learner.agent_id = 6
+        # Fresh: a full epoch. Lag 4: half is kept. Lag 8: a quarter is kept.
+        for policy_id in (6, 3, 0):
+            learner.buffer_queue.put((policy_id, FakeBuffer(10)))
+            learner.learn()
+
+        assert learner.replay_buffer.stored == 10 + 5 + 2
+        # Gradient steps follow the transitions kept, and the last chunk earns none,
+        # so it does not publish a new version either
+        assert len(updates) == 4 + 2
+        assert learner.agent_id == 6 + 2
+    finally:
+        learner.server_close()
@@ -0,0 +1,42 @@
+import torch
+import torch.multiprocessing as mp
+from distrib_l2r.asynchron.trainer import SharedPolicy
+from distrib_l2r.asynchron.trainer import SharedReplayBuffer
+
+
+def _transitions(n):
+    return [
+        {
+            "obs": torch.ones(3) * i,
+            "obs2": torch.ones(3) * (i + 1),
+            "act": torch.zeros(2),
+            "rew": float(i),
+            "done": False,
+        }
+        for i in range(n)
+    ]
+
+
+def test_shared_buffer_wraps_and_samples():
+    buffer = SharedReplayBuffer(obs_dim=3, act_dim=2, size=4, batch_size=8)
+    buffer.store(_transitions(3))
+    buffer.store(_transitions(3))
+    assert len(buffer) == 4
+
+    batch = buffer.sample_batch()
+    assert batch["obs"].shape == (8, 3) and batch["rew"].shape == (8, 1)
+    assert torch.equal(batch["obs2"], batch["obs"] + 1)
+
+
+def _publish(policy):
+    policy.write({"w": torch.ones(2, 2)})
+
+
+def test_shared_policy_across_processes():
+    ctx = mp.get_context("spawn")
+    policy = SharedPolicy({"w": torch.zeros(2, 2)}, ctx=ctx)
+    process = ctx.Process(target=_publish, args=(policy,))
+    process.start()
+    process.join()
+    assert policy.version == 1
+    assert torch.equal(policy.read()["w"], torch.ones(2, 2))
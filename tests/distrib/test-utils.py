@@ -0,0 +1,87 @@
+import socket
+
+import torch
+from distrib_l2r.utils import MsgKind
+from distrib_l2r.utils import receive_frame
+from distrib_l2r.utils import send_data
+
+
+class VersionedMsg:
+    kind = MsgKind.BUFFER
+    policy_version = 12
+
+    def __init__(self, data):
+        self.data = data
+
+
+def test_frame_header_routes_without_decoding():
+    left, right = socket.socketpair()
+    with left, right:
+        send_data(VersionedMsg({"a": 1}), sock=left)
+        frame = receive_frame(right)
+        assert frame.kind == MsgKind.BUFFER
+        assert frame.policy_version == 12
+        assert frame.decode().data == {"a": 1}
+
+        send_data(b"raw bytes", sock=left)
+        frame = receive_frame(right)
+        assert frame.kind == MsgKind.OTHER
+        assert frame.policy_version is None
+        assert frame.decode() == b"raw bytes"
+
+
+def test_large_payloads_are_compressed():
+    import struct
+    from distrib_l2r import compression
+
+    floats = struct.pack(f">{50_000}f", *[i * 1e-3 for i in range(50_000)])
+    assert (
+        compression.byte_unshuffle(compression.byte_shuffle(floats[:-1])) == floats[:-1]
+    )
+
+    left, right = socket.socketpair()
+    with left, right:
+        send_data(floats, sock=left, accept=compression.available())
+        frame = receive_frame(right)
+        assert len(frame.payload) < len(floats)
+        assert frame.decode() == floats
+
+        # Small control messages and receivers that accept nothing skip it
+        send_data(b"small", sock=left)
+        assert receive_frame(right).codec & 0xF0 == 0
+        send_data(floats, sock=left, accept=1 << compression.Compression.NONE)
+        assert len(receive_frame(right).payload) == len(floats)
+
+
+def test_pickled_buffers_are_not_shuffled():
+    import pickle
+    from distrib_l2r import compression
+    from distrib_l2r.api import BufferMsg
+    from distrib_l2r.loadgen import make_buffer
+    from distrib_l2r.utils import FRAME_HEADER
+    from distrib_l2r.utils import SHUFFLED
+    from distrib_l2r.utils import encode_frame
+
+    buffer = make_buffer(500)
+    # Transitions collected from an env hold their own tensors
+    for transition in buffer.buffer:
+        for key in ("obs", "obs2", "act"):
+            transition[key] = transition[key].clone()
+    msg = BufferMsg(data=buffer)
+    unshuffled = compression.compress(
+        pickle.dumps(msg), compression.Compression.ZLIB, shuffle=False
+    )
+
+    frame = encode_frame(msg, compression="zlib", accept=compression.available())
+    codec = FRAME_HEADER.unpack_from(frame)[1]
+    assert not codec & SHUFFLED
+    assert len(frame) - FRAME_HEADER.size == len(unshuffled)
+
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(frame)
+        received = receive_frame(right).decode().data
+    assert len(received) == 500
+    assert all(
+        torch.equal(a["obs"], b["obs"]) for a, b in zip(received.buffer, buffer.buffer)
+    )
@@ -0,0 +1,72 @@
+import pytest
+import torch
+from src.networks.critic import ActorCritic
+from src.networks.critic import ConstraintActorCritic
+from src.networks.critic import EnsembleQfunction
+
+
+def test_ensemble_heads_match_q1_q2():
+    actor_critic = ActorCritic(
+        critic_cfg={"name": "EnsembleQfunction", "config": {"state_dim": 32}}
+    )
+    obs, act = torch.randn(5, 33), torch.rand(5, 2)
+
+    q = actor_critic.q_values(obs, act)
+    assert q.shape == (2, 5)
+    assert torch.allclose(actor_critic.q1(obs, act), q[0])
+    assert torch.allclose(actor_critic.q2(obs, act), q[1])
+    # Heads share the ensemble's parameters rather than owning copies
+    assert len(actor_critic.q_parameters()) == len(list(actor_critic.q.parameters()))
+    assert not any(k.startswith(("q1.", "q2.")) for k in actor_critic.state_dict())
+
+
+def test_ensemble_of_n_heads():
+    q = EnsembleQfunction(use_speed=False, ensemble_size=5)
+    assert q(torch.randn(7, 32), torch.rand(7, 2)).shape == (5, 7)
+    with pytest.raises(ValueError):
+        EnsembleQfunction(ensemble_size=1)
+
+
+def test_compiled_act_follows_loaded_weights():
+    actor_critic = ActorCritic()
+    act = actor_critic.compile_act()
+    obs = torch.randn(4, 33)
+
+    expected = actor_critic.act(obs, deterministic=True)
+    assert torch.allclose(act(obs, True), torch.as_tensor(expected), atol=1e-6)
+    assert act(obs, False).shape == (4, 2)
+
+    # Weights loaded after compiling are picked up without compiling again
+    actor_critic.load_state_dict(ActorCritic().state_dict())
+    expected = actor_critic.act(obs, deterministic=True)
+    assert torch.allclose(act(obs, True), torch.as_tensor(expected), atol=1e-6)
+
+
+def test_fused_step_packs_action_logp_and_values():
+    actor_critic = ConstraintActorCritic(
+        critic_cfg={"name": "Vfunction", "config": {"state_dim": 32}}
+    )
+    obs = torch.randn(4, 33)
+
+    packed = actor_critic.fused_step(obs, deterministic=True)
+    assert packed.shape == (4, 2 + 1 + 2)
+    with torch.no_grad():
+        assert torch.allclose(torch.as_tensor(packed[:, 3]), actor_critic.v(obs))
+        assert torch.allclose(torch.as_tensor(packed[:, 4]), actor_critic.c(obs))
+
+    a, v, c, logp_a = actor_critic.step(obs, deterministic=True)
+    assert a.shape == (4, 2) and v.shape == c.shape == logp_a.shape == (4,)
+
+
+def test_step_values_read_raw_observations():
+    actor_critic = ConstraintActorCritic(
+        critic_cfg={"name": "Vfunction", "config": {"state_dim": 32}}
+    )
+    obs = torch.randn(3, 33)
+
+    # The value and cost heads encode the speed themselves, so they get obs_feat
+    # rather than the policy's speed-encoded features
+    _, v, c, _ = actor_critic.step(obs)
+    with torch.no_grad():
+        assert torch.allclose(torch.as_tensor(v), actor_critic.v(obs), atol=1e-6)
+        assert torch.allclose(torch.as_tensor(c), actor_critic.c(obs), atol=1e-6)
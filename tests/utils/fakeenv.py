@@ -0,0 +1,34 @@
+from src.utils.fakeenv import METRIC_KEYS
+from src.utils.fakeenv import build_fake_env
+
+
+def test_fake_env_contract():
+    env = build_fake_env(
+        env_kwargs={"max_timesteps": 3},
+        camera_cfg=[{"name": "CameraFrontRGB", "Width": 512, "Height": 384}],
+        controller_kwargs={"quiet": True},
+        frame_mode="noise",
+    )
+    obs = env.reset(random_pos=False)
+    assert obs["images"]["CameraFrontRGB"].shape == (384, 512, 3)
+    assert obs["pose"].shape == (30,)
+
+    done, steps = False, 0
+    while not done:
+        obs, reward, done, info = env.step([0.0, 1.0])
+        steps += 1
+    assert steps == 3 and reward > 0
+    assert set(METRIC_KEYS) <= set(info["metrics"])
+
+
+def test_fake_env_from_environ(monkeypatch):
+    from src.utils.fakeenv import fake_env_from_environ
+
+    monkeypatch.delenv("L2R_FAKE_ENV", raising=False)
+    assert fake_env_from_environ() is None
+
+    monkeypatch.setenv("L2R_FAKE_ENV", "1")
+    monkeypatch.setenv("L2R_FAKE_ENV_FRAMES", "noise")
+    options = fake_env_from_environ()
+    assert options == {"step_latency": 0.0, "frame_mode": "noise"}
+    assert build_fake_env(**options).frame_mode == "noise"
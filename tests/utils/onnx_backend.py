@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import torch
+from src.encoders.vae import VAE
+from src.networks.critic import ActorCritic
+from src.utils import onnx_backend
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def test_onnx_policy_matches_torch():
+    actor_critic = ActorCritic()
+    policy = onnx_backend.OnnxPolicy.from_module(actor_critic)
+    obs = torch.randn(4, 33)
+
+    expected = actor_critic.act(obs, deterministic=True)
+    assert np.allclose(policy(obs, True).numpy(), expected, atol=1e-5)
+    assert policy(obs, False).shape == (4, 2)
+
+
+def test_onnx_encoder_latents():
+    vae = VAE()
+    encoder = onnx_backend.OnnxEncoder.from_module(vae)
+    image = np.random.randint(0, 256, (384, 512, 3), dtype=np.uint8)
+
+    assert encoder.encode(image).shape == (1, 32)
+    h = onnx_backend.crop_resize_center(image).unsqueeze(0).cpu()
+    mu, _ = encoder.session.run(None, {"image": h.numpy()})
+    with torch.no_grad():
+        expected = vae.fc1(vae.encoder(h))
+    assert np.allclose(mu, expected.numpy(), atol=1e-4)
+
+
+def test_onnx_agent_acts_from_export(monkeypatch):
+    actor_critic = ActorCritic()
+    packed = onnx_backend.pack_export(actor_critic)
+    agent = onnx_backend.OnnxAgent("config_files/async_sac/network.yaml")
+
+    # Exports are loaded as they are, without building torch networks
+    monkeypatch.setattr(onnx_backend, "export_policy", None)
+    agent.load_model(packed)
+    assert agent.actor_critic is None
+
+    obs = torch.randn(1, 33)
+    agent.deterministic = True
+    agent.t = 1
+    expected = actor_critic.act(obs, deterministic=True)
+    assert np.allclose(agent.select_action(obs).action, expected, atol=1e-5)
+
+
+def test_onnx_agent_exports_received_weights():
+    actor_critic = ActorCritic()
+    agent = onnx_backend.OnnxAgent("config_files/async_sac/network.yaml")
+    agent.load_model(actor_critic.state_dict())
+
+    obs = torch.randn(4, 33)
+    expected = actor_critic.act(obs, deterministic=True)
+    assert np.allclose(agent.act_module(obs, True).numpy(), expected, atol=1e-5)
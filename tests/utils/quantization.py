@@ -0,0 +1,25 @@
+import numpy as np
+import torch
+from src.encoders.vae import VAE
+from src.networks.critic import ActorCritic
+from src.utils import quantization
+
+
+def test_quantized_policy_close_to_float():
+    actor_critic = ActorCritic()
+    quantized = quantization.quantize_policy(actor_critic)
+    obs = torch.randn(64, 33)
+
+    error = quantization.policy_error(actor_critic, quantized, obs)
+    assert error["action_max_error"] < 0.1
+    assert quantized(obs, False).shape == (64, 2)
+
+
+def test_quantized_encoder_close_to_float():
+    vae = VAE()
+    frames = np.random.randint(0, 256, (16, 384, 512, 3), dtype=np.uint8)
+    encoder = quantization.QuantizedEncoder(vae, frames[:8])
+
+    assert encoder.encode(frames[8]).shape == (1, 32)
+    error = quantization.encoder_error(vae, encoder, frames[8:])
+    assert error["latent_cosine"] > 0.9
@@ -1,6 +1,11 @@
+import os
+import signal
 import socket
+import sys
 from distrib_l2r.asynchron.worker import AsnycWorker
+from distrib_l2r.launcher import StepCounters
 from src.config.yamlize import create_configurable
+from src.utils.fakeenv import fake_env_from_environ
 
 # from src.utils.envwrapper_aicrowd import EnvContainer
 from tianshou.policy import SACPolicy
@@ -12,11 +17,25 @@ import numpy as np
 import time
 
 
-learner_ip = socket.gethostbyname("learner-service")
-learner_address = (learner_ip, 4444)
-
-
 if __name__ == "__main__":
-    worker = AsnycWorker(learner_address=learner_address)
+    # Defaults match the Kubernetes service; the local launcher overrides them
+    learner_ip = socket.gethostbyname(
+        os.environ.get("L2R_LEARNER_HOST", "learner-service")
+    )
+    learner_address = (learner_ip, int(os.environ.get("L2R_LEARNER_PORT", 4444)))
+    if "L2R_TORCH_THREADS" in os.environ:
+        torch.set_num_threads(int(os.environ["L2R_TORCH_THREADS"]))
+
+    worker = AsnycWorker(
+        learner_address=learner_address,
+        step_counters=StepCounters.from_env(),
+        transport=os.environ.get("L2R_TRANSPORT", "tcp"),
+        central_inference=os.environ.get("L2R_CENTRAL_INFERENCE", "0") == "1",
+        # Benchmark without the simulator
+        fake_env=fake_env_from_environ(),
+    )
+    # The launcher stops workers with SIGTERM; exit normally so that the worker
+    # releases its shared memory
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     print("Worker inited!!!")
     worker.work()